@@ -0,0 +1,123 @@
+"""
+Micro-benchmark: предобработка predict_mask
+===========================================
+
+Сравнивает исходный путь (cvtColor → resize → astype → /255 → transpose →
+torch.tensor) с Preprocessor (предвыделенный тензор, нормализация в весах).
+Печатает время на кадр и объём выделенной памяти (tracemalloc) на вызов.
+
+Запуск:
+  python bench_preprocess.py --frame 640x480 --size 320 --iters 500
+  python bench_preprocess.py --weights ../../models/unet_safe_obstacle1.pth --full
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+import segmentation_models_pytorch as smp
+
+from inference import Preprocessor, fold_input_transform, predict_mask
+
+
+def legacy_preprocess(frame_bgr: np.ndarray, img_size: int, device: torch.device) -> torch.Tensor:
+    """Исходная предобработка из predict_mask"""
+    rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
+    inp = cv2.resize(rgb, (img_size, img_size), interpolation=cv2.INTER_AREA)
+    x = (inp.astype(np.float32) / 255.0).transpose(2, 0, 1)[None, ...]
+    return torch.tensor(x, device=device)
+
+
+def measure(fn, iters: int, warmup: int = 20):
+    """(мкс на вызов: p50, среднее), байт выделено за вызов"""
+    for _ in range(warmup):
+        fn()
+    times = np.empty(iters)
+    for i in range(iters):
+        t = time.perf_counter()
+        fn()
+        times[i] = time.perf_counter() - t
+
+    tracemalloc.start()
+    fn()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    n = 20
+    for _ in range(n):
+        fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return float(np.median(times)) * 1e6, float(times.mean()) * 1e6, (peak - before) / n
+
+
+def report(name: str, res, base=None):
+    p50, mean, alloc = res
+    line = f"{name:<28} p50 {p50:9.1f} us   mean {mean:9.1f} us   alloc/call {alloc / 1024:8.1f} KiB"
+    if base is not None:
+        line += f"   x{base[0] / max(p50, 1e-9):.2f}"
+    print(line)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--frame", default="640x480", help="размер синтетического кадра WxH")
+    ap.add_argument("--size", type=int, default=320, help="размер входа модели")
+    ap.add_argument("--iters", type=int, default=500)
+    ap.add_argument("--channels-last", action="store_true")
+    ap.add_argument("--full", action="store_true", help="также сравнить predict_mask целиком")
+    ap.add_argument("--weights", type=Path, default=None, help="веса модели (иначе случайные)")
+    args = ap.parse_args()
+
+    w, h = (int(v) for v in args.frame.lower().split("x"))
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+    print(f"device={device} frame={w}x{h} size={args.size} iters={args.iters}")
+
+    pre = Preprocessor(device, args.size, channels_last=args.channels_last)
+    pre_rgb = Preprocessor(device, args.size, folded=False, channels_last=args.channels_last)
+
+    def sync():
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+
+    base = measure(lambda: (legacy_preprocess(frame, args.size, device), sync()), args.iters)
+    report("legacy preprocess", base)
+    report("Preprocessor (folded)", measure(lambda: (pre(frame), sync()), args.iters), base)
+    report("Preprocessor (rgb, /255)", measure(lambda: (pre_rgb(frame), sync()), args.iters), base)
+
+    ref = legacy_preprocess(frame, args.size, device)
+    diff = (pre_rgb(frame) - ref).abs().max().item()
+    print(f"max |Preprocessor(rgb) - legacy| = {diff:.2e}")
+
+    if not args.full:
+        return
+
+    model = smp.Unet("resnet18", encoder_weights=None, in_channels=3, classes=2).to(device)
+    if args.weights is not None:
+        model.load_state_dict(torch.load(args.weights, map_location=device))
+    model.eval()
+    folded = fold_input_transform(copy.deepcopy(model))
+    if args.channels_last:
+        folded.to(memory_format=torch.channels_last)
+
+    iters = max(10, args.iters // 20)
+    base = measure(lambda: predict_mask(model, device, frame, args.size), iters, warmup=3)
+    report("predict_mask legacy", base)
+    report("predict_mask Preprocessor",
+           measure(lambda: predict_mask(folded, device, frame, args.size, pre=pre), iters, warmup=3), base)
+
+    m0 = predict_mask(model, device, frame, args.size)
+    m1 = predict_mask(folded, device, frame, args.size, pre=pre)
+    print(f"mask agreement: {np.mean(m0 == m1) * 100:.3f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
-
 """
 ESP32 MJPEG Cave AI Monitor with Autopilot - GUI Interface
 ===========================================================
 
 Графический интерфейс с tkinter для управления роботом через BLE
-с видеопотоком, сегментацией и автопилотом.
+с видеопотоком, сегментацией и автопилотом. Сам конвейер (поток, модель,
+автопилот, BLE) живёт в cave_pipeline.CavePipeline; без экрана его
+запускает cave_headless.py.
 
 Требования:
   pip install bleak opencv-python numpy torch segmentation-models-pytorch pillow
@@ -12,214 +13,16 @@ ESP32 MJPEG Cave AI Monitor with Autopilot - GUI Interface
 
 from __future__ import annotations
 
-import time
-import threading
-import queue
-from dataclasses import dataclass
-from pathlib import Path
-from typing import Tuple, Optional
 import tkinter as tk
 from tkinter import ttk, messagebox
 from PIL import Image, ImageTk
 
-import cv2
-import numpy as np
-import torch
-import segmentation_models_pytorch as smp
-
-import asyncio
-import sys
-from bleak import BleakClient, BleakScanner
-
-# ═══════════════════════════════════════════════════════════════════════════
-#   КОНФИГУРАЦИЯ
-# ═══════════════════════════════════════════════════════════════════════════
-
-STREAM_URL = "/stream"
-HUB_NAME = "Pybricks Hub"
-PYBRICKS_CHAR_UUID = "CHAR UUID"
-MODEL_PATH = Path(r"\mars_cave_ai\models\unet_safe_obstacle1.pth")
-IMG_SIZE = 320
-INFER_EVERY_N_FRAMES = 2
-ALPHA = 0.35
-
-# Команды 
-CMD_FWD = b"rev"
-CMD_REV = b"fwd"
-CMD_STOP = b"stp"
-CMD_LEFT = b"lft"
-CMD_RIGHT = b"rgt"
-CMD_CENTER = b"ctr"
-CMD_BYE = b"bye"
-
-# Автопилот
-ROI_Y1 = 0.55
-ROI_Y2 = 0.95
-CENTER_CLEAR_MAX_OBS = 0.20
-STOP_IF_ALL_BAD = 0.60
-TURN_HOLD_SEC = 0.35
-AUTO_DRIVE_INTERVAL = 0.22
-AUTO_STEER_INTERVAL = 0.28
-MANUAL_OVERRIDE_SEC = 1.0
-
-
-# ═══════════════════════════════════════════════════════════════════════════
-#   BLE КОНТРОЛЛЕР
-# ═══════════════════════════════════════════════════════════════════════════
-
-@dataclass
-class HubStatus:
-    connected: bool = False
-    last_reply: bytes = b""
-    last_ready_ts: float = 0.0
-    last_send_ts: float = 0.0
-    err: str = ""
-
-
-class SpikeBLEController:
-    def __init__(self, hub_name: str):
-        self.hub_name = hub_name
-        self.status = HubStatus()
-        self._cmd_q: queue.Queue[bytes] = queue.Queue()
-        self._stop = threading.Event()
-        self._ready_event: Optional[asyncio.Event] = None
-        self._thread = threading.Thread(target=self._run_thread, daemon=True)
-
-    def start(self):
-        self._thread.start()
-
-    def stop(self):
-        self._stop.set()
-        try:
-            self._cmd_q.put_nowait(CMD_BYE)
-        except Exception:
-            pass
-
-    def send(self, cmd3: bytes):
-        if not isinstance(cmd3, (bytes, bytearray)) or len(cmd3) != 3:
-            return
-        self._cmd_q.put(cmd3)
-
-    def _handle_rx(self, _, data: bytearray):
-        if not data:
-            return
-        if data[0] == 0x01:
-            payload = bytes(data[1:])
-            if payload == b"rdy":
-                self.status.last_ready_ts = time.time()
-                if self._ready_event is not None:
-                    self._ready_event.set()
-            else:
-                self.status.last_reply = payload
-
-    async def _ble_loop(self):
-        if sys.platform.startswith("win"):
-            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-
-        self._ready_event = asyncio.Event()
-
-        while not self._stop.is_set():
-            try:
-                self.status.err = ""
-                self.status.connected = False
-
-                dev = await BleakScanner.find_device_by_name(self.hub_name, timeout=12.0)
-                if dev is None:
-                    self.status.err = "Hub not found"
-                    await asyncio.sleep(1.0)
-                    continue
-
-                async with BleakClient(dev) as client:
-                    self.status.connected = True
-                    await client.start_notify(PYBRICKS_CHAR_UUID, self._handle_rx)
-
-                    while not self._stop.is_set() and client.is_connected:
-                        try:
-                            cmd = self._cmd_q.get(timeout=0.2)
-                        except queue.Empty:
-                            continue
-
-                        try:
-                            await asyncio.wait_for(self._ready_event.wait(), timeout=2.5)
-                        except asyncio.TimeoutError:
-                            self.status.err = "No 'rdy' from hub"
-                            self._ready_event.clear()
-                            continue
-
-                        self._ready_event.clear()
-
-                        try:
-                            await client.write_gatt_char(
-                                PYBRICKS_CHAR_UUID,
-                                b"\x06" + cmd,
-                                response=True
-                            )
-                            self.status.last_send_ts = time.time()
-                        except Exception as e:
-                            self.status.err = f"Send error: {type(e).__name__}"
-                            break
-
-                    try:
-                        await client.stop_notify(PYBRICKS_CHAR_UUID)
-                    except Exception:
-                        pass
-
-            except Exception as e:
-                self.status.err = f"BLE error: {type(e).__name__}"
-                await asyncio.sleep(1.0)
-
-    def _run_thread(self):
-        asyncio.run(self._ble_loop())
-
-
-# ═══════════════════════════════════════════════════════════════════════════
-#   МОДЕЛЬ СЕГМЕНТАЦИИ
-# ═══════════════════════════════════════════════════════════════════════════
-
-def load_model(model_path: Path):
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = smp.Unet("resnet18", encoder_weights=None, in_channels=3, classes=2).to(device)
-    model.load_state_dict(torch.load(model_path, map_location=device))
-    model.eval()
-    return model, device
-
-
-@torch.no_grad()
-def predict_mask(model, device, frame_bgr: np.ndarray, img_size: int) -> np.ndarray:
-    h, w = frame_bgr.shape[:2]
-    rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
-    inp = cv2.resize(rgb, (img_size, img_size), interpolation=cv2.INTER_AREA)
-    x = (inp.astype(np.float32) / 255.0).transpose(2, 0, 1)[None, ...]
-    x = torch.tensor(x, device=device)
-    logits = model(x)
-    pred = torch.argmax(logits, dim=1).detach().cpu().numpy()[0].astype(np.uint8)
-    return cv2.resize(pred, (w, h), interpolation=cv2.INTER_NEAREST)
-
-
-def zone_ratios(mask01: np.ndarray):
-    h, w = mask01.shape[:2]
-    y1 = int(h * ROI_Y1)
-    y2 = int(h * ROI_Y2)
-    roi = mask01[y1:y2, :]
-    third = w // 3
-    L = roi[:, :third]
-    C = roi[:, third:2 * third]
-    R = roi[:, 2 * third:]
-    oL = float(np.mean(L == 1))
-    oC = float(np.mean(C == 1))
-    oR = float(np.mean(R == 1))
-    return oL, oC, oR, (y1, y2)
-
-
-def autopilot(oL, oC, oR):
-    if min(oL, oC, oR) > STOP_IF_ALL_BAD:
-        return CMD_STOP, CMD_CENTER
-    if oC <= CENTER_CLEAR_MAX_OBS:
-        return CMD_FWD, CMD_CENTER
-    if oL < oR:
-        return CMD_FWD, CMD_LEFT
-    else:
-        return CMD_FWD, CMD_RIGHT
+from cave_config import (
+    ALPHA, CMD_CENTER, CMD_FWD, CMD_LEFT, CMD_REV, CMD_RIGHT, CMD_STOP, DISPLAY_SIZE,
+    LATENCY_BUDGET_MS, ROI_Y1, ROI_Y2, UI_REFRESH_MS, ZONE_GRID,
+)
+from cave_pipeline import CavePipeline
+from overlay import OverlayRenderer
 
 
 # ═══════════════════════════════════════════════════════════════════════════
@@ -230,29 +33,21 @@ class CaveAIApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Cave AI Monitor - Autopilot Control")
-        self.root.geometry("1400x900")
+        self.root.geometry("1400x940")
         self.root.configure(bg="#1a1a1a")
 
-        # Состояние
-        self.auto_on = False
+        # Конвейер; кадры для отображения публикуются с периодом UI
+        self.pipeline = CavePipeline(display_interval=UI_REFRESH_MS / 1000.0)
         self.running = True
-        self.last_mask = None
-        self.frame_id = 0
-        self.fps = 0.0
-        self.safe_ratio = 0.0
-        self.obst_ratio = 0.0
-        self.oL = self.oC = self.oR = 0.0
-
-        # Таймеры автопилота
-        self.last_drive_ts = 0.0
-        self.last_steer_ts = 0.0
-        self.last_turn_ts = 0.0
-        self.last_manual_ts = 0.0
+        self.shown_id = -1
+        self._ui_cache = {}
+        self.renderer = OverlayRenderer(ALPHA, (ROI_Y1, ROI_Y2), ZONE_GRID)
 
         # Инициализация
         self.setup_ui()
-        self.load_resources()
-        self.start_threads()
+        if not self.load_resources():
+            return
+        self.pipeline.start()
 
         # Привязка клавиш
         self.root.bind('<KeyPress>', self.on_key_press)
@@ -354,7 +149,11 @@ class CaveAIApp:
             bg="#2a2a2a"
         ).pack(pady=5)
 
-        self.video_label = tk.Label(left_panel, bg="#000000")
+        # PhotoImage создаются один раз; новые кадры вставляются через paste()
+        self.video_photo = ImageTk.PhotoImage("RGB", DISPLAY_SIZE)
+        self.seg_photo = ImageTk.PhotoImage("RGB", DISPLAY_SIZE)
+
+        self.video_label = tk.Label(left_panel, bg="#000000", image=self.video_photo)
         self.video_label.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
         # Правое видео - сегментация
@@ -369,14 +168,14 @@ class CaveAIApp:
             bg="#2a2a2a"
         ).pack(pady=5)
 
-        self.seg_label = tk.Label(right_panel, bg="#000000")
+        self.seg_label = tk.Label(right_panel, bg="#000000", image=self.seg_photo)
         self.seg_label.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
         # ═══════════════════════════════════════════════════════════════════
         # НИЖНЯЯ ПАНЕЛЬ - МЕТРИКИ И УПРАВЛЕНИЕ
         # ═══════════════════════════════════════════════════════════════════
 
-        bottom_frame = tk.Frame(self.root, bg="#2a2a2a", height=200)
+        bottom_frame = tk.Frame(self.root, bg="#2a2a2a", height=300)
         bottom_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=10)
         bottom_frame.pack_propagate(False)
 
@@ -397,8 +196,8 @@ class CaveAIApp:
             font=("Courier", 11),
             bg="#1a1a1a",
             fg="#00ff00",
-            height=8,
-            width=50,
+            height=15,
+            width=70,
             relief=tk.FLAT,
             state=tk.DISABLED
         )
@@ -436,189 +235,119 @@ class CaveAIApp:
             justify=tk.LEFT
         ).pack(anchor=tk.W, padx=10)
 
-    def load_resources(self):
-        """Загрузка модели и инициализация BLE"""
-        if not MODEL_PATH.exists():
-            messagebox.showerror("Error", f"Model not found:\n{MODEL_PATH}")
+    def load_resources(self) -> bool:
+        """Инициализация BLE; модель грузится в фоне — окно и видео появляются сразу"""
+        try:
+            self.pipeline.load(background=True)
+        except FileNotFoundError as e:
+            messagebox.showerror("Error", str(e))
             self.root.quit()
-            return
-
-        self.model, self.device = load_model(MODEL_PATH)
-        self.ble = SpikeBLEController(HUB_NAME)
-        self.ble.start()
-
-    def start_threads(self):
-        """Запуск фоновых потоков"""
-        # Поток видео
-        self.video_thread = threading.Thread(target=self.video_loop, daemon=True)
-        self.video_thread.start()
-
-        # Поток автопилота
-        self.auto_thread = threading.Thread(target=self.autopilot_loop, daemon=True)
-        self.auto_thread.start()
-
-    def video_loop(self):
-        """Фоновый поток захвата видео"""
-        cap = cv2.VideoCapture(STREAM_URL)
-        t0 = time.time()
-        nframes = 0
-
-        while self.running:
-            ret, frame = cap.read()
-            if not ret or frame is None:
-                time.sleep(0.1)
-                continue
-
-            self.frame_id += 1
-            nframes += 1
-            self.fps = nframes / max(1e-6, (time.time() - t0))
-
-            # Инференс
-            if self.frame_id % INFER_EVERY_N_FRAMES == 0:
-                try:
-                    self.last_mask = predict_mask(self.model, self.device, frame, IMG_SIZE)
-                except Exception:
-                    self.last_mask = None
-
-            # Обработка маски
-            if self.last_mask is not None:
-                mask = self.last_mask
-                self.safe_ratio = float(np.mean(mask == 0))
-                self.obst_ratio = 1.0 - self.safe_ratio
-                self.oL, self.oC, self.oR, roi_y = zone_ratios(mask)
-
-                # Сегментация с оверлеем
-                overlay = frame.copy()
-                overlay[mask == 0] = (0, 255, 0)
-                overlay[mask == 1] = (0, 0, 255)
-                seg = cv2.addWeighted(frame, 1 - ALPHA, overlay, ALPHA, 0)
-
-                # Рисуем ROI линии
-                h, w = frame.shape[:2]
-                y1, y2 = roi_y
-                cv2.line(seg, (0, y1), (w, y1), (255, 255, 255), 2)
-                cv2.line(seg, (0, y2), (w, y2), (255, 255, 255), 2)
-                t1 = w // 3
-                t2 = 2 * w // 3
-                cv2.line(seg, (t1, y1), (t1, y2), (255, 255, 255), 2)
-                cv2.line(seg, (t2, y1), (t2, y2), (255, 255, 255), 2)
-            else:
-                seg = frame.copy()
-
-            # Конвертация для tkinter
-            self.current_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            self.current_seg = cv2.cvtColor(seg, cv2.COLOR_BGR2RGB)
-
-        cap.release()
-
-    def autopilot_loop(self):
-        """Фоновый поток автопилота"""
-        while self.running:
-            time.sleep(0.05)
-
-            if not self.auto_on or not self.ble.status.connected or self.last_mask is None:
-                continue
-
-            now = time.time()
-            if (now - self.last_manual_ts) < MANUAL_OVERRIDE_SEC:
-                continue
-
-            # Решение автопилота
-            drive_cmd, steer_cmd = autopilot(self.oL, self.oC, self.oR)
-
-            # Рулежка
-            if steer_cmd in (CMD_LEFT, CMD_RIGHT):
-                if now - self.last_steer_ts >= AUTO_STEER_INTERVAL:
-                    self.ble.send(steer_cmd)
-                    self.last_steer_ts = now
-                    self.last_turn_ts = now
-            else:
-                if (now - self.last_turn_ts) > TURN_HOLD_SEC and (now - self.last_steer_ts) >= AUTO_STEER_INTERVAL:
-                    self.ble.send(CMD_CENTER)
-                    self.last_steer_ts = now
-
-            # Привод
-            if now - self.last_drive_ts >= AUTO_DRIVE_INTERVAL:
-                self.ble.send(drive_cmd)
-                self.last_drive_ts = now
+            return False
+        return True
 
     def update_ui(self):
         """Обновление UI (главный поток)"""
         if not self.running:
             return
+        p = self.pipeline
 
         # Обновление статуса
-        if self.ble.status.connected:
-            self.status_label.config(text="🟢 Connected", fg="#44ff44")
+        if p.ble.status.connected:
+            self.set_widget(self.status_label, text="🟢 Connected", fg="#44ff44")
         else:
-            self.status_label.config(text="🔴 Disconnected", fg="#ff4444")
+            self.set_widget(self.status_label, text="🔴 Disconnected", fg="#ff4444")
 
-        mode = "AUTO" if self.auto_on else "MANUAL"
-        self.mode_label.config(text=f"MODE: {mode}")
+        mode = "AUTO" if p.auto_on else "MANUAL"
+        self.set_widget(self.mode_label, text=f"MODE: {mode}")
 
-        if self.ble.status.err:
-            self.error_label.config(text=f"Error: {self.ble.status.err}")
+        if p.load_error:
+            self.set_widget(self.error_label, text=f"Model error: {p.load_error}")
+        elif p.ble.status.err:
+            self.set_widget(self.error_label, text=f"Error: {p.ble.status.err}")
         else:
-            self.error_label.config(text="")
+            self.set_widget(self.error_label, text="")
 
         # Обновление кнопки ARM
-        if self.auto_on:
-            self.arm_button.config(text="DISARM AUTO", bg="#22aa22")
+        if p.auto_on:
+            self.set_widget(self.arm_button, text="DISARM AUTO", bg="#22aa22")
         else:
-            self.arm_button.config(text="ARM AUTO", bg="#4a4a4a")
+            self.set_widget(self.arm_button, text="ARM AUTO", bg="#4a4a4a")
 
-        # Обновление видео
-        if hasattr(self, 'current_frame'):
+        # Обновление видео: только если пришёл новый кадр; оверлей строится
+        # здесь, сразу в размере отображения, и вставляется в те же PhotoImage
+        display = p.display
+        if display is not None and display[0] != self.shown_id:
             try:
-                # Оригинальное видео
-                img = Image.fromarray(self.current_frame)
-                img = img.resize((640, 480), Image.Resampling.LANCZOS)
-                photo = ImageTk.PhotoImage(img)
-                self.video_label.config(image=photo)
-                self.video_label.image = photo
-
-                # Сегментация
-                seg_img = Image.fromarray(self.current_seg)
-                seg_img = seg_img.resize((640, 480), Image.Resampling.LANCZOS)
-                seg_photo = ImageTk.PhotoImage(seg_img)
-                self.seg_label.config(image=seg_photo)
-                self.seg_label.image = seg_photo
+                frame_id, frame, result = display
+                mask = result.mask if result is not None else None
+                current_frame, current_seg = self.renderer.render(frame, mask, DISPLAY_SIZE)
+                self.video_photo.paste(Image.fromarray(current_frame))
+                self.seg_photo.paste(Image.fromarray(current_seg))
+                self.shown_id = frame_id
             except Exception:
                 pass
 
         # Обновление метрик
+        slot_stats = p.frame_slot.stats
+        sched = p.scheduler
+        zones = p.zones.latest()
+        reasons = " ".join(f"{k}:{v}" for k, v in sorted(sched.stats.reasons.items()))
+        if p.controller is not None:
+            ctl = p.controller
+            op = (f"{str(ctl.point):>6}   p{ctl.percentile:.0f} {ctl.latency_pct() * 1000:.0f}"
+                  f" / {LATENCY_BUDGET_MS:.0f} ms   switches {ctl.switches}")
+        else:
+            op = f"{p.operating_point()} (fixed)"
+        if p.model_ready.is_set():
+            model = f"{p.model.name} on {p.device}   load {p.load_s:.1f}s warmup {p.warmup_s:.1f}s"
+        else:
+            model = p.model_state
         metrics = f"""
-FPS:           {self.fps:6.1f}
-SAFE:          {self.safe_ratio * 100:6.1f}%
-OBSTACLES:     {self.obst_ratio * 100:6.1f}%
+MODEL:         {model}
+FPS:           {p.fps:6.1f}
+FRAME AGE:     {p.frame_age_ms:6.0f} ms
+DROPPED:       {slot_stats.dropped:6d} / {slot_stats.produced}
+RECONNECTS:    {p.stream.stats.reconnects if p.stream else 0:6d}
+INFER SKIP:    {sched.stats.skip_rate * 100:6.1f}%   {reasons}
+MASK AGE:      {sched.mask_age() * 1000:6.0f} ms   motion {sched.last_motion:.1f}
+OPERATING PT:  {op}
+SAFE:          {zones.safe_ratio * 100:6.1f}%
+OBSTACLES:     {zones.obst_ratio * 100:6.1f}%
 
 ZONES (Obstacle %):
-  Left:        {self.oL * 100:6.1f}%
-  Center:      {self.oC * 100:6.1f}%
-  Right:       {self.oR * 100:6.1f}%
+  Left:        {zones.oL * 100:6.1f}%
+  Center:      {zones.oC * 100:6.1f}%
+  Right:       {zones.oR * 100:6.1f}%
         """
-
-        self.metrics_text.config(state=tk.NORMAL)
-        self.metrics_text.delete(1.0, tk.END)
-        self.metrics_text.insert(1.0, metrics.strip())
-        self.metrics_text.config(state=tk.DISABLED)
+        result = p.last_result
+        if result is not None and result.zones is not None:
+            metrics = metrics.rstrip() + f"\n  Grid cost:   {result.zone_cost * 100:6.1f}%"
+
+        metrics = metrics.strip()
+        if metrics != self._ui_cache.get("metrics"):
+            self._ui_cache["metrics"] = metrics
+            self.metrics_text.config(state=tk.NORMAL)
+            self.metrics_text.delete(1.0, tk.END)
+            self.metrics_text.insert(1.0, metrics)
+            self.metrics_text.config(state=tk.DISABLED)
 
         # Следующий кадр
-        self.root.after(50, self.update_ui)
+        self.root.after(UI_REFRESH_MS, self.update_ui)
+
+    def set_widget(self, widget, **options):
+        """config() виджета только при изменении значений"""
+        key = str(widget)
+        if self._ui_cache.get(key) != options:
+            self._ui_cache[key] = options
+            widget.config(**options)
 
     def toggle_auto(self):
         """Переключение автопилота"""
-        self.auto_on = not self.auto_on
-        if not self.auto_on:
-            self.ble.send(CMD_STOP)
-            self.ble.send(CMD_CENTER)
+        self.pipeline.toggle_auto()
 
     def emergency_stop(self):
         """Экстренная остановка"""
-        self.auto_on = False
-        self.ble.send(CMD_STOP)
-        self.ble.send(CMD_CENTER)
-        self.last_manual_ts = time.time()
+        self.pipeline.emergency_stop()
 
     def on_key_press(self, event):
         """Обработка нажатий клавиш"""
@@ -628,28 +357,22 @@ ZONES (Obstacle %):
             self.toggle_auto()
 
         elif key == 'w':
-            self.last_manual_ts = time.time()
-            self.ble.send(CMD_FWD)
+            self.pipeline.manual(CMD_FWD)
 
         elif key == 's':
-            self.last_manual_ts = time.time()
-            self.ble.send(CMD_REV)
+            self.pipeline.manual(CMD_REV)
 
         elif key == 'a':
-            self.last_manual_ts = time.time()
-            self.ble.send(CMD_LEFT)
+            self.pipeline.manual(CMD_LEFT)
 
         elif key == 'd':
-            self.last_manual_ts = time.time()
-            self.ble.send(CMD_RIGHT)
+            self.pipeline.manual(CMD_RIGHT)
 
         elif key == 'e':
-            self.last_manual_ts = time.time()
-            self.ble.send(CMD_CENTER)
+            self.pipeline.manual(CMD_CENTER)
 
         elif key == ' ':
-            self.last_manual_ts = time.time()
-            self.ble.send(CMD_STOP)
+            self.pipeline.manual(CMD_STOP)
 
         elif key in ('q', '\x1b'):  # Q или ESC
             self.on_closing()
@@ -657,9 +380,7 @@ ZONES (Obstacle %):
     def on_closing(self):
         """Закрытие приложения"""
         self.running = False
-        self.ble.send(CMD_BYE)
-        time.sleep(0.5)
-        self.ble.stop()
+        self.pipeline.stop()
         self.root.quit()
         self.root.destroy()
 
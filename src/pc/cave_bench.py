@@ -0,0 +1,406 @@
+"""
+Cave Bench - задержки по стадиям конвейера
+==========================================
+
+Офлайн на CPU, без камеры и хаба. Стадии:
+  decode      JPEG → BGR (полный кадр и DCT-уменьшение под вход модели)
+  preprocess  Preprocessor (resize в предвыделенный тензор)
+  infer       analyze() для каждого бэкенда и размера входа
+  postprocess argmax + доли зон на устройстве, full_mask (resize маски)
+  zones       zone_ratios по полноразмерной маске
+  overlay     OverlayRenderer.render в размер окна
+  ui_image    путь update_ui: render → Image.fromarray (→ PhotoImage.paste при наличии Tk)
+  ble_rtt     SpikeBLEController: send() → "rdy" от имитации хаба (sim_hub)
+  ble_pipe    конвейер: пачка из --ble-burst команд до последнего "ak" на
+              кадры 0x82, время и пропускная способность — на одну команду
+
+Для каждой стадии — p50/p95/p99, среднее (мс) и пропускная способность
+(операций/с); вызовы, вернувшие False (например, ответ хаба не пришёл),
+в перцентили не входят и считаются в failed. Кадры: синтетические (--frame-size, по умолчанию QVGA
+320×240, как поток src/esp/stream.ino), из папки (--frames) или из лога
+миссии (--log). Результаты сохраняются в JSON (--out) и сравниваются
+с прошлым прогоном (--compare): рост p50 больше --threshold — регрессия,
+код выхода 1.
+
+Запуск:
+  python cave_bench.py --out bench.json
+  python cave_bench.py --weights ../../models/unet_safe_obstacle1.pth --backends eager onnx int8-static \\
+      --sizes 192 256 320 --log missions/mission_20250101_120000.cavelog
+  python cave_bench.py --compare bench.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+import torch
+
+from cave_config import ALPHA, BLE_PIPELINE_WINDOW, CMD_CENTER, CMD_STOP, DISPLAY_SIZE, ROI_Y1, ROI_Y2
+from frame_source import decode_jpeg
+from inference import BACKENDS, InferenceBackend, load_backend, postprocess
+from overlay import OverlayRenderer
+from spike_protocol import SEQ_ACK
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+# Кадр ESP32-CAM: FRAMESIZE_QVGA в src/esp/stream.ino
+STREAM_FRAME_SIZE = (320, 240)
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   ИЗМЕРЕНИЯ
+# ═══════════════════════════════════════════════════════════════════════════
+
+@dataclass
+class StageResult:
+    name: str
+    n: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    mean_ms: float
+    throughput: float   # операций/с
+    failed: int = 0     # вызовы без результата (NaN в выборке), не вошли в статистику
+
+    @classmethod
+    def from_samples(cls, name: str, samples_ms: np.ndarray) -> "StageResult":
+        ok = samples_ms[~np.isnan(samples_ms)]
+        failed = int(samples_ms.size - ok.size)
+        if not ok.size:
+            nan = float("nan")
+            return cls(name, 0, nan, nan, nan, nan, 0.0, failed)
+        p50, p95, p99 = np.percentile(ok, (50, 95, 99))
+        mean = float(ok.mean())
+        return cls(name, int(ok.size), float(p50), float(p95), float(p99), mean,
+                   1000.0 / mean if mean > 0 else float("inf"), failed)
+
+    def line(self) -> str:
+        return (f"{self.name:<34} p50 {self.p50_ms:9.3f}  p95 {self.p95_ms:9.3f}  p99 {self.p99_ms:9.3f} ms"
+                f"  {self.throughput:10.1f} /s" + (f"  failed {self.failed}/{self.n + self.failed}" if self.failed else ""))
+
+
+def sample(fn: Callable[[int], object], iters: int, warmup: int) -> np.ndarray:
+    """
+    Время вызовов fn(i) в мс; i — номер итерации (для перебора кадров).
+    fn вернул False — вызов не удался, в выборке NaN
+    """
+    for i in range(warmup):
+        fn(i)
+    out = np.empty(iters)
+    for i in range(iters):
+        t = time.perf_counter()
+        ok = fn(i)
+        out[i] = np.nan if ok is False else (time.perf_counter() - t) * 1000.0
+    return out
+
+
+class Suite:
+    def __init__(self, iters: int, warmup: int):
+        self.iters = iters
+        self.warmup = warmup
+        self.results: Dict[str, StageResult] = {}
+
+    def run(self, name: str, fn: Callable[[int], object], iters: Optional[int] = None,
+            warmup: Optional[int] = None, ops: int = 1) -> StageResult:
+        """ops — операций за вызов fn: время делится на них (пачки команд)"""
+        res = StageResult.from_samples(name, sample(fn, iters or self.iters,
+                                                    self.warmup if warmup is None else warmup) / ops)
+        self.results[name] = res
+        print(res.line(), flush=True)
+        return res
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   КАДРЫ
+# ═══════════════════════════════════════════════════════════════════════════
+
+def synthetic_jpegs(count: int, size=STREAM_FRAME_SIZE, seed: int = 0) -> List[bytes]:
+    """Сглаженный шум с «полом» внизу кадра, JPEG quality 80 как у ESP32-CAM"""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    out = []
+    for _ in range(count):
+        small = rng.integers(0, 256, (h // 32, w // 32, 3), dtype=np.uint8)
+        img = cv2.resize(small, (w, h), interpolation=cv2.INTER_CUBIC)
+        img[int(h * 0.6):] //= 2
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        out.append(buf.tobytes())
+    return out
+
+
+def load_jpegs(frames_dir: Optional[Path], log: Optional[Path], count: int,
+               size=STREAM_FRAME_SIZE) -> List[bytes]:
+    if log is not None:
+        from mission_log import MissionLog
+        with MissionLog(log) as ml:
+            jpegs = [bytes(data) for _, _, data in ml.frames()]
+        if jpegs:
+            step = max(1, len(jpegs) // count)
+            return jpegs[::step][:count]
+        print(f"[warn] no frames in {log}, using synthetic frames")
+    if frames_dir is not None:
+        paths = sorted(p for p in frames_dir.iterdir() if p.suffix.lower() in IMAGE_EXTS)[:count]
+        jpegs = []
+        for p in paths:
+            img = cv2.imread(str(p))
+            if img is not None:
+                jpegs.append(cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes())
+        if jpegs:
+            return jpegs
+        print(f"[warn] no images in {frames_dir}, using synthetic frames")
+    return synthetic_jpegs(count, size)
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   BLE НА ИМИТАЦИИ ХАБА
+# ═══════════════════════════════════════════════════════════════════════════
+
+def bench_ble(suite: Suite, iters: int, reply_delay: float, pipeline_window: int = 0, burst: int = 16,
+              reply_timeout: float = 2.0):
+    """
+    Без конвейера — круговая задержка одной команды до "rdy". С конвейером —
+    пачка из burst команд stp (вне очереди, ящик их не схлопывает) до
+    подтверждения последней: в пути до pipeline_window кадров. Итерация
+    без ответа за reply_timeout не замеряется, а считается в failed
+    """
+    from sim_hub import LinkProfile, SimulatedHub
+    from spike_ble import SpikeBLEController
+
+    # reply_delay — круговая задержка: по половине в каждую сторону канала
+    hub = SimulatedHub(LinkProfile(latency=reply_delay / 2.0, jitter=0.0, connect_delay=0.0))
+    stage = "ble_pipe" if pipeline_window else "ble_rtt"
+    # Ответы, завершающие команду: "rdy" или подтверждение кадра 0x82
+    done = threading.Condition()
+    replies = [0]
+
+    def observer(direction: str, payload: bytes, ts: float):
+        if direction == "rx" and (payload == b"rdy" or payload[:2] == SEQ_ACK):
+            with done:
+                replies[0] += 1
+                done.notify_all()
+
+    def wait_replies(n: int, timeout: float) -> bool:
+        with done:
+            return done.wait_for(lambda: replies[0] >= n, timeout)
+
+    def settle(n: int) -> bool:
+        """
+        Ответы до n-го; при таймауте — False и ожидание опоздавших ответов,
+        чтобы они не засчитались следующей итерации
+        """
+        if wait_replies(n, reply_timeout):
+            return True
+        wait_replies(n, reply_timeout)
+        return False
+
+    ble = SpikeBLEController("Sim Hub", pipeline_window=pipeline_window, transport=hub.transport())
+    ble.add_observer(observer)
+    ble.start()
+    try:
+        if not wait_replies(1, 5.0):
+            print(f"[skip] {stage}: simulated hub did not connect")
+            return
+
+        if pipeline_window:
+            def run_burst(i):
+                target = replies[0] + burst
+                for _ in range(burst):
+                    ble.send(CMD_STOP)
+                return settle(target)
+
+            suite.run(f"{stage} x{burst} (hub delay {reply_delay * 1000:.0f} ms)", run_burst,
+                      iters=max(iters // burst, 5), warmup=2, ops=burst)
+        else:
+            cmds = (CMD_STOP, CMD_CENTER)
+
+            def round_trip(i):
+                target = replies[0] + 1
+                ble.send(cmds[i % 2])
+                return settle(target)
+
+            suite.run(f"{stage} (hub delay {reply_delay * 1000:.0f} ms)", round_trip, iters=iters, warmup=5)
+    finally:
+        ble.stop()
+        hub.close()
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   НАБОР СТАДИЙ
+# ═══════════════════════════════════════════════════════════════════════════
+
+def make_backend(weights: Optional[Path], name: str, channels_last: bool, img_size: int) -> InferenceBackend:
+    if weights is None and name != "eager":
+        raise FileNotFoundError("needs --weights")
+    return load_backend(weights, name, channels_last=channels_last, img_size=img_size)
+
+
+def run_suite(args) -> Suite:
+    from cave_pipeline import zone_ratios
+
+    suite = Suite(args.iters, args.warmup)
+    jpegs = load_jpegs(args.frames, args.log, args.count, tuple(args.frame_size))
+    frames = [decode_jpeg(j) for j in jpegs]
+    n = len(frames)
+    h, w = frames[0].shape[:2]
+    print(f"frames {n} ({w}x{h}), torch {torch.__version__}, threads {torch.get_num_threads()}")
+
+    # Декодирование
+    suite.run("decode full", lambda i: decode_jpeg(jpegs[i % n]))
+    for size in args.sizes:
+        suite.run(f"decode reduced @{size}", lambda i, s=size: decode_jpeg(jpegs[i % n], s))
+
+    # Модели: предобработка, инференс, постобработка
+    ref_result = None
+    for name in args.backends:
+        try:
+            backend = make_backend(args.weights, name, args.channels_last, max(args.sizes))
+        except (FileNotFoundError, RuntimeError) as e:
+            print(f"[skip] {name}: {e}")
+            continue
+        for size in args.sizes:
+            pre = backend.preprocessor(size)
+            if name == args.backends[0]:
+                suite.run(f"preprocess @{size}", lambda i, p=pre: p(frames[i % n]))
+            suite.run(f"infer {name} @{size}",
+                      lambda i, b=backend, s=size: b.analyze(frames[i % n], s, roi=(ROI_Y1, ROI_Y2)),
+                      iters=args.infer_iters, warmup=3)
+        if ref_result is None:
+            size = max(args.sizes)
+            x = backend.preprocessor(size)(frames[0])
+            with torch.no_grad():
+                logits = backend.infer(x)
+            suite.run(f"postprocess @{size}", lambda i: postprocess(logits, (w, h), (ROI_Y1, ROI_Y2)))
+            ref_result = postprocess(logits, (w, h), (ROI_Y1, ROI_Y2))
+            suite.run(f"full_mask resize @{size}",
+                      lambda i: cv2.resize(ref_result.mask, (w, h), interpolation=cv2.INTER_NEAREST))
+
+    # Зоны, оверлей, путь изображения в UI
+    if ref_result is None:
+        rng = np.random.default_rng(0)
+        mask = (rng.random((max(args.sizes),) * 2) > 0.5).astype(np.uint8)
+    else:
+        mask = ref_result.mask
+    full = cv2.resize(mask, (w, h), interpolation=cv2.INTER_NEAREST)
+    suite.run("zone_ratios (full mask)", lambda i: zone_ratios(full))
+
+    renderer = OverlayRenderer(ALPHA, (ROI_Y1, ROI_Y2))
+    suite.run(f"overlay render {DISPLAY_SIZE[0]}x{DISPLAY_SIZE[1]}",
+              lambda i: renderer.render(frames[i % n], mask, DISPLAY_SIZE))
+    bench_ui_image(suite, renderer, frames, mask)
+
+    # BLE
+    if args.ble_iters > 0:
+        bench_ble(suite, args.ble_iters, args.hub_delay / 1000.0)
+        bench_ble(suite, args.ble_iters, args.hub_delay / 1000.0, pipeline_window=BLE_PIPELINE_WINDOW or 4,
+                  burst=args.ble_burst)
+    return suite
+
+
+def bench_ui_image(suite: Suite, renderer: OverlayRenderer, frames: List[np.ndarray], mask: np.ndarray):
+    from PIL import Image
+    n = len(frames)
+    root = None
+    try:
+        import tkinter as tk
+        from PIL import ImageTk
+        root = tk.Tk()
+        root.withdraw()
+        photos = (ImageTk.PhotoImage("RGB", DISPLAY_SIZE), ImageTk.PhotoImage("RGB", DISPLAY_SIZE))
+    except Exception as e:
+        print(f"[info] ui_image without PhotoImage.paste ({type(e).__name__}: no display)")
+
+    def ui_image(i):
+        rgb, seg = renderer.render(frames[i % n], mask, DISPLAY_SIZE)
+        a, b = Image.fromarray(rgb), Image.fromarray(seg)
+        if root is not None:
+            photos[0].paste(a)
+            photos[1].paste(b)
+
+    suite.run("ui_image" + (" (paste)" if root is not None else " (no Tk)"), ui_image)
+    if root is not None:
+        root.destroy()
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   СОХРАНЕНИЕ И СРАВНЕНИЕ
+# ═══════════════════════════════════════════════════════════════════════════
+
+def metadata(args) -> dict:
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "torch_threads": torch.get_num_threads(),
+        "args": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+    }
+
+
+def save(path: Path, suite: Suite, meta: dict):
+    data = {"meta": meta, "stages": {k: asdict(v) for k, v in suite.results.items()}}
+    path.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    print(f"[ok] results -> {path}")
+
+
+def compare(path: Path, suite: Suite, threshold: float) -> bool:
+    """Сравнение p50 и числа неудачных вызовов с сохранённым прогоном; False при регрессии"""
+    base = json.loads(path.read_text(encoding="utf-8"))["stages"]
+    ok = True
+    print(f"\ncompare with {path} (regression if p50 > x{threshold:.2f})")
+    for name, res in suite.results.items():
+        old = base.get(name)
+        if old is None:
+            continue
+        ratio = res.p50_ms / max(old["p50_ms"], 1e-9)
+        # Больше неудачных вызовов (таймауты ответа хаба) — тоже регрессия; NaN — всё сорвалось
+        more_failed = res.failed > old.get("failed", 0)
+        bad = not ratio <= threshold or more_failed
+        ok &= not bad
+        failed = f"  failed {old.get('failed', 0)} -> {res.failed}" if more_failed else ""
+        print(f"  [{'REGR' if bad else 'ok'}] {name:<34} {old['p50_ms']:9.3f} -> {res.p50_ms:9.3f} ms"
+              f"  x{ratio:.2f}{failed}")
+    return ok
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--weights", type=Path, default=None, help="веса .pth (без них - случайные, только eager)")
+    ap.add_argument("--backends", nargs="+", default=["eager"], choices=BACKENDS)
+    ap.add_argument("--sizes", nargs="+", type=int, default=[320])
+    ap.add_argument("--channels-last", action="store_true")
+    ap.add_argument("--frames", type=Path, default=None, help="папка с кадрами")
+    ap.add_argument("--log", type=Path, default=None, help="лог миссии .cavelog")
+    ap.add_argument("--count", type=int, default=32, help="число кадров")
+    ap.add_argument("--frame-size", nargs=2, type=int, default=list(STREAM_FRAME_SIZE), metavar=("W", "H"),
+                    help="размер синтетических кадров (по умолчанию как у ESP32-CAM)")
+    ap.add_argument("--iters", type=int, default=300)
+    ap.add_argument("--infer-iters", type=int, default=30)
+    ap.add_argument("--warmup", type=int, default=10)
+    ap.add_argument("--ble-iters", type=int, default=100)
+    ap.add_argument("--ble-burst", type=int, default=16, help="команд в пачке для ble_pipe")
+    ap.add_argument("--hub-delay", type=float, default=5.0, help="круговая задержка канала имитации хаба, мс")
+    ap.add_argument("--out", type=Path, default=None, help="сохранить результаты JSON")
+    ap.add_argument("--compare", type=Path, default=None, help="сравнить с сохранёнными результатами")
+    ap.add_argument("--threshold", type=float, default=1.15, help="допустимый рост p50")
+    args = ap.parse_args()
+
+    suite = run_suite(args)
+    if args.out is not None:
+        save(args.out, suite, metadata(args))
+    if args.compare is not None and not compare(args.compare, suite, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Cave Config - общая конфигурация Cave AI
+========================================
+
+Настройки потока, модели, BLE и автопилота для GUI-монитора
+(cave_ai_monitor.py) и headless-запуска (cave_headless.py).
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional
+
+from local_map import MapConfig
+from zone_stats import ZoneGrid
+
+STREAM_URL = "/stream"
+HUB_NAME = "Pybricks Hub"
+PYBRICKS_CHAR_UUID = "CHAR UUID"
+MODEL_PATH = Path(r"\mars_cave_ai\models\unet_safe_obstacle1.pth")
+IMG_SIZE = 320
+# Планировщик инференса: модель запускается при движении в кадре
+# (средняя |разница| миниатюр 0..255), но маска не старше MAX_MASK_AGE_SEC
+MOTION_THRESHOLD = 4.0
+MAX_MASK_AGE_SEC = 0.5
+MIN_INFER_STRIDE = 1
+# Кэш повторных кадров (frame_cache): тот же JPEG байт-в-байт берёт маску и
+# доли зон из кэша без декодирования и инференса; 0 - выключено
+FRAME_CACHE_SIZE = 32
+# Совпадение по перцептивному хэшу миниатюры (dHash, 64 бита): не больше
+# стольких отличающихся бит; None - только точные повторы JPEG
+FRAME_CACHE_NEAR_BITS: Optional[int] = None
+# Бюджет сквозной задержки (захват кадра → маска), мс: контроллер переключает
+# размер входа 320/256/192 и шаг кадров по p90 задержки. None - фиксированные
+# IMG_SIZE и MIN_INFER_STRIDE
+LATENCY_BUDGET_MS: Optional[float] = 250.0
+# Предел блокировки повышения после перегрузок в точке, сек (блокировка
+# удваивается с каждой перегрузкой)
+LATENCY_MAX_BLOCK_SEC = 60.0
+ALPHA = 0.35
+# Бэкенд инференса: eager | torchscript | onnx | int8-dynamic | int8-static
+# (артефакты для ONNX/int8 создаёт model_export.py)
+BACKEND = "eager"
+# Формат памяти NHWC для входа и весов (быстрее на CPU с oneDNN и на CUDA)
+CHANNELS_LAST = True
+# Инференс в процессах-воркерах (inference_worker): кадры и маски через
+# shared_memory, модель не делит GIL с захватом, автопилотом и Tk. Упавший
+# или зависший (без ответа INFERENCE_WORKER_TIMEOUT, сек) воркер
+# перезапускается, кадры тем временем считаются в процессе. 0 - в процессе
+INFERENCE_WORKERS = 0
+INFERENCE_WORKER_TIMEOUT = 2.0
+# Кэш трассировок TorchScript по хэшу весов (inference.load_backend):
+# повторный запуск грузит готовый граф без segmentation_models_pytorch
+# и трассировки. None - без кэша
+MODEL_CACHE_DIR: Optional[Path] = MODEL_PATH.parent / ".cache"
+UI_REFRESH_MS = 50
+DISPLAY_SIZE = (640, 480)
+# Собственный MJPEG-клиент для http:// потоков (иначе cv2.VideoCapture)
+USE_NATIVE_MJPEG = True
+
+# Команды 
+CMD_FWD = b"rev"
+CMD_REV = b"fwd"
+CMD_STOP = b"stp"
+CMD_LEFT = b"lft"
+CMD_RIGHT = b"rgt"
+CMD_CENTER = b"ctr"
+CMD_BYE = b"bye"
+# Привод и руль одним кадром 0x81 (spike_protocol); False — для прошивки
+# хаба, понимающей только 3-байтные команды
+COMPOUND_FRAMES = True
+# Конвейер BLE: кадры 0x82 без ожидания "rdy", не больше стольких команд
+# в пути (0 — обычный обмен с "rdy"); без подтверждения за BLE_ACK_TIMEOUT
+# команда считается потерянной
+BLE_PIPELINE_WINDOW = 0
+BLE_ACK_TIMEOUT = 0.5
+
+# Автопилот
+ROI_Y1 = 0.55
+ROI_Y2 = 0.95
+CENTER_CLEAR_MAX_OBS = 0.20
+STOP_IF_ALL_BAD = 0.60
+TURN_HOLD_SEC = 0.35
+AUTO_DRIVE_INTERVAL = 0.22
+AUTO_STEER_INTERVAL = 0.28
+MANUAL_OVERRIDE_SEC = 1.0
+# Снимок зон старше этого (по времени захвата кадра) — автопилот шлёт stp
+AUTO_MAX_SNAPSHOT_AGE = 1.0
+# Выбор курса: "gaps" — самая широкая свободная щель по профилю столбцов
+# маски (gap_planner), дуга с непрерывным рулём кадром 0x83 (нужна прошивка
+# хаба с этим кадром); "zones" — прежний выбор fwd/lft/rgt по долям L/C/R
+AUTOPILOT_PLANNER = "gaps"
+ARC_DRIVE_POWER = 55    # мощность движения хаба при скорости плана 1
+ARC_TURN_POWER = 45     # разность мощностей моторов при руле ±1
+ARC_DEADBAND = 6        # новая дуга уходит, если мощность изменилась не меньше чем на столько
+ARC_REPEAT_SEC = 0.5    # повтор неизменной дуги
+
+# Сетка зон для экспериментов (None - только L/C/R), например 7 колонок × 3 полосы глубины:
+#   ZONE_GRID = ZoneGrid(rows=3, cols=7, y1=ROI_Y1, y2=ROI_Y2)
+# weights задаёт карту стоимости rows×cols (ближние полосы важнее дальних и т.п.)
+ZONE_GRID: Optional[ZoneGrid] = None
+
+# Локальная карта проходимости (local_map): маски копятся в сетке вокруг
+# робота через гомографию пола и счисление пути по командам; автопилот
+# берёт препятствия из карты, а не только из текущего кадра. None - выключено.
+# Точки гомографии (image_points/ground_points) задаются калибровкой камеры:
+#   LOCAL_MAP = MapConfig(size=128, cell=0.05, max_range=2.0)
+LOCAL_MAP: Optional[MapConfig] = None
+
+# HTTP-метрики на 127.0.0.1 (Prometheus: /metrics, JSON: /metrics.json); None - выключено
+METRICS_PORT: Optional[int] = 9108
+
+# Трассы команд «кадр → решение → запись GATT → ответ хаба» в формате
+# Chrome Trace (chrome://tracing, Perfetto) при остановке; None - не сохранять
+TRACE_FILE: Optional[Path] = None
+
+# Запись миссии (кадры JPEG, маски, команды и ответы BLE) в папку; None - не писать.
+# Воспроизведение: python mission_log.py replay <файл.cavelog>
+MISSION_LOG_DIR: Optional[Path] = None
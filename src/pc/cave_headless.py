@@ -0,0 +1,108 @@
+"""
+Cave Headless - автопилот без графического интерфейса
+=====================================================
+
+Тот же конвейер, что и в cave_ai_monitor.py (поток → модель → автопилот
+→ BLE), но без tkinter: для бортового компьютера и CI. Кадры для
+отображения не декодируются, вся мощность уходит на инференс.
+
+Запуск (из src/pc):
+  python -m cave_headless                     # ручной режим, только метрики
+  python -m cave_headless --auto              # сразу включить автопилот
+  python -m cave_headless --json --stats-interval 1 > run.jsonl
+  python -m cave_headless --auto --trace trace.json   # задержки «кадр → мотор»
+  python -m cave_headless --auto --sim-hub --sim-loss 0.05   # без хаба (sim_hub)
+
+SIGINT/SIGTERM (Ctrl+C) останавливают робота (stp, ctr, bye) и
+корректно закрывают поток и лог миссии.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import signal
+import sys
+import threading
+import time
+from pathlib import Path
+
+from cave_pipeline import CavePipeline
+
+
+def format_stats(st: dict) -> str:
+    """Одна строка метрик для консоли"""
+    oL, oC, oR = st["zones"]
+    hub = "hub ok" if st["hub_connected"] else f"hub -- {st['hub_err']}".rstrip()
+    dup = f"  dup {st['cache_hit_rate'] * 100:4.1f}%" if st.get("cache_hit_rate") is not None else ""
+    return (f"[{st['uptime_s']:7.1f}s] fps {st['fps']:5.1f}  age {st['frame_age_ms']:5.0f} ms"
+            f"  drop {st['dropped']}/{st['produced']}  skip {st['infer_skip_rate'] * 100:4.1f}%{dup}"
+            f"  op {st['operating_point']}  L/C/R {oL * 100:4.1f}/{oC * 100:4.1f}/{oR * 100:4.1f}%"
+            f"  {'AUTO' if st['auto'] else 'MANUAL'}  {hub}")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--auto", action="store_true", help="включить автопилот при старте")
+    ap.add_argument("--stats-interval", type=float, default=2.0, help="период вывода метрик, сек (0 - не выводить)")
+    ap.add_argument("--json", action="store_true", help="метрики строками JSON")
+    ap.add_argument("--trace", type=Path, default=None, help="сохранить трассы команд (Chrome Trace JSON)")
+    ap.add_argument("--duration", type=float, default=0.0, help="остановиться через N сек (0 - без ограничения)")
+    ap.add_argument("--sim-hub", action="store_true", help="имитация хаба вместо BLE (sim_hub.py)")
+    ap.add_argument("--sim-loss", type=float, default=0.0, help="доля потерь в канале имитации")
+    ap.add_argument("--sim-disconnect-rate", type=float, default=0.0, help="обрывов имитации в секунду")
+    args = ap.parse_args()
+
+    stop = threading.Event()
+
+    def on_signal(signum, _frame):
+        print(f"[info] {signal.Signals(signum).name}, stopping", file=sys.stderr)
+        stop.set()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    sim = None
+    if args.sim_hub:
+        from sim_hub import LinkProfile, SimulatedHub
+        sim = SimulatedHub(LinkProfile(loss=args.sim_loss, disconnect_rate=args.sim_disconnect_rate))
+
+    pipeline = CavePipeline(hub_transport=sim.transport() if sim is not None else None)
+    if args.trace is not None:
+        pipeline.trace_file = args.trace
+    try:
+        pipeline.load()
+    except FileNotFoundError as e:
+        print(f"[error] {e}", file=sys.stderr)
+        return 1
+    if stop.is_set():
+        pipeline.stop()
+        return 0
+
+    pipeline.start()
+    if args.auto:
+        pipeline.set_auto(True)
+
+    deadline = time.time() + args.duration if args.duration > 0 else None
+    interval = args.stats_interval if args.stats_interval > 0 else 0.5
+    try:
+        while not stop.wait(interval):
+            if args.stats_interval > 0:
+                st = pipeline.stats()
+                print(json.dumps(st) if args.json else format_stats(st), flush=True)
+            if deadline is not None and time.time() >= deadline:
+                break
+    finally:
+        if pipeline.auto_on:
+            pipeline.set_auto(False)
+        pipeline.stop()
+        print(pipeline.tracer.summary(), file=sys.stderr)
+        if sim is not None:
+            time.sleep(0.5)
+            sim.close()
+            print(f"sim hub: {sim.stats}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,649 @@
+"""
+Cave Pipeline - конвейер поток → модель → автопилот → BLE без UI
+================================================================
+
+CavePipeline связывает захват кадров, планировщик и контроллер задержки
+инференса, модель, автопилот, хаб SPIKE и запись миссии. Работает без
+tkinter: его запускает cave_headless.py, а GUI-монитор лишь читает
+состояние конвейера и отображает его.
+
+Модель (torch, segmentation_models_pytorch) импортируется и загружается
+только в load(): с background=True — в отдельном потоке с прогревом, а
+поток и UI работают сразу, кадры до готовности модели только показываются.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import threading
+import time
+from typing import TYPE_CHECKING, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from cave_config import (
+    ARC_DEADBAND, ARC_DRIVE_POWER, ARC_REPEAT_SEC, ARC_TURN_POWER, AUTO_DRIVE_INTERVAL, AUTO_MAX_SNAPSHOT_AGE,
+    AUTO_STEER_INTERVAL, AUTOPILOT_PLANNER, BACKEND, BLE_ACK_TIMEOUT, BLE_PIPELINE_WINDOW, CENTER_CLEAR_MAX_OBS,
+    CHANNELS_LAST,
+    CMD_BYE, CMD_CENTER, CMD_FWD, CMD_LEFT, CMD_RIGHT, CMD_STOP, COMPOUND_FRAMES, FRAME_CACHE_NEAR_BITS,
+    FRAME_CACHE_SIZE, HUB_NAME, IMG_SIZE, INFERENCE_WORKER_TIMEOUT, INFERENCE_WORKERS,
+    LATENCY_BUDGET_MS, LATENCY_MAX_BLOCK_SEC, LOCAL_MAP, MANUAL_OVERRIDE_SEC, MAX_MASK_AGE_SEC, METRICS_PORT,
+    MIN_INFER_STRIDE, MISSION_LOG_DIR, MODEL_CACHE_DIR, MODEL_PATH, TRACE_FILE, MOTION_THRESHOLD, ROI_Y1, ROI_Y2, STOP_IF_ALL_BAD, STREAM_URL, TURN_HOLD_SEC,
+    USE_NATIVE_MJPEG, ZONE_GRID,
+)
+from frame_cache import CacheEntry, FrameCache, dhash, fingerprint
+from frame_source import CaptureThread, LatestFrameSlot
+from gap_planner import GapPlanner, Plan
+from latency_control import LatencyController
+from local_map import LocalMap
+from metrics import MetricsServer, Registry, round_or_none
+from mission_log import MissionRecorder
+from mjpeg_client import MjpegStreamClient
+from scheduler import RUN_MAX_AGE, InferenceScheduler, SchedulerConfig, motion_thumbnail
+from spike_ble import HubTransport, SpikeBLEController
+from spike_protocol import DRIVE_VALUES, hub_powers
+from tracing import CommandTag, Tracer
+from zone_snapshot import ZoneBoard
+from zone_stats import ZoneGrid, ZoneStats
+
+if TYPE_CHECKING:
+    from inference_worker import WorkerPool
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   АНАЛИЗ ЗОН И АВТОПИЛОТ
+# ═══════════════════════════════════════════════════════════════════════════
+
+def zone_ratios(mask01: np.ndarray):
+    """Доли препятствий в L/C/R внутри полосы ROI (сетка 1×3 через ZoneStats)"""
+    h, w = mask01.shape[:2]
+    grid = ZoneGrid(1, 3, ROI_Y1, ROI_Y2)
+    oL, oC, oR = (float(v) for v in ZoneStats(mask01 == 1).grid(grid)[0])
+    ys, _ = grid.bounds(h, w)
+    return oL, oC, oR, (int(ys[0]), int(ys[-1]))
+
+
+def autopilot(oL, oC, oR):
+    if min(oL, oC, oR) > STOP_IF_ALL_BAD:
+        return CMD_STOP, CMD_CENTER
+    if oC <= CENTER_CLEAR_MAX_OBS:
+        return CMD_FWD, CMD_CENTER
+    if oL < oR:
+        return CMD_FWD, CMD_LEFT
+    else:
+        return CMD_FWD, CMD_RIGHT
+
+
+def plan_arc(plan: Plan) -> Tuple[int, int]:
+    """План щелей → (скорость, руль) кадра дуги 0x83 в мощностях хаба; (0, 0) — стоп"""
+    # Скорость плана — вперёд робота; у хаба вперёд — команда CMD_FWD
+    speed = DRIVE_VALUES[CMD_FWD] * int(round(plan.speed * ARC_DRIVE_POWER))
+    steer = int(round(plan.steer * ARC_TURN_POWER))
+    return speed, steer
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   КОНВЕЙЕР
+# ═══════════════════════════════════════════════════════════════════════════
+
+class CavePipeline:
+    """
+    Потоки захвата, обработки и автопилота плюс BLE-контроллер.
+
+    display_interval — период публикации кадров для отображения (сек);
+    None — кадры не публикуются и декодируются только для модели.
+    hub_transport — канал до хаба (None — BLE; sim_hub — имитация).
+    Состояние (last_result, fps, frame_age_ms, display, ...) читается
+    из других потоков без блокировок: каждое поле заменяется целиком;
+    доли зон — неизменяемым снимком из zones (ZoneBoard).
+    """
+
+    def __init__(self, display_interval: Optional[float] = None, hub_transport: Optional[HubTransport] = None):
+        self.display_interval = display_interval
+        self.hub_transport = hub_transport
+        self.metrics = Registry()
+        self.metrics_server = None
+        self.tracer = Tracer(metrics=self.metrics)
+        self.trace_file = TRACE_FILE
+
+        # Состояние
+        self.auto_on = False
+        self.running = False
+        self.started_ts = 0.0
+        self.last_result = None
+        self.frame_id = 0
+        self.scheduler = InferenceScheduler(SchedulerConfig(
+            motion_threshold=MOTION_THRESHOLD, max_mask_age=MAX_MASK_AGE_SEC, min_stride=MIN_INFER_STRIDE))
+        self.img_size = IMG_SIZE
+        # Результаты по отпечаткам кадров (None — каждый кадр решает планировщик)
+        self.frame_cache = FrameCache(FRAME_CACHE_SIZE, FRAME_CACHE_NEAR_BITS) if FRAME_CACHE_SIZE else None
+        # Серия одинаковых отпечатков подряд: отпечаток и захват её первого кадра
+        self._repeat_key: Optional[bytes] = None
+        self._repeat_since = 0.0
+        self.controller = None
+        if LATENCY_BUDGET_MS is not None:
+            self.controller = LatencyController(LATENCY_BUDGET_MS, max_block=LATENCY_MAX_BLOCK_SEC)
+            self.apply_operating_point(self.controller.point)
+        self.fps = 0.0
+        self.frame_age_ms = 0.0
+        self.frame_slot = LatestFrameSlot()
+        self.stream = None
+        self.cap = None
+        self.last_display_ts = 0.0
+        self.recorder = None
+        self.model = None
+        self.device = None
+        # Загрузка модели: loading → warmup → ready | error (load_error — причина)
+        self.model_state = "none"
+        self.load_error: Optional[str] = None
+        self.model_ready = threading.Event()
+        self.load_thread = None
+        self.stopped = False
+        self.ble = None
+        self.capture_thread = None
+        # (frame_id, BGR-кадр, результат инференса) для отображения
+        self.display = None
+        # Снимки зон для автопилота и UI (заменяются целиком)
+        self.zones = ZoneBoard()
+
+        # Таймеры автопилота
+        self.last_drive_ts = 0.0
+        self.last_steer_ts = 0.0
+        self.last_turn_ts = 0.0
+        self.last_steer_cmd = CMD_CENTER
+        self.last_manual_ts = 0.0
+        # Планировщик щелей и последняя отправленная дуга (мощности хаба)
+        self.planner = GapPlanner()
+        self.last_plan: Optional[Plan] = None
+        self.last_arc: Optional[tuple] = None
+        # Локальная карта (None — автопилот смотрит только на текущий кадр)
+        self.local_map = LocalMap(LOCAL_MAP) if LOCAL_MAP is not None else None
+
+        self._setup_metrics()
+
+    def _setup_metrics(self):
+        m = self.metrics
+        self.m_frames = m.rate("frames_per_second", "Кадры, взятые из слота (окно 5 с)")
+        self.m_inferences = m.rate("inferences_per_second", "Запуски модели (окно 5 с)")
+        self.m_infer_errors = m.counter("infer_errors", "Исключения при инференсе")
+        self.m_thumb = m.histogram("motion_thumb_ms", "Миниатюра для планировщика")
+        self.m_decode = m.histogram("decode_ms", "Декодирование JPEG")
+        self.m_infer = m.histogram("infer_ms", "analyze(): предобработка, модель, зоны")
+        self.m_latency = m.histogram("capture_to_result_ms", "От захвата кадра до готовой маски")
+        slot = self.frame_slot
+        m.gauge("frames_produced", "Кадры от потока захвата", fn=lambda: slot.stats.produced)
+        m.gauge("frames_dropped", "Кадры, вытесненные более свежими", fn=lambda: slot.stats.dropped)
+        m.gauge("stream_reconnects", "Переподключения MJPEG",
+                fn=lambda: self.stream.stats.reconnects if self.stream else 0)
+        m.gauge("infer_skip_ratio", "Доля кадров без инференса", fn=lambda: self.scheduler.stats.skip_rate)
+        if self.frame_cache is not None:
+            cache = self.frame_cache.stats
+            m.gauge("frame_cache_hit_ratio", "Доля кадров с результатом из кэша повторов", fn=lambda: cache.hit_rate)
+            m.gauge("frame_cache_exact_hits", "Повторы JPEG байт-в-байт", fn=lambda: cache.exact_hits)
+            m.gauge("frame_cache_near_hits", "Совпадения по перцептивному хэшу", fn=lambda: cache.near_hits)
+            m.gauge("frame_cache_evictions", "Вытеснения из кэша повторов", fn=lambda: cache.evictions)
+            m.gauge("frame_cache_saved_ms", "Время модели, сэкономленное кэшем", fn=lambda: cache.saved_ms)
+            self.m_stalled = m.counter("stream_stalled_frames",
+                                       "Кадры подвисшего сенсора: тот же JPEG подряд дольше AUTO_MAX_SNAPSHOT_AGE")
+        m.gauge("mask_age_ms", "Возраст текущей маски", fn=lambda: self.scheduler.mask_age() * 1000.0)
+        m.gauge("img_size", "Размер входа модели", fn=lambda: self.img_size)
+        m.gauge("autopilot_armed", "Автопилот включён", fn=lambda: self.auto_on)
+        self.m_wake = m.histogram("autopilot_wake_ms", "От публикации снимка зон до решения автопилота")
+        self.m_stale_stops = m.counter("autopilot_stale_stops", "Стоп-команды из-за устаревшего снимка зон")
+        m.gauge("zones_age_ms", "Возраст снимка зон по времени захвата",
+                fn=lambda: self.zones.latest().age() * 1000.0)
+        self.m_arcs = m.counter("autopilot_arcs", "Дуги, отправленные планировщиком щелей")
+        self.m_map = m.histogram("map_update_ms", "Обновление локальной карты маской")
+        self.load_s = self.warmup_s = None
+        m.gauge("model_ready", "Модель загружена и прогрета", fn=lambda: self.model_ready.is_set())
+        m.gauge("model_load_s", "Загрузка модели (импорт, веса или кэш трассировки)", fn=lambda: self.load_s)
+        m.gauge("model_warmup_s", "Прогрев модели на всех размерах входа", fn=lambda: self.warmup_s)
+
+    def _setup_worker_metrics(self, pool: WorkerPool):
+        m, st = self.metrics, pool.stats
+        m.gauge("infer_workers_alive", "Готовые процессы-воркеры инференса", fn=lambda: st.alive)
+        m.gauge("infer_worker_restarts", "Перезапуски воркеров инференса", fn=lambda: st.restarts)
+        m.gauge("infer_worker_errors", "Сбои запросов к воркерам (таймаут, падение)", fn=lambda: st.errors)
+        m.gauge("infer_local_fallbacks", "Кадры, посчитанные в процессе вместо воркера", fn=lambda: st.local)
+
+    def load(self, background: bool = False):
+        """
+        Загрузка модели и инициализация BLE; FileNotFoundError без весов.
+        background=True — модель грузится и прогревается в потоке, ошибка
+        попадает в load_error / model_state, готовность — model_ready
+        """
+        if not MODEL_PATH.exists():
+            raise FileNotFoundError(f"Model not found: {MODEL_PATH}")
+
+        if background:
+            self.load_thread = threading.Thread(target=self._load_model_safe, name="model-load", daemon=True)
+            self.load_thread.start()
+        else:
+            self._load_model()
+        self.ble = SpikeBLEController(HUB_NAME, metrics=self.metrics, tracer=self.tracer,
+                                      compound=COMPOUND_FRAMES, pipeline_window=BLE_PIPELINE_WINDOW,
+                                      ack_timeout=BLE_ACK_TIMEOUT, transport=self.hub_transport)
+        if MISSION_LOG_DIR is not None:
+            self.recorder = MissionRecorder(MISSION_LOG_DIR / time.strftime("mission_%Y%m%d_%H%M%S.cavelog"))
+            self.ble.add_observer(self.recorder.on_ble)
+        if self.local_map is not None:
+            self.ble.add_observer(self.on_ble_motion)
+        self.ble.start()
+
+    def _load_model(self):
+        """Импорт torch, загрузка бэкенда (процессы-воркеры или в процессе) и прогрев"""
+        self.model_state = "loading"
+        t0 = time.perf_counter()
+        from inference import load_model
+
+        model = None
+        if INFERENCE_WORKERS > 0:
+            from inference_worker import WorkerPool
+            try:
+                model = WorkerPool(MODEL_PATH, BACKEND, workers=INFERENCE_WORKERS, channels_last=CHANNELS_LAST,
+                                   warmup=IMG_SIZE, timeout=INFERENCE_WORKER_TIMEOUT,
+                                   cache_dir=MODEL_CACHE_DIR).start()
+                self._setup_worker_metrics(model)
+            except (RuntimeError, OSError) as e:
+                print(f"[warn] inference workers: {e}; running inference in-process")
+                model = None
+        if model is None:
+            model, _ = load_model(MODEL_PATH, backend=BACKEND, channels_last=CHANNELS_LAST,
+                                  cache_dir=MODEL_CACHE_DIR)
+        self.load_s = time.perf_counter() - t0
+
+        # Прогрев на всех размерах входа контроллера: первые кадры после
+        # переключения рабочей точки не должны выбивать бюджет задержки
+        self.model_state = "warmup"
+        sizes = sorted({p.img_size for p in self.controller.points} if self.controller else {self.img_size})
+        self.warmup_s = model.warmup(sizes)
+        if self.stopped:
+            model.close()
+            return
+        self.device = model.device
+        self.model = model
+        self.model_state = "ready"
+        self.model_ready.set()
+        print(f"[info] model {model.name} on {model.device}: load {self.load_s:.1f}s, "
+              f"warmup {self.warmup_s:.1f}s {sizes}")
+
+    def _load_model_safe(self):
+        """Тело потока фоновой загрузки: исключение — в load_error, конвейер работает без модели"""
+        try:
+            self._load_model()
+        except Exception as e:
+            self.load_error = repr(e)
+            self.model_state = "error"
+            print(f"[error] model load: {e!r}")
+
+    def start(self):
+        """Запуск фоновых потоков"""
+        self.running = True
+        self.started_ts = time.time()
+
+        if METRICS_PORT is not None:
+            try:
+                self.metrics_server = MetricsServer(self.metrics, METRICS_PORT,
+                                                    extra=lambda: {"pipeline": self.stats()}).start()
+            except OSError as e:
+                print(f"[warn] metrics server on port {METRICS_PORT}: {e}")
+
+        # Поток захвата: всегда вычитывает поток в слот последнего кадра
+        if USE_NATIVE_MJPEG and STREAM_URL.startswith("http://"):
+            self.stream = MjpegStreamClient(STREAM_URL)
+        else:
+            self.cap = cv2.VideoCapture(STREAM_URL)
+        self.capture_thread = CaptureThread(self.read_stream_frame, self.frame_slot)
+        self.capture_thread.start()
+
+        # Поток обработки (инференс)
+        self.video_thread = threading.Thread(target=self.video_loop, daemon=True)
+        self.video_thread.start()
+
+        # Поток автопилота
+        self.auto_thread = threading.Thread(target=self.autopilot_loop, daemon=True)
+        self.auto_thread.start()
+
+    def stop(self):
+        """Остановка: стоп-команда и bye хабу, закрытие потока и лога"""
+        self.running = False
+        self.stopped = True
+        self.zones.close()
+        if self.capture_thread is not None:
+            self.capture_thread.stop()
+        if self.ble is not None:
+            self.ble.send(CMD_BYE)
+            time.sleep(0.5)
+            self.ble.stop()
+        if self.model is not None:
+            self.model.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.trace_file is not None:
+            n = self.tracer.dump_chrome(self.trace_file)
+            print(f"[info] {n} command traces -> {self.trace_file}")
+        if self.capture_thread is not None:
+            self.capture_thread.join(timeout=1.0)
+            if self.capture_thread.is_alive():
+                return
+        if self.stream is not None:
+            self.stream.close()
+        if self.cap is not None:
+            self.cap.release()
+
+    def read_stream_frame(self):
+        """Чтение одного кадра из потока (вызывается в потоке захвата)"""
+        if self.stream is not None:
+            return self.stream.read()
+        ret, frame = self.cap.read()
+        if not ret or frame is None:
+            return None
+        return frame
+
+    def video_loop(self):
+        """Фоновый поток обработки: всегда берёт самый свежий кадр из слота"""
+        while self.running:
+            packet = self.frame_slot.take(timeout=0.5)
+            if packet is None:
+                continue
+
+            self.frame_id = packet.frame_id
+            self.m_frames.mark()
+            if self.recorder is not None:
+                self.record_frame(packet)
+            # Частота в скользящем окне: в отличие от среднего за всё время видны просадки
+            self.fps = self.m_frames.rate()
+
+            now = time.time()
+            img_size = self.img_size
+            display_due = (self.display_interval is not None
+                           and now - self.last_display_ts >= self.display_interval)
+
+            # Тот же JPEG байт-в-байт — результат из кэша без миниатюры и модели,
+            # со временем захвата нового кадра: статичная сцена снята сейчас.
+            # Подвисший сенсор — тот же JPEG подряд дольше AUTO_MAX_SNAPSHOT_AGE:
+            # снимок зон не освежается, и автопилот останавливается по его возрасту
+            model = self.model
+            key = cached = thumb = thumb_hash = None
+            if model is not None and self.frame_cache is not None and packet.jpeg is not None:
+                key = fingerprint(packet.jpeg.view(), img_size)
+                cached = self.frame_cache.get(key)
+            if key is None or key != self._repeat_key:
+                self._repeat_key, self._repeat_since = key, packet.capture_ts
+            stalled = key is not None and packet.capture_ts - self._repeat_since > AUTO_MAX_SNAPSHOT_AGE
+            if model is None:
+                # Модель ещё загружается: кадры только показываются
+                infer_due = False
+            elif cached is not None:
+                if stalled:
+                    self.m_stalled.inc()
+                else:
+                    self.reuse_result(cached, packet.capture_ts)
+                infer_due = False
+            else:
+                # Решение об инференсе по движению; декодируем только те кадры,
+                # которые будут показаны или отданы модели
+                with self.m_thumb.time():
+                    thumb = motion_thumbnail(packet)
+                decision = self.scheduler.decide(self.frame_id, thumb, now)
+                infer_due = decision.run
+                if thumb is not None and self.frame_cache is not None and self.frame_cache.near_bits is not None:
+                    thumb_hash = dhash(thumb)
+                # Похожий на сохранённый кадр (dHash) заменяет инференс по движению,
+                # но не принудительный по возрасту маски
+                if infer_due and thumb_hash is not None and decision.reason != RUN_MAX_AGE:
+                    near = self.frame_cache.find_near(thumb_hash, img_size)
+                    if near is not None:
+                        self.reuse_result(near, packet.capture_ts)
+                        infer_due = False
+            if not infer_due and not display_due:
+                packet.release()
+                continue
+
+            # Для одного инференса хватает уменьшенного декодирования до размера входа
+            with self.m_decode.time():
+                frame = packet.decode(0 if display_due else img_size)
+            packet.release()
+            if frame is None:
+                continue
+
+            # Инференс: маска и доли зон считаются в разрешении модели
+            if infer_due:
+                t_infer = time.perf_counter()
+                try:
+                    self.last_result = model.analyze(frame, img_size, roi=(ROI_Y1, ROI_Y2), grid=ZONE_GRID)
+                    infer_s = time.perf_counter() - t_infer
+                    self.last_result.frame_id = self.frame_id
+                    self.last_result.capture_ts = packet.capture_ts
+                    self.m_inferences.mark()
+                    self.m_infer.observe(infer_s * 1000.0)
+                    self.m_latency.observe(packet.age() * 1000.0)
+                    self.scheduler.record(self.frame_id, thumb, packet.capture_ts, infer_s)
+                    if key is not None:
+                        self.frame_cache.put(key, CacheEntry(self.last_result, img_size, thumb_hash, infer_s * 1000.0))
+                    if self.local_map is not None:
+                        with self.m_map.time():
+                            self.local_map.update(self.last_result.mask, packet.capture_ts)
+                    if self.recorder is not None:
+                        self.recorder.result(self.frame_id, self.last_result)
+                    if self.controller is not None:
+                        point = self.controller.observe(packet.age())
+                        if point is not None:
+                            self.apply_operating_point(point)
+                except Exception:
+                    self.m_infer_errors.inc()
+                    self.last_result = None
+
+                if self.last_result is not None:
+                    self.zones.publish(self.last_result)
+
+            # Возраст кадра к моменту готовности результата
+            self.frame_age_ms = packet.age() * 1000.0
+
+            # Публикуем кадр для отображения одной атомарной заменой ссылки
+            if display_due:
+                self.last_display_ts = now
+                self.display = (self.frame_id, frame, self.last_result)
+
+    def reuse_result(self, entry: CacheEntry, capture_ts: float):
+        """Результат из кэша повторов для текущего кадра: копия с его номером"""
+        self.last_result = dataclasses.replace(entry.result, frame_id=self.frame_id, capture_ts=capture_ts)
+        if self.recorder is not None:
+            self.recorder.result(self.frame_id, self.last_result)
+        self.zones.publish(self.last_result)
+
+    def on_ble_motion(self, direction: str, payload: bytes, ts: float):
+        """Наблюдатель BLE: отправленные команды задают движение для счисления пути карты"""
+        if direction == "tx":
+            self.local_map.set_motion(*hub_powers(payload), ts)
+
+    def record_frame(self, packet):
+        """Кадр в лог миссии: сырой JPEG без перекодирования, если он есть"""
+        if packet.jpeg is not None:
+            self.recorder.frame(packet.frame_id, packet.capture_ts, packet.jpeg.view())
+        elif packet.image is not None:
+            ok, buf = cv2.imencode(".jpg", packet.image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            if ok:
+                self.recorder.frame(packet.frame_id, packet.capture_ts, buf)
+
+    def apply_operating_point(self, point):
+        """Размер входа модели и минимальный шаг инференса от контроллера задержки"""
+        self.img_size = point.img_size
+        self.scheduler.config.min_stride = point.stride
+
+    def autopilot_loop(self):
+        """
+        Фоновый поток автопилота: просыпается по новому снимку зон или к
+        сроку очередной команды. Снимок старше AUTO_MAX_SNAPSHOT_AGE —
+        инференс встал или поток оборвался — останавливает робота.
+        """
+        seen = 0
+        timeout = 0.2
+        while self.running:
+            fresh = self.zones.wait_newer(seen, timeout)
+            timeout = 0.2
+            snap = self.zones.latest()
+            seen = snap.seq
+            if not self.auto_on or self.ble is None or not self.ble.status.connected:
+                continue
+
+            now = time.time()
+            if (now - self.last_manual_ts) < MANUAL_OVERRIDE_SEC:
+                continue
+
+            if snap.age(now) > AUTO_MAX_SNAPSHOT_AGE:
+                if now - self.last_drive_ts >= AUTO_DRIVE_INTERVAL:
+                    self.ble.send(CMD_STOP)
+                    self.last_drive_ts = now
+                    self.last_arc = None
+                    self.m_stale_stops.inc()
+                timeout = AUTO_DRIVE_INTERVAL
+                continue
+            if fresh is not None:
+                self.m_wake.observe((now - fresh.published_ts) * 1000.0)
+
+            # Решение автопилота; команды помечаются кадром, по которому оно принято
+            tag = CommandTag(snap.frame_id, snap.capture_ts, time.time())
+            columns = snap.result.columns if snap.result is not None else None
+            if self.local_map is not None:
+                columns = self.local_map.heading_profile(self.planner.config.bins)
+            if AUTOPILOT_PLANNER == "gaps" and columns is not None:
+                wake = self._autopilot_gaps(columns, now, tag)
+            else:
+                wake = self._autopilot_zones(snap, now, tag)
+
+            # Следующее пробуждение без нового снимка: срок повтора команды
+            # или момент, когда текущий снимок устареет
+            wake = min(wake, snap.capture_ts + AUTO_MAX_SNAPSHOT_AGE)
+            timeout = max(0.005, wake - time.time())
+
+    def _autopilot_gaps(self, columns: np.ndarray, now: float, tag: CommandTag) -> float:
+        """
+        Дуга по самой широкой щели. Кадр 0x83 уходит при заметном изменении
+        мощностей (ARC_DEADBAND), переходе стоп ↔ движение или раз в
+        ARC_REPEAT_SEC; возвращает срок повтора
+        """
+        plan = self.last_plan = self.planner.plan(columns)
+        arc = speed, steer = plan_arc(plan)
+        last = self.last_arc
+        changed = (last is None or (arc == (0, 0)) != (last == (0, 0))
+                   or max(abs(a - b) for a, b in zip(arc, last)) >= ARC_DEADBAND)
+        if changed or now - self.last_drive_ts >= ARC_REPEAT_SEC:
+            if arc == (0, 0):
+                self.ble.send(CMD_STOP, tag)
+            else:
+                self.ble.send_arc(speed, steer, tag)
+                self.m_arcs.inc()
+            self.last_arc = arc
+            self.last_drive_ts = now
+        return self.last_drive_ts + ARC_REPEAT_SEC
+
+    def _autopilot_zones(self, snap, now: float, tag: CommandTag) -> float:
+        """Прежний выбор fwd/lft/rgt по долям L/C/R (кадра или карты); возвращает срок повтора"""
+        zones = self.local_map.zones() if self.local_map is not None else (snap.oL, snap.oC, snap.oR)
+        drive_cmd, steer_cmd = autopilot(*zones)
+
+        # Рулежка
+        steer = None
+        if steer_cmd in (CMD_LEFT, CMD_RIGHT):
+            if now - self.last_steer_ts >= AUTO_STEER_INTERVAL:
+                steer = steer_cmd
+                self.last_turn_ts = now
+        else:
+            if (now - self.last_turn_ts) > TURN_HOLD_SEC and (now - self.last_steer_ts) >= AUTO_STEER_INTERVAL:
+                steer = CMD_CENTER
+        if steer is not None:
+            self.last_steer_ts = now
+            self.last_steer_cmd = steer
+
+        # Привод
+        drive = drive_cmd if now - self.last_drive_ts >= AUTO_DRIVE_INTERVAL else None
+        if self.ble.compound and (steer is not None or drive is not None):
+            # Кадр «привод + руль»: руль всегда вместе с приводом, а привод
+            # несёт текущий руль, чтобы не сбрасывать дугу на хабе
+            if drive_cmd == CMD_STOP:
+                self.ble.send(CMD_STOP, tag)
+            else:
+                self.ble.send_drive_steer(drive_cmd, steer or self.last_steer_cmd, tag)
+            self.last_drive_ts = now
+        else:
+            if steer is not None:
+                self.ble.send(steer, tag)
+            if drive is not None:
+                self.ble.send(drive, tag)
+                self.last_drive_ts = now
+        return min(self.last_drive_ts + AUTO_DRIVE_INTERVAL, self.last_steer_ts + AUTO_STEER_INTERVAL)
+
+    # ───────────────────────────────────────────────────────────────────────
+    #   Управление
+    # ───────────────────────────────────────────────────────────────────────
+
+    def set_auto(self, on: bool):
+        self.auto_on = on
+        self.last_arc = None
+        self.planner.reset()
+        if not on:
+            self.ble.send(CMD_STOP)
+            self.ble.send(CMD_CENTER)
+
+    def toggle_auto(self):
+        """Переключение автопилота"""
+        self.set_auto(not self.auto_on)
+
+    def emergency_stop(self):
+        """Экстренная остановка"""
+        self.auto_on = False
+        self.ble.send(CMD_STOP)
+        self.ble.send(CMD_CENTER)
+        self.last_manual_ts = time.time()
+
+    def manual(self, cmd: bytes):
+        """Ручная команда: автопилот уступает на MANUAL_OVERRIDE_SEC"""
+        self.last_manual_ts = time.time()
+        self.last_arc = None
+        self.planner.reset()
+        self.ble.send(cmd)
+
+    # ───────────────────────────────────────────────────────────────────────
+    #   Статистика
+    # ───────────────────────────────────────────────────────────────────────
+
+    def operating_point(self) -> str:
+        if self.controller is not None:
+            return str(self.controller.point)
+        return f"{self.img_size}px/{self.scheduler.config.min_stride}"
+
+    def stats(self) -> dict:
+        """Снимок метрик для консоли/JSON"""
+        slot = self.frame_slot.stats
+        sched = self.scheduler
+        status = self.ble.status if self.ble is not None else None
+        snap = self.zones.latest()
+        return {
+            "uptime_s": round(time.time() - self.started_ts, 1) if self.started_ts else 0.0,
+            "frame_id": self.frame_id,
+            "fps": round(self.fps, 2),
+            "frame_age_ms": round(self.frame_age_ms, 1),
+            "produced": slot.produced,
+            "dropped": slot.dropped,
+            "reconnects": self.stream.stats.reconnects if self.stream else 0,
+            "infer_skip_rate": round(sched.stats.skip_rate, 3),
+            "infer_reasons": dict(sched.stats.reasons),
+            "cache_hit_rate": round(self.frame_cache.stats.hit_rate, 3) if self.frame_cache is not None else None,
+            "mask_age_ms": round_or_none(sched.mask_age() * 1000.0, 1),
+            "model": self.model_state,
+            "operating_point": self.operating_point(),
+            "latency_p90_ms": round_or_none(self.controller.latency_pct() * 1000.0, 1) if self.controller else None,
+            "safe": round(snap.safe_ratio, 4),
+            "zones": [round(snap.oL, 4), round(snap.oC, 4), round(snap.oR, 4)],
+            "zones_age_ms": round_or_none(snap.age() * 1000.0, 1),
+            "plan": ([round(self.last_plan.speed, 2), round(self.last_plan.steer, 2)]
+                     if self.last_plan is not None else None),
+            "map_pose": ([round(v, 3) for v in self.local_map.pose()] if self.local_map is not None else None),
+            "auto": self.auto_on,
+            "hub_connected": bool(status and status.connected),
+            "hub_err": status.err if status else "",
+        }
@@ -0,0 +1,136 @@
+"""
+Command Mailbox - почтовый ящик команд «побеждает последняя»
+============================================================
+
+Вместо FIFO-очереди у каждого канала свой слот:
+  priority  stp / bye — вне очереди, по порядку; stp снимает ожидающие
+            команды привода и руля (lft / rgt на хабе — поворот на месте,
+            ctr — езда прямо), bye — всё ожидающее
+  drive     fwd / rev и кадр дуги 0x83 — новая команда заменяет ожидающую;
+            дуга задаёт и руль, поэтому снимает ожидающую команду steer
+  steer     lft / rgt / ctr — то же
+  other     прочие команды — FIFO (как раньше)
+
+Контроллер BLE забирает команду только после "rdy" хаба, поэтому в хаб
+всегда уходит самое свежее решение, а не хвост устаревших команд.
+С merge=True ожидающие drive и steer забираются вместе — для одного
+кадра «привод + руль» (spike_protocol).
+Вытесненные команды передаются в on_drop (трассировка, счётчики).
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from cave_config import CMD_BYE, CMD_CENTER, CMD_FWD, CMD_LEFT, CMD_REV, CMD_RIGHT, CMD_STOP
+from spike_protocol import is_arc
+
+PRIORITY: FrozenSet[bytes] = frozenset((CMD_STOP, CMD_BYE))
+DRIVE: FrozenSet[bytes] = frozenset((CMD_FWD, CMD_REV))
+STEER: FrozenSet[bytes] = frozenset((CMD_LEFT, CMD_RIGHT, CMD_CENTER))
+
+# (команда, полезная нагрузка вызывающего, время постановки, порядковый номер)
+_Entry = Tuple[bytes, object, float, int]
+
+
+class CommandMailbox:
+    def __init__(self, on_drop: Optional[Callable[[bytes, object], None]] = None):
+        self._cond = threading.Condition()
+        self._priority: deque = deque()
+        self._other: deque = deque()
+        self._slots: Dict[str, Optional[_Entry]] = {"drive": None, "steer": None}
+        self._seq = 0
+        self._on_drop = on_drop
+        self.superseded = 0
+
+    def _drop(self, entry: Optional[_Entry]):
+        if entry is None:
+            return
+        self.superseded += 1
+        if self._on_drop is not None:
+            self._on_drop(entry[0], entry[1])
+
+    def put(self, cmd: bytes, payload: object = None):
+        self.put_many(((cmd, payload),))
+
+    def put_many(self, items: Iterable[Tuple[bytes, object]]):
+        """Несколько команд атомарно: контроллер не заберёт их по отдельности"""
+        with self._cond:
+            for cmd, payload in items:
+                self._put(bytes(cmd), payload)
+            self._cond.notify_all()
+
+    def _put(self, cmd: bytes, payload: object):
+        self._seq += 1
+        entry = (cmd, payload, time.time(), self._seq)
+        if cmd in PRIORITY:
+            # Ожидающий руль после стопа снова тронул бы робота с места
+            for slot in ("drive", "steer"):
+                self._drop(self._slots[slot])
+                self._slots[slot] = None
+            if cmd == CMD_BYE:
+                while self._other:
+                    self._drop(self._other.popleft())
+            self._priority.append(entry)
+        elif cmd in DRIVE or cmd in STEER or is_arc(cmd):
+            slot = "steer" if cmd in STEER else "drive"
+            if slot == "drive" and is_arc(cmd):
+                self._drop(self._slots["steer"])
+                self._slots["steer"] = None
+            old = self._slots[slot]
+            if old is not None:
+                # Замена сохраняет место слота в очереди: иначе канал,
+                # который обновляют первым, навсегда вытеснит второй
+                entry = (cmd, payload, entry[2], old[3])
+                self._drop(old)
+            self._slots[slot] = entry
+        else:
+            self._other.append(entry)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Дождаться непустого ящика; True, если есть что отправить"""
+        with self._cond:
+            return self._cond.wait_for(self._has_pending, timeout)
+
+    def _has_pending(self) -> bool:
+        return bool(self._priority or self._other or any(self._slots.values()))
+
+    def take(self, merge: bool = False) -> List[Tuple[bytes, object, float]]:
+        """
+        Следующие команды [(cmd, payload, время постановки)] без ожидания:
+        сначала priority, затем самая давняя из слотов и FIFO. С merge —
+        пара [drive, steer], если ожидают обе. Пустой список — ящик пуст.
+        """
+        with self._cond:
+            if self._priority:
+                return [self._priority.popleft()[:3]]
+            if merge and all(self._slots.values()) and self._slots["drive"][0] in DRIVE:
+                pair = [self._slots["drive"][:3], self._slots["steer"][:3]]
+                self._slots = {"drive": None, "steer": None}
+                return pair
+            candidates = [(e[3], name) for name, e in self._slots.items() if e is not None]
+            if self._other:
+                candidates.append((self._other[0][3], "other"))
+            if not candidates:
+                return []
+            _, name = min(candidates)
+            if name == "other":
+                entry = self._other.popleft()
+            else:
+                entry, self._slots[name] = self._slots[name], None
+            return [entry[:3]]
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._priority) + len(self._other) + sum(e is not None for e in self._slots.values())
+
+    def oldest_age(self, now: Optional[float] = None) -> float:
+        """Возраст самой давней ожидающей команды, сек (0 — ящик пуст)"""
+        now = time.time() if now is None else now
+        with self._cond:
+            ts = [e[2] for e in self._priority] + [e[2] for e in self._other]
+            ts += [e[2] for e in self._slots.values() if e is not None]
+        return now - min(ts) if ts else 0.0
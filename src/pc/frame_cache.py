@@ -0,0 +1,134 @@
+"""
+Frame Cache - повторные кадры без декодирования и инференса
+===========================================================
+
+ESP32 при статичной сцене или подвисшем сенсоре шлёт байт-в-байт те же
+JPEG. FrameCache хранит последние результаты инференса по отпечатку
+кадра — blake2b от байтов JPEG вместе с размером входа модели (от него
+зависит маска). Совпадение отпечатка — тот же кадр: маска и доли зон
+берутся из кэша, миниатюра, декодирование и модель не нужны. Время
+захвата результату даёт новый кадр; подвисший сенсор (тот же JPEG
+подряд) конвейер распознаёт отдельно по длине серии повторов.
+
+Дополнительно (near_bits не None) — перцептивный dHash миниатюры
+планировщика: 64 бита «ярче ли соседний пиксель» на сером 9×8. Кадр,
+чей dHash отличается от сохранённого не больше чем на near_bits бит,
+тоже берёт результат из кэша. Это грубее точного совпадения, поэтому
+по умолчанию выключено.
+
+Размер ограничен capacity, вытесняется давно не использованный (LRU).
+Счётчики попаданий и сэкономленное время модели — в stats.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+import cv2
+import numpy as np
+
+if TYPE_CHECKING:
+    # inference тянет torch — только для аннотаций
+    from inference import InferenceResult
+
+
+def fingerprint(jpeg, variant: int = 0) -> bytes:
+    """Отпечаток байтов JPEG (bytes / memoryview) для варианта обработки (размера входа)"""
+    h = hashlib.blake2b(jpeg, digest_size=16)
+    h.update(variant.to_bytes(4, "little", signed=True))
+    return h.digest()
+
+
+def dhash(gray: np.ndarray) -> int:
+    """Перцептивный хэш 64 бита серого изображения"""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).reshape(-1)
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+@dataclass
+class CacheEntry:
+    result: InferenceResult
+    variant: int
+    dhash: Optional[int] = None
+    infer_ms: float = 0.0
+
+
+@dataclass
+class CacheStats:
+    lookups: int = 0
+    exact_hits: int = 0
+    near_hits: int = 0
+    evictions: int = 0
+    saved_ms: float = 0.0       # время модели, которое сэкономили попадания
+
+    @property
+    def hits(self) -> int:
+        return self.exact_hits + self.near_hits
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+
+class FrameCache:
+    """
+    get() / find_near() и put() вызываются из потока обработки; stats
+    читаются из других потоков без блокировок (только счётчики).
+    """
+
+    def __init__(self, capacity: int = 32, near_bits: Optional[int] = None):
+        self.capacity = capacity
+        self.near_bits = near_bits
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[bytes, CacheEntry]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: bytes) -> Optional[CacheEntry]:
+        """Запись для отпечатка кадра (считается в lookups)"""
+        self.stats.lookups += 1
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self._hit(entry, exact=True)
+        return entry
+
+    def find_near(self, hash64: int, variant: int) -> Optional[CacheEntry]:
+        """
+        Ближайшая по dHash запись того же варианта в пределах near_bits;
+        вызывается после промаха get(), поэтому lookups не увеличивает
+        """
+        if self.near_bits is None:
+            return None
+        keys = [k for k, e in self._entries.items() if e.dhash is not None and e.variant == variant]
+        if not keys:
+            return None
+        hashes = np.array([self._entries[k].dhash for k in keys], dtype=np.uint64)
+        diff = (hashes ^ np.uint64(hash64)).view(np.uint8).reshape(-1, 8)
+        dist = np.unpackbits(diff, axis=1).sum(axis=1)
+        best = int(np.argmin(dist))
+        if dist[best] > self.near_bits:
+            return None
+        self._entries.move_to_end(keys[best])
+        entry = self._entries[keys[best]]
+        self._hit(entry, exact=False)
+        return entry
+
+    def _hit(self, entry: CacheEntry, exact: bool):
+        if exact:
+            self.stats.exact_hits += 1
+        else:
+            self.stats.near_hits += 1
+        self.stats.saved_ms += entry.infer_ms
+
+    def put(self, key: bytes, entry: CacheEntry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
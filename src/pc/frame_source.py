@@ -0,0 +1,206 @@
+"""
+Frame Source - захват кадров с развязкой от инференса
+=====================================================
+
+Поток захвата всегда вычитывает видеопоток до конца и кладёт кадр
+в слот «последнего кадра». Если потребитель (инференс) не успел забрать
+предыдущий кадр, тот выбрасывается и учитывается в счётчике dropped.
+Так автопилот всегда работает по самому свежему кадру, а не по очереди
+из буфера OpenCV.
+
+Кадры из MJPEG-клиента приходят сырыми JPEG и декодируются лениво,
+только если их кто-то забрал, и с DCT-уменьшением (1/2, 1/4, 1/8),
+если нужен лишь вход модели.
+"""
+
+from __future__ import annotations
+
+import time
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from mjpeg_client import JpegBuffer
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   ДЕКОДИРОВАНИЕ JPEG
+# ═══════════════════════════════════════════════════════════════════════════
+
+_REDUCED_COLOR = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                  4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+_REDUCED_GRAY = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+
+def jpeg_size(data) -> Optional[Tuple[int, int]]:
+    """(w, h) из заголовка SOF без декодирования"""
+    mv = memoryview(data)
+    n = len(mv)
+    i = 2
+    while i + 9 < n:
+        if mv[i] != 0xFF:
+            return None
+        marker = mv[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            h = (mv[i + 5] << 8) | mv[i + 6]
+            w = (mv[i + 7] << 8) | mv[i + 8]
+            return w, h
+        i += 2 + ((mv[i + 2] << 8) | mv[i + 3])
+    return None
+
+
+def jpeg_scale_for(size: Optional[Tuple[int, int]], max_side: int) -> int:
+    """
+    Наибольший делитель 1/2/4/8, при котором короткая сторона не меньше
+    max_side: вход модели квадратный, и по короткой оси кадр должен
+    уменьшаться (INTER_AREA), а не растягиваться
+    """
+    if not max_side or size is None:
+        return 1
+    shortest = min(size)
+    for scale in (8, 4, 2):
+        if shortest // scale >= max_side:
+            return scale
+    return 1
+
+
+def decode_jpeg(data, max_side: int = 0, grayscale: bool = False) -> Optional[np.ndarray]:
+    """Декодирование JPEG; при max_side > 0 используется уменьшение в DCT"""
+    scale = jpeg_scale_for(jpeg_size(data), max_side) if max_side else 1
+    flags = (_REDUCED_GRAY if grayscale else _REDUCED_COLOR)[scale]
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   КАДРЫ И СЛОТ ПОСЛЕДНЕГО КАДРА
+# ═══════════════════════════════════════════════════════════════════════════
+
+@dataclass
+class FramePacket:
+    """Кадр с идентификатором и временем захвата: готовый BGR или сырой JPEG"""
+    frame_id: int
+    capture_ts: float
+    image: Optional[np.ndarray] = None
+    jpeg: Optional[JpegBuffer] = None
+
+    def __post_init__(self):
+        self._decoded: Dict[int, np.ndarray] = {}
+
+    def age(self, now: Optional[float] = None) -> float:
+        """Возраст кадра в секундах"""
+        return (time.time() if now is None else now) - self.capture_ts
+
+    def decode(self, max_side: int = 0) -> Optional[np.ndarray]:
+        """
+        BGR-кадр; для JPEG max_side > 0 разрешает уменьшенное декодирование
+        так, чтобы короткая сторона оставалась не меньше max_side.
+        """
+        if self.image is not None:
+            return self.image
+        if self.jpeg is None:
+            return None
+        # Полный кадр подходит для любого запроса
+        if 1 in self._decoded:
+            return self._decoded[1]
+        data = self.jpeg.view()
+        scale = jpeg_scale_for(jpeg_size(data), max_side)
+        if scale not in self._decoded:
+            img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), _REDUCED_COLOR[scale])
+            if img is None:
+                return None
+            self._decoded[scale] = img
+        return self._decoded[scale]
+
+    def release(self):
+        """Вернуть JPEG-буфер в пул; декодированные кадры остаются доступны"""
+        if self.jpeg is not None:
+            self.jpeg.release()
+            self.jpeg = None
+
+
+@dataclass
+class SlotStats:
+    produced: int = 0
+    consumed: int = 0
+    dropped: int = 0
+
+
+class LatestFrameSlot:
+    """
+    Слот на один кадр: put() заменяет непрочитанный кадр, take() забирает самый новый.
+
+    Потокобезопасен; take() блокируется до появления нового кадра или таймаута.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._packet: Optional[FramePacket] = None
+        self._closed = False
+        self.stats = SlotStats()
+
+    def put(self, packet: FramePacket):
+        with self._cond:
+            if self._packet is not None:
+                self._packet.release()
+                self.stats.dropped += 1
+            self._packet = packet
+            self.stats.produced += 1
+            self._cond.notify_all()
+
+    def take(self, timeout: Optional[float] = None) -> Optional[FramePacket]:
+        with self._cond:
+            if self._packet is None and not self._closed:
+                self._cond.wait(timeout)
+            packet, self._packet = self._packet, None
+            if packet is not None:
+                self.stats.consumed += 1
+            return packet
+
+    def close(self):
+        """Разбудить ожидающих потребителей при остановке"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class CaptureThread(threading.Thread):
+    """
+    Фоновый поток захвата.
+
+    read_frame() возвращает BGR-кадр, JpegBuffer или None; при None поток
+    делает паузу и пробует снова. Кадры нумеруются и штампуются временем захвата.
+    """
+
+    def __init__(self, read_frame: Callable[[], Union[np.ndarray, JpegBuffer, None]],
+                 slot: LatestFrameSlot,
+                 retry_delay: float = 0.1):
+        super().__init__(daemon=True)
+        self.read_frame = read_frame
+        self.slot = slot
+        self.retry_delay = retry_delay
+        self.frame_id = 0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self.slot.close()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            frame = self.read_frame()
+            if frame is None:
+                time.sleep(self.retry_delay)
+                continue
+            self.frame_id += 1
+            if isinstance(frame, JpegBuffer):
+                packet = FramePacket(self.frame_id, time.time(), jpeg=frame)
+            else:
+                packet = FramePacket(self.frame_id, time.time(), image=frame)
+            self.slot.put(packet)
@@ -0,0 +1,106 @@
+"""
+Gap Planner - курс по самой широкой свободной щели
+==================================================
+
+Вместо выбора fwd/lft/rgt из трёх долей L/C/R планировщик берёт профиль
+столбцов маски в полосе ROI (доля препятствий в каждом столбце, считается
+в postprocess тем же запросом к интегральному изображению), сводит его
+в bins корзин и находит непрерывные отрезки свободных корзин — щели.
+
+Выбирается самая широкая щель (с поправкой на близость к прежнему курсу,
+чтобы не перескакивать между двумя почти равными щелями), цель — ближайшая
+к «прямо» точка щели с запасом на полширины робота. Руль непрерывный,
+-1..1 (минус — налево), сглаживается EMA; скорость снижается на крутой
+дуге. Щели нет — поворот на месте в сторону меньших препятствий (сторона
+сохраняется до появления щели), всё занято — стоп.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+from cave_config import CENTER_CLEAR_MAX_OBS, STOP_IF_ALL_BAD
+
+
+@dataclass
+class GapPlannerConfig:
+    bins: int = 32                                  # корзин по ширине кадра
+    clear_max_obs: float = CENTER_CLEAR_MAX_OBS     # корзина свободна при доле препятствий не выше
+    min_gap: float = 0.15                           # ширина робота, доля ширины кадра
+    stop_if_all_bad: float = STOP_IF_ALL_BAD        # стоп, если занята каждая корзина
+    hysteresis: float = 0.25                        # штраф за отход центра щели от прежнего курса
+    steer_gain: float = 1.5                         # руль на единицу смещения цели (-1..1 по ширине)
+    smoothing: float = 0.5                          # доля нового руля в EMA
+    slow_on_turn: float = 0.5                       # снижение скорости при |steer| = 1
+    min_speed: float = 0.4
+
+
+@dataclass
+class Plan:
+    speed: float                            # 0..1 (0 — стоп или поворот на месте)
+    steer: float                            # -1..1, минус — налево
+    gap: Optional[Tuple[int, int]] = None   # выбранная щель [lo, hi) в корзинах
+    aim: float = 0.0                        # цель по ширине кадра, -1..1
+
+
+def column_profile(columns: np.ndarray, bins: int) -> np.ndarray:
+    """Доли препятствий столбцов → bins корзин (среднее); NaN считается препятствием"""
+    columns = np.nan_to_num(np.asarray(columns, dtype=np.float64), nan=1.0)
+    n = columns.size
+    edges = np.linspace(0, n, min(bins, n) + 1).round().astype(int)
+    return np.add.reduceat(columns, edges[:-1]) / np.diff(edges)
+
+
+def clear_gaps(profile: np.ndarray, clear_max: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Начала и концы [lo, hi) отрезков корзин с долей препятствий ≤ clear_max"""
+    clear = np.concatenate(([0], (profile <= clear_max).astype(np.int8), [0]))
+    d = np.diff(clear)
+    return np.flatnonzero(d == 1), np.flatnonzero(d == -1)
+
+
+class GapPlanner:
+    def __init__(self, config: Optional[GapPlannerConfig] = None):
+        self.config = config or GapPlannerConfig()
+        self.reset()
+
+    def reset(self):
+        """Забыть прежний курс и руль (ручное управление, стоп)"""
+        self._aim = 0.0
+        self._steer = 0.0
+        self._spin = 0.0
+
+    def plan(self, columns: np.ndarray) -> Plan:
+        cfg = self.config
+        profile = column_profile(columns, cfg.bins)
+        n = profile.size
+        lo, hi = clear_gaps(profile, cfg.clear_max_obs)
+        widths = (hi - lo) / n
+        fits = widths >= cfg.min_gap
+
+        if not fits.any():
+            self._steer = 0.0
+            if profile.min() > cfg.stop_if_all_bad:
+                self._spin = 0.0
+                return Plan(0.0, 0.0)
+            if self._spin == 0.0:
+                half = n // 2
+                self._spin = -1.0 if profile[:half].mean() <= profile[half:].mean() else 1.0
+            return Plan(0.0, self._spin)
+        self._spin = 0.0
+
+        # Щели в координатах -1..1 по ширине кадра
+        lo_x, hi_x = lo / n * 2.0 - 1.0, hi / n * 2.0 - 1.0
+        centers = (lo_x + hi_x) / 2.0
+        score = np.where(fits, widths - cfg.hysteresis * np.abs(centers - self._aim), -np.inf)
+        best = int(np.argmax(score))
+
+        margin = cfg.min_gap
+        aim = float(np.clip(0.0, lo_x[best] + margin, hi_x[best] - margin))
+        target = float(np.clip(cfg.steer_gain * aim, -1.0, 1.0))
+        self._aim = aim
+        self._steer += cfg.smoothing * (target - self._steer)
+        speed = float(np.clip(1.0 - cfg.slow_on_turn * abs(self._steer), cfg.min_speed, 1.0))
+        return Plan(speed, self._steer, (int(lo[best]), int(hi[best])), aim)
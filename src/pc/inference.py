@@ -0,0 +1,407 @@
+"""
+Inference - загрузка модели и инференс сегментации
+==================================================
+
+UNet + ResNet18 (SAFE / OBSTACLE). Предобработка выполняется без
+выделения памяти в устойчивом режиме: Preprocessor владеет входным
+тензором и заполняет его на месте из uint8-кадра, а нормализация /255
+и перестановка BGR→RGB внесены в веса первой свёртки модели.
+
+Бэкенды (общий интерфейс InferenceBackend.predict):
+  eager         - smp.Unet в PyTorch, fp32
+  torchscript   - замороженный TorchScript (.ts или трассировка при загрузке)
+  onnx          - ONNX Runtime CPU (.onnx)
+  int8-dynamic  - ONNX Runtime, динамическое int8-квантование (.int8-dynamic.onnx)
+  int8-static   - ONNX Runtime, статическое int8-квантование QDQ (.int8-static.onnx)
+
+Артефакты создаются командой model_export.py; onnxruntime нужен только
+для ONNX-бэкендов. С cache_dir трассировка TorchScript сохраняется в кэш
+под ключом из хэша весов, устройства и версии torch: повторный запуск
+загружает готовый граф, не импортируя segmentation_models_pytorch.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+
+from zone_stats import ZoneGrid, ZoneStats
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   МОДЕЛЬ
+# ═══════════════════════════════════════════════════════════════════════════
+
+def fold_input_transform(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    Внести нормализацию x/255 и порядок каналов BGR в первую свёртку.
+
+    После этого модель принимает float-тензор BGR в диапазоне 0..255,
+    и результат совпадает с исходной моделью на RGB 0..1 (свёртка линейна).
+    """
+    if getattr(model, "cave_input_folded", False):
+        return model
+    conv = next(m for m in model.modules() if isinstance(m, torch.nn.Conv2d) and m.in_channels == 3)
+    with torch.no_grad():
+        conv.weight.copy_(conv.weight.flip(1) / 255.0)
+    model.cave_input_folded = True
+    return model
+
+
+def build_model(device: torch.device, weights: Optional[Path] = None) -> torch.nn.Module:
+    # Импорт smp — секунды; при загрузке из кэша TorchScript он не нужен
+    import segmentation_models_pytorch as smp
+
+    model = smp.Unet("resnet18", encoder_weights=None, in_channels=3, classes=2).to(device)
+    if weights is not None:
+        model.load_state_dict(torch.load(weights, map_location=device))
+    return model.eval()
+
+
+def load_model(model_path: Path, fold_input: bool = False, channels_last: bool = False,
+               backend: Optional[str] = None, cache_dir: Optional[Path] = None):
+    """
+    Загрузка модели.
+
+    backend=None — вернуть eager nn.Module (как раньше); иначе вернуть
+    InferenceBackend выбранного типа (см. BACKENDS), который принимает
+    predict_mask вместо модели.
+    """
+    if backend is not None:
+        inst = load_backend(model_path, backend, channels_last=channels_last, cache_dir=cache_dir)
+        return inst, inst.device
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = build_model(device, model_path)
+    if fold_input:
+        fold_input_transform(model)
+    if channels_last:
+        model.to(memory_format=torch.channels_last)
+    return model, device
+
+
+def trace_torchscript(model: torch.nn.Module, img_size: int, optimize: bool = True) -> torch.jit.ScriptModule:
+    """
+    Трассировка и заморозка модели для TorchScript-бэкенда.
+
+    optimize=False — только freeze (переносимый артефакт для сохранения);
+    optimize_for_inference привязывает веса к устройству и применяется при загрузке.
+    """
+    device = next(model.parameters()).device
+    x = torch.zeros(1, 3, img_size, img_size, device=device)
+    with torch.no_grad():
+        frozen = torch.jit.freeze(torch.jit.trace(model, x))
+        return torch.jit.optimize_for_inference(frozen) if optimize else frozen
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   ПРЕДОБРАБОТКА
+# ═══════════════════════════════════════════════════════════════════════════
+
+class Preprocessor:
+    """
+    Переиспользуемый вход модели размера 1×3×img_size×img_size.
+
+    folded=True — модель прошла fold_input_transform(), тензор заполняется
+    BGR 0..255 без отдельной нормализации; иначе RGB и деление на 255 на месте.
+    На CUDA промежуточный буфер на хосте закреплён (pinned), копирование асинхронное.
+    """
+
+    def __init__(self, device: torch.device, img_size: int, folded: bool = True,
+                 channels_last: bool = False, pin_memory: Optional[bool] = None):
+        self.device = device
+        self.img_size = img_size
+        self.folded = folded
+        if pin_memory is None:
+            pin_memory = device.type == "cuda"
+        fmt = torch.channels_last if channels_last else torch.contiguous_format
+        shape = (1, 3, img_size, img_size)
+
+        self._resized = np.empty((img_size, img_size, 3), dtype=np.uint8)
+        self._chw = torch.from_numpy(self._resized).permute(2, 0, 1)
+        self._host = torch.empty(shape, dtype=torch.float32, memory_format=fmt, pin_memory=pin_memory)
+        if device.type == "cpu":
+            self.input = self._host
+        else:
+            self.input = torch.empty(shape, dtype=torch.float32, memory_format=fmt, device=device)
+
+    def __call__(self, frame_bgr: np.ndarray) -> torch.Tensor:
+        s = self.img_size
+        cv2.resize(frame_bgr, (s, s), dst=self._resized, interpolation=cv2.INTER_AREA)
+        if not self.folded:
+            cv2.cvtColor(self._resized, cv2.COLOR_BGR2RGB, dst=self._resized)
+        # uint8 HWC → float NCHW одним проходом с приведением типа
+        self._host[0].copy_(self._chw)
+        if not self.folded:
+            self._host.mul_(1.0 / 255.0)
+        if self.input is not self._host:
+            self.input.copy_(self._host, non_blocking=True)
+        return self.input
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   ПОСТОБРАБОТКА
+# ═══════════════════════════════════════════════════════════════════════════
+
+@dataclass
+class InferenceResult:
+    """
+    Результат инференса в разрешении модели.
+
+    mask — компактная маска 0/1 (uint8, img_size×img_size); до размера
+    кадра она растягивается только по запросу (full_mask) для отображения.
+    """
+    mask: np.ndarray
+    frame_size: Tuple[int, int]
+    safe_ratio: float = 0.0
+    oL: float = 0.0
+    oC: float = 0.0
+    oR: float = 0.0
+    zones: Optional[np.ndarray] = None
+    zone_cost: float = 0.0
+    # Доля препятствий в каждом столбце маски в полосе ROI (для планировщика щелей)
+    columns: Optional[np.ndarray] = None
+    # Кадр-источник (заполняет конвейер) для трассировки команд
+    frame_id: int = -1
+    capture_ts: float = 0.0
+    _full: Optional[Tuple[Tuple[int, int], np.ndarray]] = field(default=None, repr=False)
+
+    @property
+    def obst_ratio(self) -> float:
+        return 1.0 - self.safe_ratio
+
+    def full_mask(self, size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """Маска размера (w, h) (по умолчанию размер исходного кадра), кэшируется"""
+        size = tuple(size or self.frame_size)
+        if self._full is None or self._full[0] != size:
+            full = cv2.resize(self.mask, size, interpolation=cv2.INTER_NEAREST)
+            self._full = (size, full)
+        return self._full[1]
+
+
+@torch.no_grad()
+def postprocess(logits: torch.Tensor, frame_size: Tuple[int, int],
+                roi: Optional[Tuple[float, float]] = None,
+                grid: Optional[ZoneGrid] = None) -> InferenceResult:
+    """
+    Маска и статистика зон прямо из логитов на устройстве модели.
+
+    Для двух классов argmax равен сравнению logit[1] > logit[0] (при равенстве
+    оба дают класс 0). По маске разрешения модели строится одно интегральное
+    изображение; доля SAFE, L/C/R и профиль столбцов в полосе roi и ячейки
+    grid берутся из него, на хост уходят маска uint8 и суммы ячеек.
+    """
+    obs = logits[0, 1] > logits[0, 0]
+    h, w = obs.shape
+    stats = ZoneStats(obs)
+    mask = obs.to(torch.uint8).cpu().numpy()
+
+    # Узлы 0/ROI/кадр по вертикали и каждый столбец по горизонтали: весь кадр,
+    # профиль столбцов в полосе ROI и L/C/R за один запрос
+    y1, y2 = (int(h * roi[0]), int(h * roi[1])) if roi is not None else (0, h)
+    third = w // 3
+    cells = stats.cell_sums(np.array([0, y1, y2, h]), np.arange(w + 1))
+    result = InferenceResult(mask, frame_size, safe_ratio=1.0 - cells.sum() / float(h * w))
+    if roi is not None:
+        band = cells[1]
+        edges = np.array([0, third, 2 * third])
+        areas = (y2 - y1) * np.diff([0, third, 2 * third, w])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result.oL, result.oC, result.oR = (float(v) for v in np.add.reduceat(band, edges) / areas)
+            result.columns = band / (y2 - y1)
+    if grid is not None:
+        result.zones = stats.grid(grid)
+        result.zone_cost = stats.cost(grid, result.zones)
+    return result
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   БЭКЕНДЫ
+# ═══════════════════════════════════════════════════════════════════════════
+
+BACKENDS = ("eager", "torchscript", "onnx", "int8-dynamic", "int8-static")
+
+_ARTIFACT_SUFFIX = {
+    "torchscript": ".ts",
+    "onnx": ".onnx",
+    "int8-dynamic": ".int8-dynamic.onnx",
+    "int8-static": ".int8-static.onnx",
+}
+
+
+def artifact_path(weights: Path, backend: str) -> Path:
+    """Путь артефакта бэкенда рядом с весами: unet.pth → unet.ts, unet.onnx, ..."""
+    return weights.with_suffix(_ARTIFACT_SUFFIX[backend])
+
+
+class InferenceBackend:
+    """
+    Общий интерфейс бэкендов:
+      predict(кадр BGR, размер входа) → маска 0/1 размера кадра
+      analyze(кадр BGR, размер входа, roi) → InferenceResult (без апсемплинга)
+    """
+
+    name = ""
+
+    def __init__(self, device: torch.device, channels_last: bool = False):
+        self.device = device
+        self.channels_last = channels_last
+        self._pre: Dict[int, Preprocessor] = {}
+
+    def preprocessor(self, img_size: int) -> Preprocessor:
+        pre = self._pre.get(img_size)
+        if pre is None:
+            pre = Preprocessor(self.device, img_size, channels_last=self.channels_last)
+            self._pre[img_size] = pre
+        return pre
+
+    def infer(self, x: torch.Tensor) -> torch.Tensor:
+        """Логиты 1×2×H×W для входа BGR 0..255 (нормализация внесена в модель)"""
+        raise NotImplementedError
+
+    @torch.no_grad()
+    def analyze(self, frame_bgr: np.ndarray, img_size: int,
+                roi: Optional[Tuple[float, float]] = None,
+                grid: Optional[ZoneGrid] = None) -> InferenceResult:
+        """Инференс с постобработкой на устройстве: компактная маска и доли зон"""
+        h, w = frame_bgr.shape[:2]
+        logits = self.infer(self.preprocessor(img_size)(frame_bgr))
+        return postprocess(logits, (w, h), roi, grid)
+
+    def predict(self, frame_bgr: np.ndarray, img_size: int) -> np.ndarray:
+        return self.analyze(frame_bgr, img_size).full_mask()
+
+    def close(self):
+        """Освободить ресурсы бэкенда (процессы, общая память)"""
+
+    def warmup(self, sizes: Iterable[int], runs: int = 2) -> float:
+        """
+        Прогон на пустых кадрах для каждого размера входа: первые вызовы
+        (выделение памяти, выбор алгоритмов oneDNN/cuDNN, оптимизация
+        графа TorchScript) медленнее устойчивого режима. Возвращает секунды
+        """
+        t0 = time.perf_counter()
+        for size in sizes:
+            frame = np.zeros((size, size, 3), np.uint8)
+            for _ in range(runs):
+                self.analyze(frame, size)
+        return time.perf_counter() - t0
+
+
+class TorchBackend(InferenceBackend):
+    """eager и TorchScript: модуль со свёрнутой нормализацией"""
+
+    def __init__(self, module, device: torch.device, name: str, channels_last: bool = False):
+        super().__init__(device, channels_last)
+        self.module = module
+        self.name = name
+
+    def infer(self, x: torch.Tensor) -> torch.Tensor:
+        return self.module(x)
+
+
+class OnnxBackend(InferenceBackend):
+    """ONNX Runtime на CPU (fp32 или int8)"""
+
+    def __init__(self, path: Path, name: str, threads: int = 0):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("ONNX backends need onnxruntime: pip install onnxruntime") from e
+        super().__init__(torch.device("cpu"))
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(path), opts, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.name = name
+
+    def infer(self, x: torch.Tensor) -> torch.Tensor:
+        out = self.session.run(None, {self.input_name: x.numpy()})[0]
+        return torch.from_numpy(out)
+
+
+def weights_digest(weights: Path) -> str:
+    """Хэш файла весов (blake2b, 32 hex) — ключ кэша артефактов"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(weights, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cached_artifact(cache_dir: Path, weights: Path, backend: str, img_size: int, device: torch.device,
+                    channels_last: bool) -> Path:
+    """Путь артефакта в кэше: веса, размер трассировки, устройство, формат памяти, версия torch"""
+    layout = "nhwc" if channels_last else "nchw"
+    version = torch.__version__.replace("+", "_")
+    name = f"{weights.stem}-{weights_digest(weights)}-{backend}-{img_size}-{device.type}-{layout}-torch{version}.ts"
+    return Path(cache_dir) / name
+
+
+def load_backend(weights: Path, backend: str = "eager", channels_last: bool = False,
+                 img_size: int = 320, cache_dir: Optional[Path] = None) -> InferenceBackend:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+
+    if backend in ("eager", "torchscript"):
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        cached = None
+        if backend == "torchscript" and cache_dir is not None:
+            cached = cached_artifact(cache_dir, weights, backend, img_size, device, channels_last)
+        if backend == "torchscript" and artifact_path(weights, backend).exists():
+            module = torch.jit.load(str(artifact_path(weights, backend)), map_location=device)
+            module = torch.jit.optimize_for_inference(module)
+        elif cached is not None and cached.exists():
+            module = torch.jit.optimize_for_inference(torch.jit.load(str(cached), map_location=device))
+        else:
+            module = fold_input_transform(build_model(device, weights))
+            if channels_last:
+                module.to(memory_format=torch.channels_last)
+            if backend == "torchscript":
+                module = trace_torchscript(module, img_size, optimize=cached is None)
+            if cached is not None:
+                # Запись через временный файл: параллельный запуск не прочтёт половину
+                cached.parent.mkdir(parents=True, exist_ok=True)
+                tmp = cached.with_name(f"{cached.name}.{os.getpid()}.tmp")
+                torch.jit.save(module, str(tmp))
+                os.replace(tmp, cached)
+                module = torch.jit.optimize_for_inference(module)
+        return TorchBackend(module, device, backend, channels_last)
+
+    path = artifact_path(weights, backend)
+    if not path.exists():
+        raise FileNotFoundError(f"{path} not found, run: python model_export.py {weights}")
+    return OnnxBackend(path, backend)
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   ИНФЕРЕНС
+# ═══════════════════════════════════════════════════════════════════════════
+
+@torch.no_grad()
+def predict_mask(model, device, frame_bgr: np.ndarray, img_size: int,
+                 pre: Optional[Preprocessor] = None) -> np.ndarray:
+    if isinstance(model, InferenceBackend):
+        return model.predict(frame_bgr, img_size)
+    h, w = frame_bgr.shape[:2]
+    if pre is not None:
+        x = pre(frame_bgr)
+    elif getattr(model, "cave_input_folded", False):
+        raise ValueError("Model with folded input transform needs a Preprocessor")
+    else:
+        rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
+        inp = cv2.resize(rgb, (img_size, img_size), interpolation=cv2.INTER_AREA)
+        x = (inp.astype(np.float32) / 255.0).transpose(2, 0, 1)[None, ...]
+        x = torch.tensor(x, device=device)
+    logits = model(x)
+    pred = torch.argmax(logits, dim=1).detach().cpu().numpy()[0].astype(np.uint8)
+    return cv2.resize(pred, (w, h), interpolation=cv2.INTER_NEAREST)
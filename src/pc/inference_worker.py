@@ -0,0 +1,369 @@
+"""
+Inference Worker - инференс в отдельных процессах
+=================================================
+
+Захват, инференс, отрисовка, автопилот и Tk делят один интерпретатор и
+один GIL: обновление UI и numpy-работа тормозят друг друга. WorkerPool
+выносит модель в процессы-воркеры (spawn) и сам является бэкендом
+инференса: analyze()/predict() и predict_mask() работают как раньше.
+
+Обмен без pickle больших массивов: у каждого воркера два кольца в
+multiprocessing.shared_memory на slots ячеек — кадры BGR (до max_frame,
+больший кадр уменьшается перед записью) и результаты (компактная маска
+и профиль столбцов). По Pipe идут только номер ячейки, формы и скаляры.
+Несколько потоков (несколько потоков видео) занимают разные воркеры,
+в одном воркере запросы выстраиваются по ячейкам кольца.
+
+Супервизор раз в check_interval перезапускает умершие и зависшие
+(ответ не пришёл за timeout) воркеры, не чаще max_restarts за
+restart_window. Пока воркеров нет или запрос сорвался, кадр считается
+в процессе конвейера (бэкенд загружается при первой необходимости) —
+ни один кадр не теряется из-за падения воркера.
+"""
+
+from __future__ import annotations
+
+import itertools
+import multiprocessing as mp
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+
+from inference import InferenceBackend, InferenceResult, load_backend
+from zone_stats import ZoneGrid
+
+
+class WorkerError(RuntimeError):
+    """Воркер упал, не ответил вовремя или вернул ошибку"""
+
+
+@dataclass
+class WorkerStats:
+    requests: int = 0
+    local: int = 0          # кадры, посчитанные в процессе конвейера
+    timeouts: int = 0
+    errors: int = 0
+    restarts: int = 0
+    alive: int = 0
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   ПРОЦЕСС ВОРКЕРА
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _worker_main(weights: str, backend: str, channels_last: bool, warmup: int, conn, in_name: str,
+                 out_name: str, frame_bytes: int, out_bytes: int, cache_dir: Optional[str] = None):
+    """
+    Точка входа процесса: загрузка модели и прогрев (первый прогон не должен
+    упереться в timeout), затем запросы по Pipe до "stop" / EOF
+    """
+    shm_in = shared_memory.SharedMemory(name=in_name)
+    shm_out = shared_memory.SharedMemory(name=out_name)
+    try:
+        try:
+            model = load_backend(Path(weights), backend, channels_last=channels_last,
+                                 cache_dir=Path(cache_dir) if cache_dir else None)
+            if warmup:
+                model.analyze(np.zeros((warmup, warmup, 3), np.uint8), warmup)
+        except Exception as e:
+            conn.send(("fail", repr(e)))
+            return
+        conn.send(("ready", model.name, str(model.device)))
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                break
+            if msg[0] == "stop":
+                break
+            _, seq, slot, shape, img_size, roi, grid = msg
+            try:
+                frame = np.ndarray(shape, np.uint8, buffer=shm_in.buf, offset=slot * frame_bytes)
+                r = model.analyze(frame, img_size, roi, grid)
+                base = slot * out_bytes
+                np.ndarray(r.mask.shape, np.uint8, buffer=shm_out.buf, offset=base)[:] = r.mask
+                ncols = 0
+                if r.columns is not None:
+                    ncols = r.columns.size
+                    np.ndarray((ncols,), np.float64, buffer=shm_out.buf,
+                               offset=base + _align(r.mask.size))[:] = r.columns
+                conn.send(("ok", seq, r.mask.shape, ncols,
+                           (r.safe_ratio, r.oL, r.oC, r.oR, r.zone_cost), r.zones))
+            except Exception as e:
+                conn.send(("err", seq, repr(e)))
+    finally:
+        shm_in.close()
+        shm_out.close()
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   СТОРОНА КОНВЕЙЕРА
+# ═══════════════════════════════════════════════════════════════════════════
+
+@dataclass
+class _Waiter:
+    event: threading.Event = field(default_factory=threading.Event)
+    reply: Optional[tuple] = None
+
+
+class _Worker:
+    """Процесс, его кольца в shared memory и поток чтения ответов"""
+
+    def __init__(self, index: int, pool: "WorkerPool"):
+        self.index = index
+        self.pool = pool
+        self.shm_in = shared_memory.SharedMemory(create=True, size=pool.slots * pool.frame_bytes)
+        self.shm_out = shared_memory.SharedMemory(create=True, size=pool.slots * pool.out_bytes)
+        self.proc = None
+        self.conn = None
+        self.ready = False
+        self.dead = True
+        self._cond = threading.Condition()
+        self._send_lock = threading.Lock()
+        self._free: deque = deque()
+        self._pending: Dict[int, _Waiter] = {}
+        self._seq = itertools.count()
+        self.started_ts = 0.0
+
+    def spawn(self):
+        pool = self.pool
+        parent, child = pool.ctx.Pipe()
+        self.proc = pool.ctx.Process(
+            target=_worker_main, name=f"cave-infer-{self.index}", daemon=True,
+            args=(str(pool.weights), pool.backend, pool.channels_last, pool.warmup, child,
+                  self.shm_in.name, self.shm_out.name, pool.frame_bytes, pool.out_bytes,
+                  str(pool.cache_dir) if pool.cache_dir is not None else None))
+        self.proc.start()
+        child.close()
+        with self._cond:
+            self.conn = parent
+            self.ready = False
+            self.dead = False
+            self._free = deque(range(pool.slots))
+            self.started_ts = time.time()
+        threading.Thread(target=self._reader, args=(parent,), name=f"cave-infer-rx-{self.index}",
+                         daemon=True).start()
+
+    def _reader(self, conn):
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                break
+            if msg[0] == "ready":
+                with self._cond:
+                    self.ready = True
+                    self._cond.notify_all()
+            elif msg[0] == "fail":
+                print(f"[warn] inference worker {self.index}: {msg[1]}")
+                break
+            else:
+                with self._cond:
+                    waiter = self._pending.pop(msg[1], None)
+                if waiter is not None:
+                    waiter.reply = msg
+                    waiter.event.set()
+        if conn is self.conn:
+            self.kill()
+
+    def wait_ready(self, timeout: float) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self.ready or self.dead, timeout) and self.ready
+
+    @property
+    def load(self) -> int:
+        return self.pool.slots - len(self._free)
+
+    def usable(self) -> bool:
+        return self.ready and not self.dead and bool(self._free)
+
+    def kill(self):
+        """Пометить мёртвым и остановить процесс; ожидающие получают ошибку"""
+        with self._cond:
+            if self.dead and self.proc is None:
+                return
+            self.dead = True
+            self.ready = False
+            pending, self._pending = self._pending, {}
+            proc, self.proc = self.proc, None
+            conn, self.conn = self.conn, None
+            self._cond.notify_all()
+        for waiter in pending.values():
+            waiter.event.set()
+        if conn is not None:
+            conn.close()
+        if proc is not None and proc.is_alive():
+            proc.terminate()
+            proc.join(timeout=1.0)
+
+    def run(self, frame: np.ndarray, img_size: int, roi, grid, timeout: float) -> InferenceResult:
+        pool = self.pool
+        h, w = frame.shape[:2]
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._free or self.dead, timeout) or self.dead:
+                raise WorkerError("no free slot")
+            slot = self._free.popleft()
+            seq = next(self._seq)
+            waiter = self._pending[seq] = _Waiter()
+        try:
+            # Больше ячейки — уменьшить: модель всё равно сжимает кадр до img_size
+            if frame.nbytes > pool.frame_bytes:
+                scale = (pool.frame_bytes / frame.nbytes) ** 0.5
+                frame = cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))),
+                                   interpolation=cv2.INTER_AREA)
+            np.ndarray(frame.shape, np.uint8, buffer=self.shm_in.buf, offset=slot * pool.frame_bytes)[:] = frame
+            try:
+                with self._send_lock:
+                    self.conn.send(("run", seq, slot, frame.shape, img_size, roi, grid))
+            except (OSError, ValueError, AttributeError) as e:
+                raise WorkerError(f"send failed: {e!r}") from e
+            if not waiter.event.wait(timeout):
+                pool.stats.timeouts += 1
+                self.kill()
+                raise WorkerError("timeout")
+            reply = waiter.reply
+            if reply is None:
+                raise WorkerError("worker died")
+            if reply[0] == "err":
+                raise WorkerError(reply[2])
+            _, _, mask_shape, ncols, (safe, oL, oC, oR, cost), zones = reply
+            base = slot * pool.out_bytes
+            mask = np.ndarray(mask_shape, np.uint8, buffer=self.shm_out.buf, offset=base).copy()
+            columns = None
+            if ncols:
+                columns = np.ndarray((ncols,), np.float64, buffer=self.shm_out.buf,
+                                     offset=base + _align(mask.size)).copy()
+            return InferenceResult(mask, (w, h), safe_ratio=safe, oL=oL, oC=oC, oR=oR,
+                                   zones=zones, zone_cost=cost, columns=columns)
+        finally:
+            with self._cond:
+                self._pending.pop(seq, None)
+                if not self.dead:
+                    self._free.append(slot)
+                    self._cond.notify_all()
+
+    def stop(self):
+        if self.conn is not None and not self.dead:
+            try:
+                with self._send_lock:
+                    self.conn.send(("stop",))
+            except (OSError, ValueError):
+                pass
+            proc = self.proc
+            if proc is not None:
+                proc.join(timeout=2.0)
+        self.kill()
+        for shm in (self.shm_in, self.shm_out):
+            shm.close()
+            shm.unlink()
+
+
+class WorkerPool(InferenceBackend):
+    """
+    Бэкенд инференса на процессах-воркерах. start() ждёт хотя бы одного
+    готового воркера (RuntimeError — нет ни одного: вызывающий переходит
+    на load_model в процессе). cache_dir — кэш трассировок TorchScript
+    (inference.load_backend): перезапуск воркера не трассирует модель заново.
+    """
+
+    def __init__(self, weights: Path, backend: str = "eager", workers: int = 1, channels_last: bool = False,
+                 slots: int = 2, max_frame: Tuple[int, int] = (1280, 960), max_img: int = 512,
+                 warmup: int = 0, timeout: float = 2.0, start_timeout: float = 60.0, check_interval: float = 1.0,
+                 max_restarts: int = 5, restart_window: float = 60.0, cache_dir: Optional[Path] = None):
+        super().__init__(torch.device("cpu"), channels_last)
+        self.name = f"{backend}x{workers}-proc"
+        self.weights = Path(weights)
+        self.backend = backend
+        self.slots = slots
+        self.frame_bytes = _align(max_frame[0] * max_frame[1] * 3)
+        self.out_bytes = _align(max_img * max_img) + max_img * 8
+        self.warmup = warmup
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.check_interval = check_interval
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.ctx = mp.get_context("spawn")
+        self.stats = WorkerStats()
+        self._workers = [_Worker(i, self) for i in range(workers)]
+        self._restarts: deque = deque()
+        self._local: Optional[InferenceBackend] = None
+        self._local_lock = threading.Lock()
+        self._running = False
+
+    def start(self) -> "WorkerPool":
+        for w in self._workers:
+            w.spawn()
+        deadline = time.time() + self.start_timeout
+        ready = [w.wait_ready(max(0.0, deadline - time.time())) for w in self._workers]
+        if not any(ready):
+            self.close()
+            raise RuntimeError("no inference worker became ready")
+        self.stats.alive = sum(ready)
+        self._running = True
+        threading.Thread(target=self._supervise, name="cave-infer-supervisor", daemon=True).start()
+        return self
+
+    def _supervise(self):
+        """Перезапуск умерших воркеров с ограничением частоты"""
+        while self._running:
+            time.sleep(self.check_interval)
+            now = time.time()
+            while self._restarts and now - self._restarts[0] > self.restart_window:
+                self._restarts.popleft()
+            for w in self._workers:
+                if not self._running:
+                    return
+                if not w.dead and w.proc is not None and not w.proc.is_alive():
+                    w.kill()
+                if w.dead and len(self._restarts) < self.max_restarts:
+                    self._restarts.append(now)
+                    self.stats.restarts += 1
+                    w.spawn()
+            self.stats.alive = sum(w.ready and not w.dead for w in self._workers)
+
+    def _pick(self) -> Optional[_Worker]:
+        usable = [w for w in self._workers if w.usable()]
+        return min(usable, key=lambda w: w.load) if usable else None
+
+    def _local_backend(self) -> InferenceBackend:
+        with self._local_lock:
+            if self._local is None:
+                self._local = load_backend(self.weights, self.backend, channels_last=self.channels_last,
+                                           cache_dir=self.cache_dir)
+            return self._local
+
+    def analyze(self, frame_bgr: np.ndarray, img_size: int,
+                roi: Optional[Tuple[float, float]] = None,
+                grid: Optional[ZoneGrid] = None) -> InferenceResult:
+        self.stats.requests += 1
+        worker = self._pick()
+        if worker is not None:
+            try:
+                return worker.run(np.ascontiguousarray(frame_bgr), img_size, roi, grid, self.timeout)
+            except WorkerError:
+                self.stats.errors += 1
+        self.stats.local += 1
+        return self._local_backend().analyze(frame_bgr, img_size, roi, grid)
+
+    def workers(self) -> List[dict]:
+        return [{"index": w.index, "ready": w.ready, "dead": w.dead, "load": w.load,
+                 "pid": w.proc.pid if w.proc is not None else None} for w in self._workers]
+
+    def close(self):
+        self._running = False
+        for w in self._workers:
+            w.stop()
@@ -0,0 +1,102 @@
+"""
+Latency Control - подстройка разрешения и частоты инференса под бюджет
+======================================================================
+
+Рабочие точки — пары (размер входа модели, минимальный шаг кадров),
+упорядоченные от самой качественной к самой дешёвой. Контроллер копит
+измерения сквозной задержки (от захвата кадра до готовой маски) в точке,
+где они сняты, и по перцентилю (p90) решает:
+  - p90 > бюджета                  → шаг к более дешёвой точке;
+  - p90 < up_margin · бюджета      → шаг к более качественной.
+
+Против «дребезга»: решение только по полному окну измерений, пауза
+cooldown после каждого переключения, а точка, с которой пришлось уйти
+из-за перегрузки, блокируется для повышения на время, удваивающееся
+с каждой новой перегрузкой в ней, но не дольше max_block: даже после
+серии неудачных проб точка снова пробуется через max_block.
+"""
+
+from __future__ import annotations
+
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class OperatingPoint:
+    img_size: int
+    stride: int
+
+    def __str__(self) -> str:
+        return f"{self.img_size}px/{self.stride}"
+
+
+DEFAULT_POINTS = (
+    OperatingPoint(320, 1),
+    OperatingPoint(256, 1),
+    OperatingPoint(256, 2),
+    OperatingPoint(192, 2),
+    OperatingPoint(192, 3),
+)
+
+
+class LatencyController:
+    """observe() после каждого инференса; point — текущая рабочая точка"""
+
+    def __init__(self, budget_ms: float, points: Sequence[OperatingPoint] = DEFAULT_POINTS,
+                 start: int = 0, window: int = 30, percentile: float = 90.0,
+                 up_margin: float = 0.7, cooldown: float = 2.0, max_block: float = 60.0):
+        if not points:
+            raise ValueError("no operating points")
+        self.budget = budget_ms / 1000.0
+        self.points = tuple(points)
+        self.index = min(max(start, 0), len(self.points) - 1)
+        self.percentile = percentile
+        self.up_margin = up_margin
+        self.cooldown = cooldown
+        self.max_block = max_block
+        self.switches = 0
+        self._samples: deque = deque(maxlen=window)
+        self._last_switch = 0.0
+        self._overloads: Dict[int, int] = {}
+        self._blocked_until: Dict[int, float] = {}
+
+    @property
+    def point(self) -> OperatingPoint:
+        return self.points[self.index]
+
+    def latency_pct(self) -> float:
+        """Перцентиль задержки в текущей точке, сек (nan без измерений)"""
+        if not self._samples:
+            return float("nan")
+        return float(np.percentile(self._samples, self.percentile))
+
+    def observe(self, latency: float, now: Optional[float] = None) -> Optional[OperatingPoint]:
+        """Добавить измерение (сек); возвращает новую точку при переключении"""
+        now = time.time() if now is None else now
+        self._samples.append(latency)
+        if len(self._samples) < self._samples.maxlen or now - self._last_switch < self.cooldown:
+            return None
+
+        pct = self.latency_pct()
+        if pct > self.budget and self.index + 1 < len(self.points):
+            fails = self._overloads.get(self.index, 0)
+            self._blocked_until[self.index] = now + min(self.cooldown * 2 ** (fails + 1), self.max_block)
+            self._overloads[self.index] = fails + 1
+            return self._switch(self.index + 1, now)
+
+        up = self.index - 1
+        if pct < self.up_margin * self.budget and up >= 0 and now >= self._blocked_until.get(up, 0.0):
+            return self._switch(up, now)
+        return None
+
+    def _switch(self, index: int, now: float) -> OperatingPoint:
+        self.index = index
+        self.switches += 1
+        self._last_switch = now
+        self._samples.clear()
+        return self.point
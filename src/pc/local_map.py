@@ -0,0 +1,227 @@
+"""
+Local Map - локальная карта проходимости вокруг робота
+======================================================
+
+Решения по одной текущей маске забывают препятствие, как только оно
+ушло из кадра. LocalMap копит маски в сетке «вид сверху» фиксированного
+размера вокруг робота:
+
+  маска → гомография плоскости пола (калибровка по 4 точкам) → клетки
+  сетки → log-odds: занято +l_occ, свободно +l_free, с ограничением
+
+Сетка выровнена по осям мира и хранится кольцевым буфером numpy:
+клетка мира (i, j) лежит в [i mod N, j mod N]. Когда робот переходит
+в другую клетку, окно сдвигается без копирования — обнуляются только
+въехавшие строки/столбцы; повороты сетку не трогают, от курса зависит
+лишь проекция новых масок. Положение робота — счисление пути по
+отправленным командам (мощности моторов хаба → скорость и угловая
+скорость, MapConfig.speed_per_power / yaw_per_power).
+
+Память постоянна (N×N float32), обновление — одна выборка пикселей
+маски в заранее посчитанных точках пола и два bincount.
+
+Оси робота: x — вперёд, y — налево, курс theta — против часовой.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Точки пола: нормированные координаты кадра (u вправо, v вниз, 0..1) и
+# метры от робота (x вперёд, y налево). Грубая оценка для камеры на
+# высоте ~10 см с наклоном вниз — заменить калибровкой по разметке на полу.
+IMAGE_POINTS = ((0.0, 1.0), (1.0, 1.0), (0.75, 0.5), (0.25, 0.5))
+GROUND_POINTS = ((0.12, 0.10), (0.12, -0.10), (1.0, -0.55), (1.0, 0.55))
+
+
+@dataclass
+class MapConfig:
+    size: int = 128                 # клеток по стороне (128 × 5 см = 6.4 м)
+    cell: float = 0.05              # м
+    l_occ: float = 0.85             # log-odds за наблюдение «занято»
+    l_free: float = -0.4            # ... «свободно»
+    l_min: float = -4.0
+    l_max: float = 4.0
+    max_range: float = 2.0          # м: дальше гомография слишком неточна
+    stride: int = 2                 # шаг выборки пикселей маски
+    fov: float = math.radians(120)  # сектор запросов курса (шире камеры: помнит бока)
+    speed_per_power: float = 0.004  # м/с на 1% мощности хаба
+    yaw_per_power: float = 0.025    # рад/с на 1% разности мощностей
+    image_points: Tuple[Tuple[float, float], ...] = IMAGE_POINTS
+    ground_points: Tuple[Tuple[float, float], ...] = GROUND_POINTS
+
+
+def ground_homography(image_points, ground_points) -> np.ndarray:
+    """Гомография нормированный кадр → пол (м) по четырём парам точек"""
+    return cv2.getPerspectiveTransform(np.float32(image_points), np.float32(ground_points))
+
+
+class LocalMap:
+    def __init__(self, config: Optional[MapConfig] = None):
+        self.config = config or MapConfig()
+        n = self.config.size
+        self.homography = ground_homography(self.config.image_points, self.config.ground_points)
+        self.logodds = np.zeros((n, n), dtype=np.float32)
+        self._flat = self.logodds.reshape(-1)
+        self._lock = threading.Lock()
+        # Положение робота в мире и первая клетка окна
+        self.x = self.y = self.theta = 0.0
+        self._ox = self._oy = -(n // 2)
+        # Движение по последней команде и момент, до которого путь учтён
+        self._v = self._w = 0.0
+        self._ts: Optional[float] = None
+        # Точки пола для формы маски: (индексы пикселей, x, y)
+        self._samples: Dict[Tuple[int, int], Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self._rays: Dict[tuple, Tuple[np.ndarray, np.ndarray]] = {}
+        self.updates = 0
+
+    # ── Движение ───────────────────────────────────────────────────────────
+
+    def set_motion(self, left: float, right: float, ts: Optional[float] = None):
+        """
+        Мощности моторов хаба после команды (spike_protocol.hub_powers).
+        Вперёд робота — отрицательная мощность хаба (CMD_FWD = "rev"),
+        rgt (+, −) поворачивает направо
+        """
+        ts = time.time() if ts is None else ts
+        cfg = self.config
+        with self._lock:
+            self._advance(ts)
+            self._v = -(left + right) / 2.0 * cfg.speed_per_power
+            self._w = -(left - right) / 2.0 * cfg.yaw_per_power
+
+    def _advance(self, ts: float):
+        """Счисление пути до ts по текущим скорости и угловой скорости"""
+        if self._ts is None:
+            self._ts = ts
+            return
+        if ts <= self._ts:
+            return
+        dt, self._ts = ts - self._ts, ts
+        v, w = self._v, self._w
+        if abs(w) < 1e-6:
+            self.x += v * dt * math.cos(self.theta)
+            self.y += v * dt * math.sin(self.theta)
+        else:
+            th = self.theta + w * dt
+            self.x += v / w * (math.sin(th) - math.sin(self.theta))
+            self.y -= v / w * (math.cos(th) - math.cos(self.theta))
+            self.theta = math.atan2(math.sin(th), math.cos(th))
+        self._recenter()
+
+    def _recenter(self):
+        """Сдвиг окна к клетке робота: обнуляются только въехавшие полосы"""
+        n = self.config.size
+        ox = int(math.floor(self.x / self.config.cell)) - n // 2
+        oy = int(math.floor(self.y / self.config.cell)) - n // 2
+        for axis, old, new in ((0, self._ox, ox), (1, self._oy, oy)):
+            if new == old:
+                continue
+            start, count = (old + n, new - old) if new > old else (new, old - new)
+            idx = (start + np.arange(min(count, n))) % n
+            if axis == 0:
+                self.logodds[idx, :] = 0.0
+            else:
+                self.logodds[:, idx] = 0.0
+        self._ox, self._oy = ox, oy
+
+    # ── Наблюдения ─────────────────────────────────────────────────────────
+
+    def _ground_samples(self, shape: Tuple[int, int]):
+        """Пиксели маски с шагом stride, попадающие на пол в пределах max_range"""
+        cached = self._samples.get(shape)
+        if cached is not None:
+            return cached
+        h, w = shape
+        s = self.config.stride
+        vs, us = np.mgrid[s // 2:h:s, s // 2:w:s]
+        pts = np.stack([(us + 0.5) / w, (vs + 0.5) / h], axis=-1).reshape(-1, 1, 2).astype(np.float32)
+        # Точки у горизонта и выше уходят в бесконечность или за спину: на полу
+        # знак знаменателя гомографии тот же, что у низа кадра
+        H = self.homography
+        denom = H[2, 0] * pts[:, 0, 0] + H[2, 1] * pts[:, 0, 1] + H[2, 2]
+        floor = np.sign(H[2, 0] * 0.5 + H[2, 1] + H[2, 2])
+        ground = cv2.perspectiveTransform(pts, H).reshape(-1, 2)
+        ok = ((denom * floor > 0) & (ground[:, 0] > 0)
+              & (np.hypot(ground[:, 0], ground[:, 1]) <= self.config.max_range))
+        cached = ((vs * w + us).reshape(-1)[ok], ground[ok, 0].astype(np.float64), ground[ok, 1].astype(np.float64))
+        self._samples[shape] = cached
+        return cached
+
+    def _cells(self, gx: np.ndarray, gy: np.ndarray):
+        """Точки в осях робота → (индексы в буфере, маска попадания в окно)"""
+        cfg = self.config
+        n = cfg.size
+        c, s = math.cos(self.theta), math.sin(self.theta)
+        cx = np.floor((self.x + c * gx - s * gy) / cfg.cell).astype(np.int64)
+        cy = np.floor((self.y + s * gx + c * gy) / cfg.cell).astype(np.int64)
+        inside = (cx >= self._ox) & (cx < self._ox + n) & (cy >= self._oy) & (cy < self._oy + n)
+        return (cx % n) * n + (cy % n), inside
+
+    def update(self, mask: np.ndarray, ts: Optional[float] = None):
+        """Маска 0/1 (1 — препятствие, любое разрешение) снятая в момент ts"""
+        cfg = self.config
+        idx, gx, gy = self._ground_samples(mask.shape[:2])
+        occ = mask.reshape(-1)[idx] != 0
+        with self._lock:
+            self._advance(time.time() if ts is None else ts)
+            cells, inside = self._cells(gx, gy)
+            cells, occ = cells[inside], occ[inside]
+            size = cfg.size * cfg.size
+            hits = np.bincount(cells, minlength=size)
+            occ_hits = np.bincount(cells, weights=occ, minlength=size)
+            seen = np.flatnonzero(hits)
+            delta = np.where(occ_hits[seen] * 2 >= hits[seen], cfg.l_occ, cfg.l_free).astype(np.float32)
+            self._flat[seen] = np.clip(self._flat[seen] + delta, cfg.l_min, cfg.l_max)
+            self.updates += 1
+
+    # ── Запросы ────────────────────────────────────────────────────────────
+
+    def _ray_points(self, bins: int, fov: float, max_range: float):
+        key = (bins, fov, max_range)
+        if key not in self._rays:
+            angles = np.linspace(fov / 2.0, -fov / 2.0, bins)        # слева направо, как столбцы кадра
+            radii = np.arange(self.config.cell, max_range, self.config.cell / 2.0)
+            self._rays[key] = (np.outer(np.cos(angles), radii), np.outer(np.sin(angles), radii))
+        return self._rays[key]
+
+    def heading_profile(self, bins: int = 32, fov: Optional[float] = None,
+                        max_range: Optional[float] = None) -> np.ndarray:
+        """
+        Доля занятых клеток (log-odds > 0) вдоль лучей от робота, bins
+        лучей слева направо в секторе fov — тот же смысл, что у профиля
+        столбцов маски (InferenceResult.columns) для gap_planner
+        """
+        cfg = self.config
+        gx, gy = self._ray_points(bins, cfg.fov if fov is None else fov,
+                                  cfg.max_range if max_range is None else max_range)
+        with self._lock:
+            self._advance(time.time())
+            cells, inside = self._cells(gx.reshape(-1), gy.reshape(-1))
+            occupied = (self._flat[cells] > 0) & inside
+        return occupied.reshape(gx.shape).mean(axis=1)
+
+    def zones(self) -> Tuple[float, float, float]:
+        """Доли препятствий L/C/R по карте — замена долей текущего кадра для autopilot()"""
+        oL, oC, oR = self.heading_profile(3 * 8).reshape(3, 8).mean(axis=1)
+        return float(oL), float(oC), float(oR)
+
+    def view(self) -> np.ndarray:
+        """Вероятность занятости N×N с роботом в центре (ось 0 — x мира, ось 1 — y)"""
+        n = self.config.size
+        with self._lock:
+            grid = np.roll(self.logodds, (-(self._ox % n), -(self._oy % n)), axis=(0, 1))
+        return 1.0 / (1.0 + np.exp(-grid))
+
+    def pose(self) -> Tuple[float, float, float]:
+        """(x, y, theta) робота в мире на текущий момент"""
+        with self._lock:
+            self._advance(time.time())
+            return self.x, self.y, self.theta
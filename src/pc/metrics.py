@@ -0,0 +1,303 @@
+"""
+Metrics - счётчики, скользящие частоты и гистограммы задержек
+==============================================================
+
+Лёгкий слой инструментирования без внешних зависимостей:
+  Counter    монотонный счётчик (события, ошибки, переподключения)
+  Gauge      текущее значение (или функция, читаемая при экспорте)
+  Rate       частота событий в скользящем окне (секундные корзины)
+  Histogram  гистограмма задержек в мс: корзины Prometheus + окно
+             последних значений для p50/p95/p99
+
+Registry отдаёт всё в текстовом формате Prometheus и JSON-снимком;
+MetricsServer публикует их по HTTP на 127.0.0.1:
+  GET /metrics       text/plain; version=0.0.4
+  GET /metrics.json  JSON
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import math
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Границы корзин гистограмм задержек, мс
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 300, 500, 1000, 2000, 5000)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str = ""):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: int = 1):
+        with self._lock:
+            self.value += n
+
+    def samples(self):
+        yield self.name + "_total", self.value
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str = "", fn: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.help = help
+        self.value = 0.0
+        self._fn = fn
+
+    def set(self, value: float):
+        self.value = value
+
+    def get(self) -> float:
+        if self._fn is not None:
+            try:
+                return float(self._fn())
+            except Exception:
+                return float("nan")
+        return self.value
+
+    def samples(self):
+        yield self.name, self.get()
+
+    def snapshot(self):
+        return round_or_none(self.get(), 6)
+
+
+class Rate:
+    """Событий в секунду за последние window секунд (без учёта текущей секунды)"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str = "", window: int = 5):
+        self.name = name
+        self.help = help
+        self.window = window
+        self.total = 0
+        self._buckets = np.zeros(window + 1, dtype=np.int64)
+        self._sec = int(time.time())
+        self._lock = threading.Lock()
+
+    def _advance(self, sec: int):
+        gap = sec - self._sec
+        if gap <= 0:
+            return
+        n = len(self._buckets)
+        if gap >= n:
+            self._buckets[:] = 0
+        else:
+            for s in range(self._sec + 1, sec + 1):
+                self._buckets[s % n] = 0
+        self._sec = sec
+
+    def mark(self, n: int = 1, now: Optional[float] = None):
+        sec = int(time.time() if now is None else now)
+        with self._lock:
+            self._advance(sec)
+            self._buckets[sec % len(self._buckets)] += n
+            self.total += n
+
+    def rate(self, now: Optional[float] = None) -> float:
+        sec = int(time.time() if now is None else now)
+        with self._lock:
+            self._advance(sec)
+            current = self._buckets[sec % len(self._buckets)]
+            return float(self._buckets.sum() - current) / self.window
+
+    def samples(self):
+        yield self.name, self.rate()
+
+    def snapshot(self):
+        return round(self.rate(), 3)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str = "", buckets: Sequence[float] = DEFAULT_BUCKETS_MS,
+                 window: int = 512):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._recent: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, value_ms: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, value_ms)] += 1
+            self.count += 1
+            self.sum += value_ms
+            self._recent.append(value_ms)
+
+    def time(self) -> "_Timer":
+        """with hist.time(): ... — наблюдение длительности блока"""
+        return _Timer(self)
+
+    def percentiles(self, qs=(50, 95, 99)) -> List[float]:
+        with self._lock:
+            recent = list(self._recent)
+        if not recent:
+            return [float("nan")] * len(qs)
+        return [float(v) for v in np.percentile(recent, qs)]
+
+    def samples(self):
+        with self._lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        acc = 0
+        for bound, c in zip(self.bounds, counts):
+            acc += c
+            yield f'{self.name}_bucket{{le="{bound:g}"}}', acc
+        yield f'{self.name}_bucket{{le="+Inf"}}', count
+        yield self.name + "_sum", total
+        yield self.name + "_count", count
+
+    def snapshot(self):
+        p50, p95, p99 = self.percentiles()
+        return {"count": self.count, "p50": round_or_none(p50), "p95": round_or_none(p95),
+                "p99": round_or_none(p99), "mean": round_or_none(self.sum / self.count) if self.count else None}
+
+
+class _Timer:
+    def __init__(self, hist: Histogram):
+        self.hist = hist
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe((time.perf_counter() - self.t0) * 1000.0)
+
+
+def round_or_none(v: Optional[float], nd: int = 3) -> Optional[float]:
+    """Округление для JSON: nan → None"""
+    return None if v is None or math.isnan(v) else round(v, nd)
+
+
+class Registry:
+    """Набор метрик с общим префиксом имён"""
+
+    def __init__(self, prefix: str = "cave_"):
+        self.prefix = prefix
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, *args, **kwargs):
+        full = self.prefix + name
+        with self._lock:
+            m = self._metrics.get(full)
+            if m is None:
+                m = cls(full, *args, **kwargs)
+                self._metrics[full] = m
+            elif not isinstance(m, cls):
+                raise ValueError(f"metric {full} already registered as {type(m).__name__}")
+            return m
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        return self._get(Counter, name, help)
+
+    def gauge(self, name: str, help: str = "", fn: Optional[Callable[[], float]] = None) -> Gauge:
+        return self._get(Gauge, name, help, fn)
+
+    def rate(self, name: str, help: str = "", window: int = 5) -> Rate:
+        return self._get(Rate, name, help, window)
+
+    def histogram(self, name: str, help: str = "", buckets: Sequence[float] = DEFAULT_BUCKETS_MS) -> Histogram:
+        return self._get(Histogram, name, help, buckets)
+
+    def prometheus_text(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for m in metrics:
+            if m.help:
+                lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for key, value in m.samples():
+                lines.append(f"{key} {_prom_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            metrics = list(self._metrics.items())
+        return {name[len(self.prefix):]: m.snapshot() for name, m in metrics}
+
+
+def _prom_value(v) -> str:
+    v = float(v)
+    if math.isnan(v):
+        return "NaN"
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return str(int(v)) if v.is_integer() else repr(v)
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   HTTP-ЭКСПОРТ
+# ═══════════════════════════════════════════════════════════════════════════
+
+class MetricsServer:
+    """HTTP-сервер метрик в фоновом потоке (по умолчанию только localhost)"""
+
+    def __init__(self, registry: Registry, port: int = 9108, host: str = "127.0.0.1",
+                 extra: Optional[Callable[[], dict]] = None):
+        self.registry = registry
+        self.extra = extra
+        outer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path == "/metrics":
+                    body = outer.registry.prometheus_text().encode()
+                    ctype = "text/plain; version=0.0.4; charset=utf-8"
+                elif path == "/metrics.json":
+                    data = outer.registry.snapshot()
+                    if outer.extra is not None:
+                        data.update(outer.extra())
+                    body = json.dumps(data).encode()
+                    ctype = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
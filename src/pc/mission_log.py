@@ -0,0 +1,428 @@
+"""
+Mission Log - запись миссии и headless-воспроизведение
+======================================================
+
+Формат файла .cavelog (little-endian, только дозапись):
+
+  заголовок   8s magic "CAVELOG1", H версия, 6x
+  запись      B тип, 3x, I длина, q frame_id, d время (сек, time.time())
+              + полезная нагрузка
+  индекс      массив INDEX_DTYPE по всем записям (пишется при close)
+  трейлер     Q смещение индекса, I число записей, 8s magic "CAVEIDX1"
+
+Типы записей:
+  FRAME   сырой JPEG кадра (время = захват кадра)
+  RESULT  RESULT_HEAD + H число столбцов + float32 профиль столбцов
+          (InferenceResult.columns, с версии 2) + zlib(маска 0/1 в
+          разрешении модели)
+  BLE_TX  отправленная команда (3 байта ASCII или кадр spike_protocol)
+  BLE_RX  ответ хаба (без префикса 0x01)
+
+Если запись оборвалась (нет трейлера), индекс восстанавливается проходом
+по записям до первой неполной. Чтение через mmap: кадры отдаются
+memoryview без копирования.
+
+Запуск:
+  python mission_log.py info missions/mission_20250101_120000.cavelog
+  python mission_log.py replay missions/mission_20250101_120000.cavelog
+  python mission_log.py replay missions/... --realtime --backend onnx --img-size 256
+  python mission_log.py replay missions/... --planner zones
+"""
+
+from __future__ import annotations
+
+import argparse
+import mmap
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+MAGIC = b"CAVELOG1"
+INDEX_MAGIC = b"CAVEIDX1"
+VERSION = 2
+
+FILE_HEAD = struct.Struct("<8sH6x")
+RECORD_HEAD = struct.Struct("<BxxxIqd")
+TRAILER = struct.Struct("<QI8s")
+# mask h, mask w, frame w, frame h, safe, oL, oC, oR, zone_cost
+RESULT_HEAD = struct.Struct("<HHHHfffff")
+RESULT_COLUMNS = struct.Struct("<H")
+
+FRAME = 1
+RESULT = 2
+BLE_TX = 3
+BLE_RX = 4
+RECORD_NAMES = {FRAME: "frame", RESULT: "result", BLE_TX: "ble_tx", BLE_RX: "ble_rx"}
+
+INDEX_DTYPE = np.dtype([("type", "u1"), ("frame_id", "<i8"), ("ts", "<f8"),
+                        ("offset", "<u8"), ("length", "<u4")])
+
+
+@dataclass
+class LoggedResult:
+    """Результат инференса из лога"""
+    frame_id: int
+    ts: float
+    mask: np.ndarray
+    frame_size: Tuple[int, int]
+    safe_ratio: float
+    oL: float
+    oC: float
+    oR: float
+    zone_cost: float
+    columns: Optional[np.ndarray] = None    # профиль столбцов (логи версии 2)
+
+
+def encode_result(result) -> bytes:
+    """InferenceResult → полезная нагрузка RESULT"""
+    mask = np.ascontiguousarray(result.mask, dtype=np.uint8)
+    h, w = mask.shape[:2]
+    fw, fh = result.frame_size
+    head = RESULT_HEAD.pack(h, w, fw, fh, result.safe_ratio, result.oL, result.oC, result.oR,
+                            result.zone_cost)
+    columns = np.zeros(0, "<f4") if result.columns is None else np.asarray(result.columns, dtype="<f4")
+    return head + RESULT_COLUMNS.pack(columns.size) + columns.tobytes() + zlib.compress(mask.tobytes(), 1)
+
+
+def decode_result(frame_id: int, ts: float, payload, version: int = VERSION) -> LoggedResult:
+    h, w, fw, fh, safe, oL, oC, oR, cost = RESULT_HEAD.unpack_from(payload)
+    pos = RESULT_HEAD.size
+    columns = None
+    if version >= 2:
+        (n,) = RESULT_COLUMNS.unpack_from(payload, pos)
+        pos += RESULT_COLUMNS.size
+        if n:
+            columns = np.frombuffer(payload, dtype="<f4", count=n, offset=pos).astype(np.float64)
+        pos += n * 4
+    raw = zlib.decompress(payload[pos:])
+    mask = np.frombuffer(raw, dtype=np.uint8).reshape(h, w)
+    return LoggedResult(frame_id, ts, mask, (fw, fh), safe, oL, oC, oR, cost, columns)
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   ЗАПИСЬ
+# ═══════════════════════════════════════════════════════════════════════════
+
+class MissionRecorder:
+    """
+    Потокобезопасная дозапись в новый .cavelog. Буфер сбрасывается на диск
+    не реже flush_interval, так что после аварии теряется не больше секунды.
+    """
+
+    def __init__(self, path: Path, flush_interval: float = 1.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(self.path, "xb", buffering=1 << 20)
+        self._f.write(FILE_HEAD.pack(MAGIC, VERSION))
+        self._offset = FILE_HEAD.size
+        self._index: List[tuple] = []
+        self._lock = threading.Lock()
+        self._flush_interval = flush_interval
+        self._last_flush = time.time()
+        self.bytes_written = self._offset
+
+    def write(self, rtype: int, frame_id: int, ts: float, payload) -> None:
+        with self._lock:
+            if self._f is None:
+                return
+            length = len(payload)
+            self._f.write(RECORD_HEAD.pack(rtype, length, frame_id, ts))
+            self._f.write(payload)
+            self._index.append((rtype, frame_id, ts, self._offset, length))
+            self._offset += RECORD_HEAD.size + length
+            self.bytes_written = self._offset
+            now = time.time()
+            if now - self._last_flush >= self._flush_interval:
+                self._f.flush()
+                self._last_flush = now
+
+    def frame(self, frame_id: int, capture_ts: float, jpeg) -> None:
+        self.write(FRAME, frame_id, capture_ts, jpeg)
+
+    def result(self, frame_id: int, result, ts: Optional[float] = None) -> None:
+        self.write(RESULT, frame_id, time.time() if ts is None else ts, encode_result(result))
+
+    def on_ble(self, direction: str, payload: bytes, ts: float) -> None:
+        """Наблюдатель SpikeBLEController: direction "tx" или "rx" """
+        self.write(BLE_TX if direction == "tx" else BLE_RX, -1, ts, payload)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._f is None:
+                return
+            index = np.array(self._index, dtype=INDEX_DTYPE)
+            self._f.write(index.tobytes())
+            self._f.write(TRAILER.pack(self._offset, len(index), INDEX_MAGIC))
+            self._f.close()
+            self._f = None
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   ЧТЕНИЕ
+# ═══════════════════════════════════════════════════════════════════════════
+
+class MissionLog:
+    """Лог миссии через mmap; index — структурированный массив INDEX_DTYPE"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = FILE_HEAD.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path}: not a mission log")
+        if version > VERSION:
+            raise ValueError(f"{self.path}: unsupported log version {version}")
+        self.version = version
+        self.recovered = False
+        self.index = self._read_index()
+        if self.index is None:
+            self.index = self._scan()
+            self.recovered = True
+
+    def _read_index(self) -> Optional[np.ndarray]:
+        size = len(self._mm)
+        if size < FILE_HEAD.size + TRAILER.size:
+            return None
+        offset, count, magic = TRAILER.unpack_from(self._mm, size - TRAILER.size)
+        if magic != INDEX_MAGIC or offset + count * INDEX_DTYPE.itemsize + TRAILER.size != size:
+            return None
+        return np.frombuffer(self._mm, dtype=INDEX_DTYPE, count=count, offset=offset).copy()
+
+    def _scan(self) -> np.ndarray:
+        """Восстановление индекса проходом по записям (лог без трейлера)"""
+        size = len(self._mm)
+        entries = []
+        pos = FILE_HEAD.size
+        while pos + RECORD_HEAD.size <= size:
+            rtype, length, frame_id, ts = RECORD_HEAD.unpack_from(self._mm, pos)
+            if rtype not in RECORD_NAMES or pos + RECORD_HEAD.size + length > size:
+                break
+            entries.append((rtype, frame_id, ts, pos, length))
+            pos += RECORD_HEAD.size + length
+        return np.array(entries, dtype=INDEX_DTYPE)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def payload(self, i: int) -> memoryview:
+        e = self.index[i]
+        start = int(e["offset"]) + RECORD_HEAD.size
+        return memoryview(self._mm)[start:start + int(e["length"])]
+
+    def records(self, rtype: Optional[int] = None) -> Iterator[Tuple[int, int, float, memoryview]]:
+        """(тип, frame_id, время, payload) в порядке записи"""
+        idx = np.arange(len(self.index))
+        if rtype is not None:
+            idx = idx[self.index["type"] == rtype]
+        for i in idx:
+            e = self.index[i]
+            yield int(e["type"]), int(e["frame_id"]), float(e["ts"]), self.payload(i)
+
+    def frames(self) -> Iterator[Tuple[int, float, memoryview]]:
+        for _, frame_id, ts, data in self.records(FRAME):
+            yield frame_id, ts, data
+
+    def results(self) -> Dict[int, LoggedResult]:
+        return {fid: decode_result(fid, ts, data, self.version) for _, fid, ts, data in self.records(RESULT)}
+
+    def counts(self) -> Dict[str, int]:
+        types, n = np.unique(self.index["type"], return_counts=True)
+        return {RECORD_NAMES.get(int(t), str(t)): int(c) for t, c in zip(types, n)}
+
+    def duration(self) -> float:
+        if not len(self.index):
+            return 0.0
+        ts = self.index["ts"]
+        return float(ts.max() - ts.min())
+
+    def close(self):
+        try:
+            self._mm.close()
+        except BufferError:
+            # Остались живые memoryview — mmap закроется вместе с ними
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   ВОСПРОИЗВЕДЕНИЕ
+# ═══════════════════════════════════════════════════════════════════════════
+
+@dataclass
+class ReplayStats:
+    frames: int = 0
+    decode_errors: int = 0
+    seconds: float = 0.0
+    stage_ms: Dict[str, List[float]] = field(default_factory=lambda: {"decode": [], "infer": [], "autopilot": []})
+    zone_err: List[float] = field(default_factory=list)
+    compared: int = 0
+    same_decision: int = 0
+
+    def summary(self) -> str:
+        lines = [f"frames {self.frames} in {self.seconds:.2f} s"
+                 f" ({self.frames / max(self.seconds, 1e-9):.1f} fps), decode errors {self.decode_errors}"]
+        for stage, ms in self.stage_ms.items():
+            if ms:
+                lines.append(f"  {stage:<10} p50 {np.percentile(ms, 50):7.2f} ms   p95 {np.percentile(ms, 95):7.2f} ms")
+        if self.compared:
+            lines.append(f"  vs recorded: mean |zone diff| {np.mean(self.zone_err) * 100:.2f}%"
+                         f"   same autopilot decision {self.same_decision / self.compared * 100:.1f}%"
+                         f" ({self.compared} frames)")
+        return "\n".join(lines)
+
+
+def replay(log: MissionLog, model, img_size: int, roi: Tuple[float, float],
+           make_autopilot: Callable[[], Callable], realtime: bool = False, on_step=None,
+           same: Callable[[object, object], bool] = lambda a, b: a == b) -> ReplayStats:
+    """
+    Прогон кадров лога через тот же конвейер, что и video_loop:
+    model.analyze → autopilot(result). make_autopilot() создаёт решатель
+    (у планировщика щелей есть состояние — отдельный экземпляр для
+    записанных результатов); решение None — сравнить нечем. same —
+    совпадение решений. Если в логе есть результаты, автопилот делает шаг
+    только на кадрах с записанным результатом — как в миссии, где кадры
+    без инференса не дают нового снимка зон, — иначе состояние планировщика
+    разойдётся с эталонным. Лог без результатов — шаг на каждом кадре.
+    realtime выдерживает исходные интервалы между кадрами, иначе —
+    максимально быстро.
+    on_step(frame_id, frame, result, решение или None) — для отображения.
+    """
+    from frame_source import decode_jpeg
+
+    recorded = log.results()
+    autopilot, ref_autopilot = make_autopilot(), make_autopilot()
+    stats = ReplayStats()
+    t_start = time.perf_counter()
+    ts0 = None
+
+    for frame_id, ts, jpeg in log.frames():
+        if realtime:
+            if ts0 is None:
+                ts0 = ts
+            delay = (ts - ts0) - (time.perf_counter() - t_start)
+            if delay > 0:
+                time.sleep(delay)
+
+        t0 = time.perf_counter()
+        frame = decode_jpeg(jpeg, img_size)
+        t1 = time.perf_counter()
+        if frame is None:
+            stats.decode_errors += 1
+            continue
+        result = model.analyze(frame, img_size, roi=roi)
+        t2 = time.perf_counter()
+        ref = recorded.get(frame_id)
+        decision = None
+        if ref is not None or not recorded:
+            decision = autopilot(result)
+            stats.stage_ms["autopilot"].append((time.perf_counter() - t2) * 1000.0)
+
+        stats.frames += 1
+        stats.stage_ms["decode"].append((t1 - t0) * 1000.0)
+        stats.stage_ms["infer"].append((t2 - t1) * 1000.0)
+
+        if ref is not None:
+            stats.zone_err.append(np.mean(np.abs(np.subtract((result.oL, result.oC, result.oR),
+                                                             (ref.oL, ref.oC, ref.oR)))))
+            ref_decision = ref_autopilot(ref)
+            if decision is not None and ref_decision is not None:
+                stats.compared += 1
+                stats.same_decision += same(decision, ref_decision)
+
+        if on_step is not None:
+            on_step(frame_id, frame, result, decision)
+
+    stats.seconds = time.perf_counter() - t_start
+    return stats
+
+
+def _cmd_info(args):
+    from spike_protocol import describe
+
+    with MissionLog(args.log) as log:
+        print(f"{log.path}: {len(log)} records, {log.duration():.1f} s"
+              f"{' (index recovered by scan)' if log.recovered else ''}")
+        for name, n in log.counts().items():
+            print(f"  {name:<8} {n}")
+        tx = Counter(describe(p) for _, _, _, p in log.records(BLE_TX))
+        if tx:
+            print("  commands: " + "  ".join(f"{c} {n}" for c, n in sorted(tx.items())))
+
+
+def _cmd_replay(args):
+    import cave_config as cfg
+    from cave_pipeline import autopilot, plan_arc
+    from gap_planner import GapPlanner
+    from inference import load_model
+
+    planner = args.planner or cfg.AUTOPILOT_PLANNER
+    if planner == "gaps":
+        # Как _autopilot_gaps: план → мощности дуги; решения совпадают,
+        # если отличаются меньше ARC_DEADBAND (конвейер не отправил бы новую дугу)
+        def make_autopilot():
+            gaps = GapPlanner()
+            return lambda r: plan_arc(gaps.plan(r.columns)) if r.columns is not None else None
+
+        def same(a, b):
+            return max(abs(x - y) for x, y in zip(a, b)) < cfg.ARC_DEADBAND
+    elif planner == "zones":
+        def make_autopilot():
+            return lambda r: autopilot(r.oL, r.oC, r.oR)
+
+        def same(a, b):
+            return a == b
+    else:
+        raise SystemExit(f"unknown planner {planner!r}, expected gaps or zones")
+    if cfg.LOCAL_MAP is not None:
+        print("[warn] replay decides by the current frame only: the local map (LOCAL_MAP) is not replayed")
+
+    model, _ = load_model(args.weights or cfg.MODEL_PATH, backend=args.backend or cfg.BACKEND,
+                          channels_last=cfg.CHANNELS_LAST)
+    with MissionLog(args.log) as log:
+        if planner == "gaps" and log.version < 2:
+            print(f"[warn] {log.path}: log version {log.version} has no column profiles,"
+                  " recorded decisions of the gap planner are not compared")
+        stats = replay(log, model, args.img_size or cfg.IMG_SIZE, (cfg.ROI_Y1, cfg.ROI_Y2),
+                       make_autopilot, realtime=args.realtime, same=same)
+    print(f"planner {planner}")
+    print(stats.summary())
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("info", help="содержимое лога")
+    p.add_argument("log", type=Path)
+    p.set_defaults(fn=_cmd_info)
+
+    p = sub.add_parser("replay", help="прогон кадров через модель и автопилот")
+    p.add_argument("log", type=Path)
+    p.add_argument("--realtime", action="store_true", help="в исходном темпе")
+    p.add_argument("--weights", type=Path, default=None)
+    p.add_argument("--backend", default=None)
+    p.add_argument("--img-size", type=int, default=None)
+    p.add_argument("--planner", choices=("gaps", "zones"), default=None,
+                   help="автопилот (по умолчанию AUTOPILOT_PLANNER из cave_config)")
+    p.set_defaults(fn=_cmd_replay)
+
+    args = ap.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
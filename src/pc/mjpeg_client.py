@@ -0,0 +1,247 @@
+"""
+MJPEG Stream Client - клиент потока multipart/x-mixed-replace
+=============================================================
+
+Читает поток ESP32-CAM (src/esp/stream.ino) напрямую по HTTP без
+cv2.VideoCapture. Каждая часть потока содержит Content-Length, поэтому
+JPEG читается целиком одним readinto() в переиспользуемый буфер из пула.
+Декодирование не выполняется: кадр декодирует только тот, кто его
+действительно использует (см. FramePacket.decode).
+"""
+
+from __future__ import annotations
+
+import time
+import threading
+import http.client
+from dataclasses import dataclass
+from typing import List, Optional
+from urllib.parse import urlsplit
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   БУФЕРЫ JPEG
+# ═══════════════════════════════════════════════════════════════════════════
+
+class JpegBuffer:
+    """Переиспользуемый буфер с байтами одного JPEG"""
+
+    def __init__(self, pool: Optional["JpegBufferPool"], capacity: int):
+        self._pool = pool
+        self.data = bytearray(capacity)
+        self.length = 0
+
+    def reserve(self, n: int):
+        # bytearray с экспортированным memoryview нельзя ресайзить, поэтому новый объект
+        if n > len(self.data):
+            self.data = bytearray(max(n, 2 * len(self.data)))
+
+    def view(self) -> memoryview:
+        return memoryview(self.data)[:self.length]
+
+    def release(self):
+        """Вернуть буфер в пул (повторный вызов безопасен)"""
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool._give_back(self)
+
+
+class JpegBufferPool:
+    """Пул буферов: в устойчивом режиме новые bytearray не создаются"""
+
+    def __init__(self, count: int = 4, capacity: int = 64 * 1024):
+        self._lock = threading.Lock()
+        self._capacity = capacity
+        self._free: List[JpegBuffer] = [JpegBuffer(None, capacity) for _ in range(count)]
+        self.allocated = count
+
+    def acquire(self) -> JpegBuffer:
+        with self._lock:
+            buf = self._free.pop() if self._free else None
+            if buf is None:
+                self.allocated += 1
+        if buf is None:
+            buf = JpegBuffer(None, self._capacity)
+        buf._pool = self
+        buf.length = 0
+        return buf
+
+    def _give_back(self, buf: JpegBuffer):
+        with self._lock:
+            self._free.append(buf)
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   КЛИЕНТ ПОТОКА
+# ═══════════════════════════════════════════════════════════════════════════
+
+@dataclass
+class StreamStats:
+    connected: bool = False
+    frames: int = 0
+    bytes: int = 0
+    reconnects: int = 0
+    errors: int = 0
+    err: str = ""
+
+
+class MjpegStreamClient:
+    """
+    Блокирующий клиент MJPEG-потока.
+
+    read() возвращает JpegBuffer со следующим кадром или None, если соединение
+    потеряно (переподключение выполняется автоматически на следующем вызове).
+    Вызывающий обязан вызвать release() у полученного буфера.
+    """
+
+    def __init__(self, url: str, pool: Optional[JpegBufferPool] = None,
+                 timeout: float = 5.0, reconnect_delay: float = 1.0,
+                 max_frame_bytes: int = 4 * 1024 * 1024):
+        parts = urlsplit(url)
+        if parts.scheme != "http" or not parts.hostname:
+            raise ValueError(f"Unsupported stream URL: {url}")
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        self.pool = pool or JpegBufferPool()
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_frame_bytes = max_frame_bytes
+        self.stats = StreamStats()
+
+        self._conn: Optional[http.client.HTTPConnection] = None
+        self._resp: Optional[http.client.HTTPResponse] = None
+        self._boundary = b""
+        self._at_headers = False
+        self._last_connect_ts = 0.0
+
+    # ── соединение ────────────────────────────────────────────────────────
+
+    def _connect(self):
+        wait = self.reconnect_delay - (time.time() - self._last_connect_ts)
+        if wait > 0:
+            time.sleep(wait)
+        self._last_connect_ts = time.time()
+        if self.stats.frames or self.stats.errors:
+            self.stats.reconnects += 1
+
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        conn.request("GET", self.path)
+        resp = conn.getresponse()
+        ctype = resp.getheader("Content-Type", "")
+        if resp.status != 200 or "multipart" not in ctype.lower():
+            conn.close()
+            raise ConnectionError(f"HTTP {resp.status} {ctype}")
+
+        boundary = ""
+        for param in ctype.split(";")[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "boundary":
+                boundary = value.strip('"')
+        if not boundary:
+            conn.close()
+            raise ConnectionError("No multipart boundary")
+        if boundary.startswith("--"):
+            boundary = boundary[2:]
+
+        self._conn, self._resp = conn, resp
+        self._boundary = b"--" + boundary.encode("latin-1")
+        self._at_headers = False
+        self.stats.connected = True
+        self.stats.err = ""
+
+    def close(self):
+        self.stats.connected = False
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = self._resp = None
+
+    # ── чтение частей ─────────────────────────────────────────────────────
+
+    def _read_headers(self) -> dict:
+        resp = self._resp
+        if not self._at_headers:
+            # Пропускаем всё до строки-разделителя (включая \r\n после JPEG)
+            while True:
+                line = resp.readline(1024)
+                if not line:
+                    raise ConnectionError("Stream closed")
+                if line.startswith(self._boundary):
+                    break
+        self._at_headers = False
+
+        headers = {}
+        while True:
+            line = resp.readline(1024)
+            if not line:
+                raise ConnectionError("Stream closed")
+            line = line.strip()
+            if not line:
+                return headers
+            key, _, value = line.partition(b":")
+            headers[key.strip().lower()] = value.strip()
+
+    def _read_exact(self, view: memoryview):
+        got = 0
+        while got < len(view):
+            n = self._resp.readinto(view[got:])
+            if not n:
+                raise ConnectionError("Stream closed")
+            got += n
+
+    def _read_until_boundary(self, buf: JpegBuffer):
+        """Запасной путь для частей без Content-Length"""
+        buf.length = 0
+        while True:
+            line = self._resp.readline(64 * 1024)
+            if not line:
+                raise ConnectionError("Stream closed")
+            if line.startswith(self._boundary):
+                self._at_headers = True
+                break
+            n = buf.length + len(line)
+            if n > self.max_frame_bytes:
+                raise ConnectionError("Frame too large")
+            if n > len(buf.data):
+                old = buf.data
+                buf.reserve(n)
+                if buf.data is not old:
+                    buf.data[:buf.length] = old[:buf.length]
+            buf.data[buf.length:n] = line
+            buf.length = n
+        # \r\n перед разделителем не относится к JPEG
+        if buf.view()[-2:].tobytes() == b"\r\n":
+            buf.length -= 2
+
+    def read(self) -> Optional[JpegBuffer]:
+        buf = None
+        try:
+            if self._resp is None:
+                self._connect()
+
+            headers = self._read_headers()
+            buf = self.pool.acquire()
+            length = headers.get(b"content-length")
+            if length is not None:
+                n = int(length)
+                if n <= 0 or n > self.max_frame_bytes:
+                    raise ConnectionError(f"Bad Content-Length: {n}")
+                buf.reserve(n)
+                buf.length = n
+                self._read_exact(buf.view())
+            else:
+                self._read_until_boundary(buf)
+
+            self.stats.frames += 1
+            self.stats.bytes += buf.length
+            return buf
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            if buf is not None:
+                buf.release()
+            self.stats.errors += 1
+            self.stats.err = f"{type(e).__name__}: {e}"
+            self.close()
+            return None
@@ -0,0 +1,200 @@
+"""
+Model Export - артефакты бэкендов инференса
+===========================================
+
+Превращает веса unet_safe_obstacle1.pth в артефакты для load_model(backend=...):
+  .ts                 TorchScript (замороженный, CPU)
+  .onnx               ONNX fp32 (динамические H/W)
+  .int8-dynamic.onnx  int8, динамическое квантование ONNX Runtime
+  .int8-static.onnx   int8, статическое квантование (QDQ) с калибровкой
+
+Во всех артефактах нормализация /255 и порядок BGR уже внесены в первую
+свёртку (см. fold_input_transform), поэтому у бэкендов общая предобработка.
+
+Запуск:
+  python model_export.py ../../models/unet_safe_obstacle1.pth
+  python model_export.py ../../models/unet_safe_obstacle1.pth --calib frames/
+  python model_export.py ../../models/unet_safe_obstacle1.pth --check --frames frames/
+
+--check сравнивает маски всех доступных бэкендов с eager и завершается
+с кодом 1, если доля совпадающих пикселей ниже --tolerance.
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+import cv2
+import numpy as np
+import torch
+
+from inference import (BACKENDS, Preprocessor, artifact_path, build_model,
+                       fold_input_transform, load_backend, trace_torchscript)
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   КАДРЫ ДЛЯ КАЛИБРОВКИ И ПРОВЕРКИ
+# ═══════════════════════════════════════════════════════════════════════════
+
+def load_frames(directory: Optional[Path], count: int, seed: int = 0) -> List[np.ndarray]:
+    """Кадры BGR из папки; без папки — сглаженный синтетический шум 320×240"""
+    if directory is not None:
+        paths = sorted(p for p in directory.iterdir() if p.suffix.lower() in IMAGE_EXTS)
+        frames = [cv2.imread(str(p)) for p in paths[:count]]
+        frames = [f for f in frames if f is not None]
+        if frames:
+            return frames
+        print(f"[warn] no images in {directory}, using synthetic frames")
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(count):
+        small = rng.integers(0, 256, (15, 20, 3), dtype=np.uint8)
+        frames.append(cv2.resize(small, (320, 240), interpolation=cv2.INTER_CUBIC))
+    return frames
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   ЭКСПОРТ
+# ═══════════════════════════════════════════════════════════════════════════
+
+def export_torchscript(model: torch.nn.Module, path: Path, img_size: int):
+    torch.jit.save(trace_torchscript(model, img_size, optimize=False), str(path))
+
+
+def export_onnx(model: torch.nn.Module, path: Path, img_size: int, opset: int = 17):
+    x = torch.zeros(1, 3, img_size, img_size)
+    kwargs = dict(
+        input_names=["input"],
+        output_names=["logits"],
+        dynamic_axes={"input": {2: "h", 3: "w"}, "logits": {2: "h", 3: "w"}},
+        opset_version=opset,
+    )
+    with torch.no_grad():
+        try:
+            torch.onnx.export(model, x, str(path), dynamo=False, **kwargs)
+        except TypeError:
+            # torch < 2.5: параметра dynamo ещё нет
+            torch.onnx.export(model, x, str(path), **kwargs)
+
+
+def quantize_dynamic(src: Path, dst: Path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic as ort_quantize_dynamic
+    ort_quantize_dynamic(str(src), str(dst), weight_type=QuantType.QUInt8)
+
+
+def quantize_static(src: Path, dst: Path, frames: List[np.ndarray], img_size: int):
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType,
+                                          quantize_static as ort_quantize_static)
+
+    pre = Preprocessor(torch.device("cpu"), img_size)
+
+    # Рекомендуемая ORT подготовка графа (shape inference, оптимизация) перед калибровкой
+    prepared = dst.with_suffix(".prep.onnx")
+    try:
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+        quant_pre_process(str(src), str(prepared))
+        src = prepared
+    except Exception as e:
+        print(f"[warn] quant_pre_process skipped: {type(e).__name__}: {e}")
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self._it = iter(frames)
+
+        def get_next(self):
+            frame = next(self._it, None)
+            if frame is None:
+                return None
+            return {"input": pre(frame).numpy().copy()}
+
+    try:
+        ort_quantize_static(str(src), str(dst), FrameReader(),
+                            quant_format=QuantFormat.QDQ, per_channel=True,
+                            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    finally:
+        prepared.unlink(missing_ok=True)
+
+
+def export_all(weights: Path, backends: List[str], img_size: int, calib: List[np.ndarray]):
+    model = fold_input_transform(build_model(torch.device("cpu"), weights))
+    onnx_path = artifact_path(weights, "onnx")
+
+    for backend in backends:
+        path = artifact_path(weights, backend)
+        if backend == "torchscript":
+            export_torchscript(model, path, img_size)
+        elif backend == "onnx":
+            export_onnx(model, path, img_size)
+        elif backend in ("int8-dynamic", "int8-static"):
+            if not onnx_path.exists():
+                export_onnx(model, onnx_path, img_size)
+            if backend == "int8-dynamic":
+                quantize_dynamic(onnx_path, path)
+            else:
+                quantize_static(onnx_path, path, calib, img_size)
+        else:
+            continue
+        print(f"[ok] {backend:<13} -> {path}")
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   ПРОВЕРКА СОВПАДЕНИЯ МАСОК
+# ═══════════════════════════════════════════════════════════════════════════
+
+def check_parity(weights: Path, backends: List[str], frames: List[np.ndarray],
+                 img_size: int, tolerance: float) -> bool:
+    """Доля совпадающих пикселей маски каждого бэкенда с eager (худший кадр)"""
+    ref = load_backend(weights, "eager")
+    ref_masks = [ref.predict(f, img_size) for f in frames]
+    ok = True
+    for backend in backends:
+        if backend == "eager":
+            continue
+        try:
+            inst = load_backend(weights, backend, img_size=img_size)
+        except (FileNotFoundError, RuntimeError) as e:
+            print(f"[skip] {backend:<13} {e}")
+            continue
+        agree = [float(np.mean(inst.predict(f, img_size) == m)) for f, m in zip(frames, ref_masks)]
+        worst = min(agree)
+        passed = worst >= tolerance
+        ok &= passed
+        print(f"[{'ok' if passed else 'FAIL'}] {backend:<13} agreement mean {np.mean(agree) * 100:7.3f}%"
+              f"  worst {worst * 100:7.3f}%")
+    return ok
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("weights", type=Path, help="веса .pth")
+    ap.add_argument("--backends", nargs="+", default=[b for b in BACKENDS if b != "eager"],
+                    choices=BACKENDS)
+    ap.add_argument("--img-size", type=int, default=320)
+    ap.add_argument("--calib", type=Path, default=None, help="папка с кадрами для int8-static")
+    ap.add_argument("--calib-frames", type=int, default=64)
+    ap.add_argument("--check", action="store_true", help="только проверка совпадения масок")
+    ap.add_argument("--frames", type=Path, default=None, help="папка с кадрами для --check")
+    ap.add_argument("--check-frames", type=int, default=16)
+    ap.add_argument("--tolerance", type=float, default=0.98,
+                    help="минимальная доля совпадающих пикселей маски")
+    args = ap.parse_args()
+
+    if args.check:
+        frames = load_frames(args.frames, args.check_frames, seed=1)
+        sys.exit(0 if check_parity(args.weights, args.backends, frames, args.img_size, args.tolerance) else 1)
+
+    calib = []
+    if "int8-static" in args.backends:
+        if args.calib is None:
+            print("[warn] int8-static without --calib: calibrating on synthetic frames")
+        calib = load_frames(args.calib, args.calib_frames)
+    export_all(args.weights, args.backends, args.img_size, calib)
+
+
+if __name__ == "__main__":
+    main()
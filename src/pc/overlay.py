@@ -0,0 +1,118 @@
+"""
+Overlay Renderer - оверлей сегментации через таблицу палитры
+============================================================
+
+Смешивание кадра с цветом класса (frame·(1-α) + color·α) заранее сведено
+в таблицы палитры: для каждого класса LUT[канал, значение пикселя].
+Кадр прогоняется через cv2.LUT (векторно, все каналы за проход), пиксели
+остальных классов переносятся по маске. Всё пишется в предвыделенные
+буферы сразу в RGB для tkinter, без frame.copy(), булевых индексов и
+addWeighted. Рендер вызывается только из UI, когда нужен новый кадр.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from zone_stats import ZoneGrid
+
+# Цвета классов (RGB): 0 - SAFE, 1 - OBSTACLE
+DEFAULT_PALETTE = {0: (0, 255, 0), 1: (255, 0, 0)}
+
+
+def build_overlay_lut(color: Tuple[int, int, int], alpha: float) -> np.ndarray:
+    """Таблица 1×256×3 для cv2.LUT: LUT[v, c] = v·(1-α) + color[c]·α"""
+    v = np.arange(256, dtype=np.float64)
+    lut = np.stack([v * (1.0 - alpha) + c * alpha for c in color], axis=-1)
+    return np.clip(np.rint(lut), 0, 255).astype(np.uint8).reshape(1, 256, 3)
+
+
+class OverlayRenderer:
+    """
+    Переиспользуемые буферы для кадра RGB и оверлея сегментации.
+
+    render() возвращает (rgb, seg) — массивы принадлежат рендереру и
+    перезаписываются следующим вызовом. С size кадр сразу масштабируется
+    до размера отображения (INTER_LINEAR), и весь оверлей считается уже
+    в этом размере.
+    """
+
+    def __init__(self, alpha: float, roi: Tuple[float, float],
+                 grid: Optional[ZoneGrid] = None,
+                 palette: Optional[Dict[int, Tuple[int, int, int]]] = None):
+        palette = palette or DEFAULT_PALETTE
+        self.roi = roi
+        self.grid = grid
+        self._luts = {k: build_overlay_lut(color, alpha) for k, color in sorted(palette.items())}
+        self._shape = None
+
+    def _alloc(self, h: int, w: int):
+        self._shape = (h, w)
+        self._rgb = np.empty((h, w, 3), dtype=np.uint8)
+        self._seg = np.empty((h, w, 3), dtype=np.uint8)
+        self._tmp = np.empty((h, w, 3), dtype=np.uint8)
+        self._mask = np.empty((h, w), dtype=np.uint8)
+        self._sel = np.empty((h, w), dtype=np.uint8)
+        self._resized = np.empty((h, w, 3), dtype=np.uint8)
+
+    def render(self, frame_bgr: np.ndarray, mask: Optional[np.ndarray],
+               size: Optional[Tuple[int, int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        mask — маска классов любого размера (растягивается до кадра) или None;
+        size — (w, h) выхода, по умолчанию размер кадра.
+        """
+        h, w = frame_bgr.shape[:2]
+        if size is not None:
+            w, h = size
+        if self._shape != (h, w):
+            self._alloc(h, w)
+        if frame_bgr.shape[:2] != (h, w):
+            cv2.resize(frame_bgr, (w, h), dst=self._resized, interpolation=cv2.INTER_LINEAR)
+            frame_bgr = self._resized
+
+        cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB, dst=self._rgb)
+        if mask is None:
+            np.copyto(self._seg, self._rgb)
+            return self._rgb, self._seg
+
+        if mask.shape[:2] == (h, w):
+            np.copyto(self._mask, mask)
+        else:
+            cv2.resize(mask, (w, h), dst=self._mask, interpolation=cv2.INTER_NEAREST)
+
+        # Класс 0 - весь кадр, остальные классы переносятся по своей маске
+        if 0 in self._luts:
+            cv2.LUT(self._rgb, self._luts[0], dst=self._seg)
+        else:
+            np.copyto(self._seg, self._rgb)
+        for k, lut in self._luts.items():
+            if k == 0:
+                continue
+            cv2.compare(self._mask, k, cv2.CMP_EQ, dst=self._sel)
+            cv2.LUT(self._rgb, lut, dst=self._tmp)
+            cv2.copyTo(self._tmp, self._sel, self._seg)
+
+        self._draw_zones(self._seg)
+        return self._rgb, self._seg
+
+    def _draw_zones(self, seg: np.ndarray):
+        h, w = seg.shape[:2]
+        y1, y2 = int(h * self.roi[0]), int(h * self.roi[1])
+        white = (255, 255, 255)
+        cv2.line(seg, (0, y1), (w, y1), white, 2)
+        cv2.line(seg, (0, y2), (w, y2), white, 2)
+        t1 = w // 3
+        t2 = 2 * w // 3
+        cv2.line(seg, (t1, y1), (t1, y2), white, 2)
+        cv2.line(seg, (t2, y1), (t2, y2), white, 2)
+
+        # Экспериментальная сетка зон - тонкими линиями
+        if self.grid is not None:
+            ys, xs = self.grid.bounds(h, w)
+            for y in ys:
+                cv2.line(seg, (int(xs[0]), int(y)), (int(xs[-1]), int(y)), (0, 255, 255), 1)
+            for x in xs:
+                cv2.line(seg, (int(x), int(ys[0])), (int(x), int(ys[-1])), (0, 255, 255), 1)
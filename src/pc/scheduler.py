@@ -0,0 +1,138 @@
+"""
+Inference Scheduler - запуск модели по движению в кадре
+=======================================================
+
+Вместо фиксированного «каждый N-й кадр» решение принимается для каждого
+кадра по дешёвой метрике изменения сцены: средняя абсолютная разница
+серой миниатюры (JPEG декодируется с уменьшением в DCT до короткой
+стороны миниатюры: 1/4 для QVGA 320×240, 1/8 для 640×480) с миниатюрой кадра,
+по которому считалась текущая маска. Сравнение с опорным кадром, а не
+с предыдущим, ловит и медленный дрейф сцены.
+
+Гарантии:
+  - возраст маски (от захвата её кадра до готовности следующей) не
+    превышает max_mask_age с учётом средней задержки инференса;
+  - между запусками проходит не меньше min_stride кадров.
+
+Причины решений и доля пропусков доступны в stats для метрик.
+"""
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from frame_source import FramePacket, decode_jpeg
+
+THUMB_SIZE = (80, 60)
+
+# Причины решений
+RUN_FIRST = "first"
+RUN_MAX_AGE = "max_age"
+RUN_MOTION = "motion"
+RUN_UNKNOWN = "unknown"
+SKIP_STRIDE = "stride"
+SKIP_STATIC = "static"
+
+
+def motion_thumbnail(packet: FramePacket, size: Tuple[int, int] = THUMB_SIZE) -> Optional[np.ndarray]:
+    """Серая миниатюра кадра фиксированного размера (w, h)"""
+    if packet.jpeg is not None:
+        gray = decode_jpeg(packet.jpeg.view(), min(size), grayscale=True)
+    elif packet.image is not None:
+        gray = cv2.cvtColor(packet.image, cv2.COLOR_BGR2GRAY)
+    else:
+        return None
+    if gray is None:
+        return None
+    if (gray.shape[1], gray.shape[0]) != size:
+        gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    return gray
+
+
+@dataclass
+class SchedulerConfig:
+    motion_threshold: float = 4.0   # средняя |разница| миниатюр, 0..255
+    max_mask_age: float = 0.5       # сек
+    min_stride: int = 1             # кадров между запусками
+    latency_alpha: float = 0.2      # сглаживание EMA задержки инференса
+
+
+@dataclass
+class Decision:
+    run: bool
+    reason: str
+    motion: float = float("nan")
+
+
+@dataclass
+class SchedulerStats:
+    decisions: int = 0
+    runs: int = 0
+    reasons: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def skip_rate(self) -> float:
+        return 1.0 - self.runs / self.decisions if self.decisions else 0.0
+
+
+class InferenceScheduler:
+    """
+    decide() вызывается для каждого кадра, record() — после успешного
+    инференса (миниатюра кадра становится опорной, обновляется EMA задержки).
+    """
+
+    def __init__(self, config: Optional[SchedulerConfig] = None):
+        self.config = config or SchedulerConfig()
+        self.stats = SchedulerStats()
+        self.latency_ema = 0.0
+        self.last_motion = 0.0
+        self._ref: Optional[np.ndarray] = None
+        self._ref_id = -1
+        self._mask_ts = 0.0
+
+    def mask_age(self, now: Optional[float] = None) -> float:
+        """Возраст текущей маски: от захвата её кадра, сек"""
+        if self._ref_id < 0:
+            return float("nan")
+        return (time.time() if now is None else now) - self._mask_ts
+
+    def decide(self, frame_id: int, thumb: Optional[np.ndarray], now: Optional[float] = None) -> Decision:
+        decision = self._decide(frame_id, thumb, time.time() if now is None else now)
+        self.stats.decisions += 1
+        self.stats.runs += decision.run
+        self.stats.reasons[decision.reason] = self.stats.reasons.get(decision.reason, 0) + 1
+        return decision
+
+    def _decide(self, frame_id: int, thumb: Optional[np.ndarray], now: float) -> Decision:
+        cfg = self.config
+        if self._ref_id < 0:
+            return Decision(True, RUN_FIRST)
+
+        # Маска успеет устареть, пока считается следующая
+        if now - self._mask_ts + self.latency_ema >= cfg.max_mask_age:
+            return Decision(True, RUN_MAX_AGE)
+
+        if frame_id - self._ref_id < cfg.min_stride:
+            return Decision(False, SKIP_STRIDE)
+
+        if thumb is None or self._ref is None or thumb.shape != self._ref.shape:
+            return Decision(True, RUN_UNKNOWN)
+
+        motion = cv2.mean(cv2.absdiff(thumb, self._ref))[0]
+        self.last_motion = motion
+        if motion >= cfg.motion_threshold:
+            return Decision(True, RUN_MOTION, motion)
+        return Decision(False, SKIP_STATIC, motion)
+
+    def record(self, frame_id: int, thumb: Optional[np.ndarray], capture_ts: float, latency: float):
+        """Маска готова: кадр frame_id (захвачен в capture_ts) становится опорным"""
+        self._ref = thumb
+        self._ref_id = frame_id
+        self._mask_ts = capture_ts
+        a = self.config.latency_alpha
+        self.latency_ema = latency if self.latency_ema == 0.0 else (1 - a) * self.latency_ema + a * latency
@@ -0,0 +1,455 @@
+"""
+Sim Hub - имитация хаба SPIKE без BLE и железа
+==============================================
+
+SimulatedHub исполняет настоящий src/spike/spike_server.py в отдельном
+потоке с подменёнными модулями Pybricks (pybricks.*, usys, uselect):
+моторы — VirtualMotor с инерцией первого порядка, stdin/stdout — канал
+SimTransport, который SpikeBLEController получает вместо BLE.
+
+Канал имитирует BLE по LinkProfile:
+  latency / jitter  односторонняя задержка, сек (порядок сообщений сохраняется)
+  loss              доля потерянных записей без подтверждения и уведомлений;
+                    запись с подтверждением не теряется, но повторяется
+                    (+ retry_delay)
+  disconnect_rate   случайные обрывы: в среднем раз в 1/rate сек
+  connect_delay     поиск и подключение
+
+Использование:
+  hub = SimulatedHub(LinkProfile(latency=0.02, loss=0.05))
+  ble = SpikeBLEController("sim", transport=hub.transport())
+
+Нагрузочный прогон контроллера (команды с частотой --rate):
+  python sim_hub.py --rate 100 --duration 10 --loss 0.05 --disconnect-rate 0.2
+  python sim_hub.py --rate 200 --pipeline 4 --compound
+  python -m cave_headless --sim-hub --auto
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import builtins
+import math
+import random
+import threading
+import time
+import types
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from spike_ble import HubTransport
+
+SERVER_PATH = Path(__file__).resolve().parent.parent / "spike" / "spike_server.py"
+
+
+@dataclass
+class LinkProfile:
+    latency: float = 0.015
+    jitter: float = 0.005
+    loss: float = 0.0
+    retry_delay: float = 0.03
+    disconnect_rate: float = 0.0
+    connect_delay: float = 0.2
+
+
+class _HubHalt(Exception):
+    """Остановка программы хаба при close()"""
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   ВИРТУАЛЬНОЕ ЖЕЛЕЗО
+# ═══════════════════════════════════════════════════════════════════════════
+
+class VirtualMotor:
+    """
+    Мотор с инерцией первого порядка: скорость стремится к power% от
+    max_speed (град/с) с постоянной времени tau. log — (время, мощность).
+    """
+
+    def __init__(self, port: str, direction: int = 1, max_speed: float = 1000.0, tau: float = 0.08):
+        self.port = port
+        self.direction = direction
+        self.max_speed = max_speed
+        self.tau = tau
+        self.power = 0.0
+        self.log: deque = deque(maxlen=10000)
+        self._speed = 0.0
+        self._angle = 0.0
+        self._t = time.time()
+        self._lock = threading.Lock()
+
+    def _advance(self, now: float):
+        dt = max(0.0, now - self._t)
+        target = self.power / 100.0 * self.max_speed
+        decay = math.exp(-dt / self.tau)
+        self._angle += target * dt + (self._speed - target) * self.tau * (1.0 - decay)
+        self._speed = target + (self._speed - target) * decay
+        self._t = now
+
+    def _set(self, power: float):
+        now = time.time()
+        with self._lock:
+            self._advance(now)
+            self.power = max(-100.0, min(100.0, float(power)))
+            self.log.append((now, self.power))
+
+    # API pybricks.pupdevices.Motor, используемое spike_server.py
+    def dc(self, power):
+        self._set(power)
+
+    def stop(self):
+        self._set(0.0)
+
+    def speed(self) -> float:
+        with self._lock:
+            self._advance(time.time())
+            return self._speed
+
+    def angle(self) -> float:
+        with self._lock:
+            self._advance(time.time())
+            return self._angle
+
+
+class _Lights:
+    def on(self, *brightness):
+        pass
+
+    def off(self):
+        pass
+
+
+class _UltrasonicSensor:
+    def __init__(self, port):
+        self.port = port
+        self.lights = _Lights()
+
+    def distance(self) -> int:
+        return 2000
+
+
+class _Stdin:
+    """stdin программы хаба: байты из канала, блокирующее чтение"""
+
+    def __init__(self, hub: "SimulatedHub"):
+        self.buffer = self
+        self._hub = hub
+        self._data = bytearray()
+        self._cond = threading.Condition()
+
+    def feed(self, data: bytes):
+        with self._cond:
+            self._data += data
+            self._cond.notify_all()
+
+    def available(self) -> bool:
+        return bool(self._data)
+
+    def read(self, n: int) -> bytes:
+        with self._cond:
+            while len(self._data) < n:
+                if self._hub.halted:
+                    raise _HubHalt()
+                self._cond.wait(0.05)
+            out = bytes(self._data[:n])
+            del self._data[:n]
+            return out
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+
+class _Stdout:
+    def __init__(self, hub: "SimulatedHub"):
+        self.buffer = self
+        self._hub = hub
+
+    def write(self, data: bytes):
+        self._hub._emit(bytes(data))
+
+
+class _Poll:
+    def __init__(self, stdin: _Stdin):
+        self._stdin = stdin
+
+    def register(self, _stream, *flags):
+        pass
+
+    def poll(self, _timeout=0):
+        return [(self._stdin, 1)] if self._stdin.available() else []
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   ХАБ
+# ═══════════════════════════════════════════════════════════════════════════
+
+class SimulatedHub:
+    """
+    Программа spike_server.py на виртуальном хабе. Запускается при первом
+    подключении канала (как нажатие кнопки на хабе после подключения);
+    после "bye" останавливается и на команды больше не отвечает.
+    """
+
+    def __init__(self, profile: Optional[LinkProfile] = None, seed: Optional[int] = None,
+                 server_path: Path = SERVER_PATH):
+        self.profile = profile or LinkProfile()
+        self.rng = random.Random(seed)
+        self.server_path = Path(server_path)
+        self.motors: Dict[str, VirtualMotor] = {}
+        self.stdin = _Stdin(self)
+        self.stdout = _Stdout(self)
+        self.halted = False
+        self.running = False
+        self.error: Optional[BaseException] = None
+        self.stats = {"to_hub": 0, "from_hub": 0, "lost": 0, "retries": 0, "disconnects": 0}
+        self._link: Optional["SimTransport"] = None
+        self._thread: Optional[threading.Thread] = None
+
+    # ── Программа ──────────────────────────────────────────────────────────
+
+    def _modules(self) -> Dict[str, types.ModuleType]:
+        def module(name, **attrs):
+            m = types.ModuleType(name)
+            m.__dict__.update(attrs)
+            return m
+
+        def motor(port, positive_direction=1, *args, **kwargs):
+            m = VirtualMotor(port, positive_direction)
+            self.motors[port] = m
+            return m
+
+        def wait(ms):
+            if self.halted:
+                raise _HubHalt()
+            time.sleep(ms / 1000.0)
+
+        ports = types.SimpleNamespace(**{p: p for p in "ABCDEF"})
+        return {
+            "pybricks.pupdevices": module("pybricks.pupdevices", Motor=motor, UltrasonicSensor=_UltrasonicSensor),
+            "pybricks.parameters": module(
+                "pybricks.parameters", Port=ports,
+                Stop=types.SimpleNamespace(COAST=0, BRAKE=1, HOLD=2),
+                Direction=types.SimpleNamespace(CLOCKWISE=1, COUNTERCLOCKWISE=-1)),
+            "pybricks.tools": module("pybricks.tools", wait=wait),
+            "usys": module("usys", stdin=self.stdin, stdout=self.stdout),
+            "uselect": module("uselect", poll=lambda: _Poll(self.stdin)),
+        }
+
+    def start(self):
+        if self._thread is not None:
+            return
+        modules = self._modules()
+
+        def _import(name, globals=None, locals=None, fromlist=(), level=0):
+            if name in modules:
+                return modules[name]
+            return builtins.__import__(name, globals, locals, fromlist, level)
+
+        code = compile(self.server_path.read_text(encoding="utf-8"), str(self.server_path), "exec")
+        namespace = {"__name__": "__main__", "__builtins__": dict(vars(builtins), __import__=_import)}
+
+        def run():
+            self.running = True
+            try:
+                exec(code, namespace)
+            except _HubHalt:
+                pass
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.running = False
+
+        self._thread = threading.Thread(target=run, name="sim-hub", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.halted = True
+        self.stdin.wake()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+
+    def motor(self, port: str) -> VirtualMotor:
+        """Мотор по порту ("C" — левый, "D" — правый в spike_server.py)"""
+        return self.motors[port]
+
+    # ── Канал ──────────────────────────────────────────────────────────────
+
+    def transport(self) -> "SimTransport":
+        return SimTransport(self)
+
+    def _emit(self, data: bytes):
+        """stdout программы (поток хаба) → текущий канал"""
+        link = self._link
+        if link is not None:
+            link._from_hub(data)
+
+    def delay(self) -> float:
+        p = self.profile
+        return max(0.0, p.latency + self.rng.uniform(-p.jitter, p.jitter))
+
+    def lost(self) -> bool:
+        return self.profile.loss > 0 and self.rng.random() < self.profile.loss
+
+
+class SimTransport(HubTransport):
+    """Канал до SimulatedHub с задержками, потерями и обрывами LinkProfile"""
+
+    def __init__(self, hub: SimulatedHub):
+        self.hub = hub
+        self._connected = False
+        self._epoch = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._on_stdout: Optional[Callable[[bytes], None]] = None
+        # Время доставки последнего сообщения в каждую сторону (порядок BLE)
+        self._up_at = 0.0
+        self._down_at = 0.0
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def connect(self, on_stdout: Callable[[bytes], None]) -> bool:
+        hub = self.hub
+        await asyncio.sleep(hub.profile.connect_delay)
+        if hub.halted:
+            return False
+        self._loop = asyncio.get_running_loop()
+        self._on_stdout = on_stdout
+        self._epoch += 1
+        self._connected = True
+        hub._link = self
+        if hub.profile.disconnect_rate > 0:
+            self._loop.call_later(hub.rng.expovariate(hub.profile.disconnect_rate), self._drop, self._epoch)
+        hub.start()
+        return True
+
+    async def disconnect(self):
+        self._connected = False
+        self._epoch += 1
+        if self.hub._link is self:
+            self.hub._link = None
+
+    def _drop(self, epoch: int):
+        if epoch == self._epoch and self._connected:
+            self.hub.stats["disconnects"] += 1
+            self._connected = False
+
+    def _schedule(self, last_at: float, delay: float) -> float:
+        """Время доставки по часам цикла: не раньше предыдущего сообщения"""
+        return max(self._loop.time() + delay, last_at + 1e-6)
+
+    async def write(self, payload: bytes, response: bool = True):
+        if not self._connected:
+            raise ConnectionError("simulated link is down")
+        hub = self.hub
+        delay = hub.delay()
+        if hub.lost():
+            if not response:
+                hub.stats["lost"] += 1
+                await asyncio.sleep(0)
+                return
+            hub.stats["retries"] += 1
+            delay += hub.profile.retry_delay
+        self._up_at = self._schedule(self._up_at, delay)
+        self._loop.call_at(self._up_at, self._deliver_up, bytes(payload), self._epoch)
+        if response:
+            # Подтверждение записи идёт обратно с той же задержкой
+            await asyncio.sleep(self._up_at - self._loop.time() + hub.delay())
+            if not self._connected:
+                raise ConnectionError("simulated link dropped during write")
+        else:
+            await asyncio.sleep(0)
+
+    def _deliver_up(self, payload: bytes, epoch: int):
+        if epoch == self._epoch and self._connected:
+            self.hub.stats["to_hub"] += 1
+            self.hub.stdin.feed(payload)
+
+    def _from_hub(self, data: bytes):
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._send_down, data, self._epoch)
+
+    def _send_down(self, data: bytes, epoch: int):
+        hub = self.hub
+        if epoch != self._epoch or not self._connected:
+            return
+        if hub.lost():
+            hub.stats["lost"] += 1
+            return
+        self._down_at = self._schedule(self._down_at, hub.delay())
+        self._loop.call_at(self._down_at, self._deliver_down, data, epoch)
+
+    def _deliver_down(self, data: bytes, epoch: int):
+        if epoch == self._epoch and self._connected and self._on_stdout is not None:
+            self.hub.stats["from_hub"] += 1
+            self._on_stdout(data)
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#   НАГРУЗОЧНЫЙ ПРОГОН
+# ═══════════════════════════════════════════════════════════════════════════
+
+def stress(args) -> dict:
+    from cave_config import CMD_CENTER, CMD_FWD, CMD_LEFT, CMD_RIGHT
+    from metrics import Registry
+    from spike_ble import SpikeBLEController
+    from tracing import CommandTag, Tracer
+
+    hub = SimulatedHub(LinkProfile(latency=args.latency / 1000.0, jitter=args.jitter / 1000.0, loss=args.loss,
+                                   disconnect_rate=args.disconnect_rate), seed=args.seed)
+    registry = Registry()
+    tracer = Tracer(metrics=registry)
+    ble = SpikeBLEController("sim", metrics=registry, tracer=tracer, compound=args.compound,
+                             pipeline_window=args.pipeline, transport=hub.transport(), rdy_timeout=args.rdy_timeout)
+    ble.start()
+    steer = (CMD_LEFT, CMD_CENTER, CMD_RIGHT, CMD_CENTER)
+    period = 1.0 / args.rate
+    t_end = time.perf_counter() + args.duration
+    i = 0
+    while time.perf_counter() < t_end:
+        tag = CommandTag(i, time.time(), time.time())
+        if args.compound:
+            ble.send_drive_steer(CMD_FWD, steer[i % 4], tag)
+        else:
+            ble.send(steer[i % 4] if i % 2 else CMD_FWD, tag)
+        i += 1
+        time.sleep(period)
+    time.sleep(0.5)
+    ble.stop()
+    time.sleep(0.3)
+    hub.close()
+
+    snap = registry.snapshot()
+    print(f"issued {i} commands in {args.duration:.1f} s ({args.rate:.0f}/s), "
+          f"written {snap['ble_commands']}, superseded {snap['ble_commands_superseded']}")
+    print(f"link: {hub.stats}")
+    print(f"rdy timeouts {snap['ble_rdy_timeouts']}  send errors {snap['ble_send_errors']}  "
+          f"reconnects {snap['ble_reconnects']}  seq lost {snap['ble_seq_lost']}  stale {snap['ble_seq_stale']}")
+    print(tracer.summary())
+    if hub.error is not None:
+        print(f"hub program error: {hub.error!r}")
+    return snap
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Нагрузочный прогон SpikeBLEController на имитации хаба")
+    ap.add_argument("--rate", type=float, default=50.0, help="команд в секунду")
+    ap.add_argument("--duration", type=float, default=5.0)
+    ap.add_argument("--latency", type=float, default=15.0, help="мс, в одну сторону")
+    ap.add_argument("--jitter", type=float, default=5.0, help="мс")
+    ap.add_argument("--loss", type=float, default=0.0)
+    ap.add_argument("--disconnect-rate", type=float, default=0.0, help="обрывов в секунду")
+    ap.add_argument("--pipeline", type=int, default=0, help="окно конвейера (0 — обмен с rdy)")
+    ap.add_argument("--compound", action="store_true", help="привод и руль кадром 0x81")
+    ap.add_argument("--rdy-timeout", type=float, default=2.5, help="ожидание rdy, сек")
+    ap.add_argument("--seed", type=int, default=None)
+    stress(ap.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
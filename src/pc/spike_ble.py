@@ -0,0 +1,435 @@
+"""
+Spike BLE - управление хабом SPIKE Prime (Pybricks) по BLE
+==========================================================
+
+Команды по 3 байта ASCII уходят в хаб только после его сигнала "rdy";
+собственный поток с asyncio-циклом, переподключение при обрыве.
+Ожидающие команды лежат в CommandMailbox: команда выбирается уже после
+"rdy", поэтому отправляется самое свежее решение, а stp/bye — вне очереди.
+С compound=True ожидающие вместе привод и руль уходят одним кадром 0x81
+(spike_protocol) — одна запись GATT и одно "rdy" вместо двух.
+
+pipeline_window > 0 включает конвейер: кадры 0x82 с номером пишутся без
+подтверждения и без ожидания "rdy", в пути — не больше pipeline_window;
+хаб отвечает накопительным "ak"/"gp"/"st", потери и нарушения порядка
+считаются в метриках.
+
+Канал до хаба — HubTransport: stdin/stdout программы на хабе. По
+умолчанию BleakTransport (BLE через bleak); sim_hub.SimulatedHub даёт
+имитацию без железа.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    from bleak import BleakClient, BleakScanner
+except ImportError:
+    # Без bleak работает только имитация хаба (sim_hub)
+    BleakClient = BleakScanner = None
+
+from cave_config import CMD_BYE, PYBRICKS_CHAR_UUID
+from command_mailbox import CommandMailbox
+from metrics import Registry
+from spike_protocol import (SEQ_ACK, SEQ_GAP, SEQ_STALE, encode_arc, encode_drive_steer, encode_sequenced,
+                            seq_newer)
+from tracing import CommandTag, CommandTrace, Tracer
+
+
+class HubTransport:
+    """
+    Канал до программы на хабе:
+      connect(on_stdout) → найти хаб и подключиться (False — не найден);
+                           on_stdout(bytes) вызывается в цикле asyncio
+      write(payload, response) → запись в stdin программы
+      disconnect()
+    """
+
+    @property
+    def is_connected(self) -> bool:
+        raise NotImplementedError
+
+    async def connect(self, on_stdout: Callable[[bytes], None]) -> bool:
+        raise NotImplementedError
+
+    async def write(self, payload: bytes, response: bool = True):
+        raise NotImplementedError
+
+    async def disconnect(self):
+        raise NotImplementedError
+
+
+class BleakTransport(HubTransport):
+    """stdin/stdout программы Pybricks через BLE"""
+
+    def __init__(self, hub_name: str, scan_timeout: float = 12.0):
+        self.hub_name = hub_name
+        self.scan_timeout = scan_timeout
+        self._client = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._client is not None and self._client.is_connected
+
+    async def connect(self, on_stdout: Callable[[bytes], None]) -> bool:
+        if BleakScanner is None:
+            raise RuntimeError("BLE needs bleak: pip install bleak")
+        dev = await BleakScanner.find_device_by_name(self.hub_name, timeout=self.scan_timeout)
+        if dev is None:
+            return False
+
+        def handle(_, data: bytearray):
+            # 0x01 — вывод программы в stdout; прочие события Pybricks не нужны
+            if data and data[0] == 0x01:
+                on_stdout(bytes(data[1:]))
+
+        self._client = BleakClient(dev)
+        await self._client.connect()
+        await self._client.start_notify(PYBRICKS_CHAR_UUID, handle)
+        return True
+
+    async def write(self, payload: bytes, response: bool = True):
+        # 0x06 — запись в stdin программы
+        await self._client.write_gatt_char(PYBRICKS_CHAR_UUID, b"\x06" + payload, response=response)
+
+    async def disconnect(self):
+        client, self._client = self._client, None
+        if client is None:
+            return
+        try:
+            await client.stop_notify(PYBRICKS_CHAR_UUID)
+            await client.disconnect()
+        except Exception:
+            pass
+
+
+@dataclass
+class HubStatus:
+    connected: bool = False
+    last_reply: bytes = b""
+    last_ready_ts: float = 0.0
+    last_send_ts: float = 0.0
+    err: str = ""
+
+
+class SpikeBLEController:
+    def __init__(self, hub_name: str, metrics: Optional[Registry] = None, tracer: Optional[Tracer] = None,
+                 compound: bool = False, pipeline_window: int = 0, ack_timeout: float = 0.5,
+                 transport: Optional[HubTransport] = None, rdy_timeout: float = 2.5):
+        self.hub_name = hub_name
+        self.transport = transport or BleakTransport(hub_name)
+        self.status = HubStatus()
+        self.tracer = tracer
+        self.compound = compound
+        # Мощности в кадре 0x81 (0 — значения по умолчанию на хабе)
+        self.drive_power = 0
+        self.turn_power = 0
+        # Команды, записанные в хаб и ещё не получившие "rdy" (для трассировки)
+        self._inflight: List[CommandTrace] = []
+        # Конвейер (pipeline_window > 0): seq → (трассы, время записи)
+        self.pipeline_window = pipeline_window
+        self.ack_timeout = ack_timeout
+        self.rdy_timeout = rdy_timeout
+        self._seq = 0
+        self._window: Dict[int, Tuple[List[CommandTrace], float]] = {}
+        self._ack_event: Optional[asyncio.Event] = None
+        self.mailbox = CommandMailbox(on_drop=self._on_superseded)
+        self._stop = threading.Event()
+        self._ready_event: Optional[asyncio.Event] = None
+        self._thread = threading.Thread(target=self._run_thread, daemon=True)
+        # Наблюдатели трафика: fn("tx" | "rx", payload, time.time())
+        self.observers: List[Callable[[str, bytes, float], None]] = []
+        self._setup_metrics(metrics or Registry())
+
+    def _setup_metrics(self, m: Registry):
+        self.metrics = m
+        self.m_sent = m.counter("ble_commands", "Команды, записанные в хаб")
+        self.m_send_errors = m.counter("ble_send_errors", "Ошибки write_gatt_char")
+        self.m_rdy_timeouts = m.counter("ble_rdy_timeouts", "Команды, не дождавшиеся rdy")
+        self.m_connects = m.counter("ble_connects", "Подключения к хабу")
+        self.m_errors = m.counter("ble_errors", "Ошибки BLE (поиск, подключение, обрыв)")
+        self.m_rdy_wait = m.histogram("ble_rdy_wait_ms", "Ожидание rdy перед отправкой команды")
+        self.m_write = m.histogram("ble_write_ms", "Запись команды с подтверждением")
+        self.m_compound = m.counter("ble_compound_frames", "Записи кадром «привод + руль»")
+        self.m_seq_lost = m.counter("ble_seq_lost", "Команды конвейера, не выполненные хабом (не дошли или обогнаны)")
+        self.m_seq_stale = m.counter("ble_seq_stale", "Команды конвейера, пришедшие не по порядку")
+        self.m_ack_rtt = m.histogram("ble_ack_rtt_ms", "Запись кадра 0x82 → подтверждение хаба")
+        m.gauge("ble_inflight", "Команды конвейера без подтверждения", fn=lambda: len(self._window))
+        self.m_superseded = m.counter("ble_commands_superseded", "Команды, вытесненные более свежими")
+        self.m_cmd_age = m.histogram("ble_command_age_ms", "Возраст команды к моменту записи в хаб")
+        m.gauge("ble_queue_depth", "Команды, ожидающие отправки", fn=self.mailbox.depth)
+        m.gauge("ble_oldest_pending_ms", "Возраст самой давней ожидающей команды",
+                fn=lambda: self.mailbox.oldest_age() * 1000.0)
+        m.gauge("ble_connected", "Хаб подключён", fn=lambda: self.status.connected)
+        m.gauge("ble_reconnects", "Переподключения к хабу", fn=lambda: max(0, self.m_connects.value - 1))
+
+    def add_observer(self, fn: Callable[[str, bytes, float], None]):
+        self.observers.append(fn)
+
+    def _notify(self, direction: str, payload: bytes, ts: float):
+        for fn in self.observers:
+            try:
+                fn(direction, payload, ts)
+            except Exception:
+                pass
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.mailbox.put(CMD_BYE, None)
+
+    def send(self, cmd3: bytes, tag: Optional[CommandTag] = None):
+        """
+        Положить команду в почтовый ящик; tag — кадр, по которому принято
+        решение. Ожидающая команда того же канала при этом вытесняется.
+        """
+        if not isinstance(cmd3, (bytes, bytearray)) or len(cmd3) != 3:
+            return
+        trace = self.tracer.begin(cmd3, tag, time.time()) if self.tracer is not None else None
+        self.mailbox.put(bytes(cmd3), trace)
+
+    def send_drive_steer(self, drive_cmd: bytes, steer_cmd: bytes, tag: Optional[CommandTag] = None):
+        """
+        Привод и руль одного решения: кладутся атомарно, чтобы с compound
+        уйти одним кадром; без compound — две обычные команды.
+        """
+        now = time.time()
+        items = []
+        for cmd in (steer_cmd, drive_cmd):
+            trace = self.tracer.begin(cmd, tag, now) if self.tracer is not None else None
+            items.append((bytes(cmd), trace))
+        self.mailbox.put_many(items)
+
+    def send_arc(self, speed: int, steer: int, tag: Optional[CommandTag] = None):
+        """
+        Дуга с непрерывным рулём одним кадром 0x83 (мощности хаба -100..100);
+        занимает слот привода: ожидающие fwd/rev и lft/rgt вытесняются
+        """
+        frame = encode_arc(speed, steer)
+        trace = self.tracer.begin(frame, tag, time.time()) if self.tracer is not None else None
+        self.mailbox.put(frame, trace)
+
+    def _on_superseded(self, _cmd: bytes, trace: Optional[CommandTrace]):
+        self.m_superseded.inc()
+        self._finish(trace, "dropped")
+
+    def _finish(self, trace: Optional[CommandTrace], status: str = "ok"):
+        if trace is not None:
+            trace.status = status
+            self.tracer.complete(trace)
+
+    def _handle_rx(self, payload: bytes):
+        if not payload:
+            return
+        now = time.time()
+        self._notify("rx", payload, now)
+        if len(payload) == 3 and payload[:2] in (SEQ_ACK, SEQ_GAP, SEQ_STALE):
+            self._handle_seq_reply(payload[:2], payload[2], now)
+        elif payload == b"rdy":
+            self.status.last_ready_ts = now
+            for trace in self._inflight:
+                trace.ready_ts = now
+                self._finish(trace)
+            self._inflight = []
+            if self._ready_event is not None:
+                self._ready_event.set()
+        else:
+            self.status.last_reply = payload
+            for trace in self._inflight:
+                if not trace.ack_ts:
+                    trace.ack_ts = now
+
+    def _payload(self, items) -> Tuple[bytes, List[CommandTrace]]:
+        """Команда или кадр 0x81 из забранного в ящике; трассы с отметкой записи"""
+        now = time.time()
+        for _, _, queued_ts in items:
+            self.m_cmd_age.observe((now - queued_ts) * 1000.0)
+        if len(items) == 2:
+            cmd = encode_drive_steer(items[0][0], items[1][0], self.drive_power, self.turn_power)
+            self.m_compound.inc()
+        else:
+            cmd = items[0][0]
+        traces = [trace for _, trace, _ in items if trace is not None]
+        for trace in traces:
+            trace.write_ts = now
+        return cmd, traces
+
+    async def _ble_loop(self):
+        if sys.platform.startswith("win"):
+            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+        self._ready_event = asyncio.Event()
+        self._ack_event = asyncio.Event()
+
+        while not self._stop.is_set():
+            try:
+                self.status.err = ""
+                self.status.connected = False
+
+                if not await self.transport.connect(self._handle_rx):
+                    self.status.err = "Hub not found"
+                    await asyncio.sleep(1.0)
+                    continue
+
+                try:
+                    self.status.connected = True
+                    self.m_connects.inc()
+                    if self.pipeline_window > 0:
+                        await self._pipelined_session(self.transport)
+                    else:
+                        await self._stop_and_wait_session(self.transport)
+                finally:
+                    self.status.connected = False
+                    await self.transport.disconnect()
+
+            except Exception as e:
+                self.status.err = f"BLE error: {type(e).__name__}"
+                self.m_errors.inc()
+                await asyncio.sleep(1.0)
+            finally:
+                self._expire_window(float("inf"))
+
+    async def _stop_and_wait_session(self, link: HubTransport):
+        """Каждая команда — запись с подтверждением после "rdy" хаба"""
+        loop = asyncio.get_running_loop()
+        while not self._stop.is_set() and link.is_connected:
+            # Ожидание ящика в пуле потоков: цикл asyncio остаётся
+            # свободным и сразу обрабатывает уведомления хаба ("rdy")
+            if not await loop.run_in_executor(None, self.mailbox.wait, 0.2):
+                continue
+
+            t_wait = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._ready_event.wait(), timeout=self.rdy_timeout)
+            except asyncio.TimeoutError:
+                # "rdy" мог потеряться: хаб ждёт команду, а мы — его сигнал.
+                # Пишем следующую команду без него, ответ на неё снова
+                # синхронизирует обмен
+                self.status.err = "No 'rdy' from hub"
+                self.m_rdy_timeouts.inc()
+                for trace in self._inflight:
+                    self._finish(trace, "no_rdy")
+                self._inflight = []
+            t_write = time.perf_counter()
+            self.m_rdy_wait.observe((t_write - t_wait) * 1000.0)
+
+            # Выбор команды только сейчас: за время ожидания "rdy"
+            # её могла вытеснить более свежая или stp
+            items = self.mailbox.take(self.compound)
+            if not items:
+                continue
+            self._ready_event.clear()
+
+            # "OK " может прийти раньше подтверждения записи
+            cmd, traces = self._payload(items)
+            self._inflight = traces
+            try:
+                await link.write(cmd, response=True)
+                self.m_write.observe((time.perf_counter() - t_write) * 1000.0)
+                self.m_sent.inc()
+                self.status.last_send_ts = time.time()
+                for trace in traces:
+                    trace.written_ts = self.status.last_send_ts
+                self._notify("tx", cmd, self.status.last_send_ts)
+            except Exception as e:
+                self.status.err = f"Send error: {type(e).__name__}"
+                self.m_send_errors.inc()
+                self._inflight = []
+                for trace in traces:
+                    self._finish(trace, "send_error")
+                break
+
+    async def _pipelined_session(self, link: HubTransport):
+        """
+        Кадры 0x82 записью без подтверждения: до pipeline_window команд в
+        пути, хаб подтверждает номером. Неподтверждённые за ack_timeout
+        считаются потерянными.
+        """
+        loop = asyncio.get_running_loop()
+        sync = True
+        while not self._stop.is_set() and link.is_connected:
+            self._expire_window(time.time() - self.ack_timeout)
+            if len(self._window) >= self.pipeline_window:
+                self._ack_event.clear()
+                try:
+                    await asyncio.wait_for(self._ack_event.wait(), timeout=self.ack_timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if not await loop.run_in_executor(None, self.mailbox.wait, 0.05):
+                continue
+            items = self.mailbox.take(self.compound)
+            if not items:
+                continue
+
+            t_write = time.perf_counter()
+            inner, traces = self._payload(items)
+            self._seq = (self._seq + 1) & 0xFF
+            cmd = encode_sequenced(self._seq, inner, sync)
+            self._window[self._seq] = (traces, time.time())
+            try:
+                await link.write(cmd, response=False)
+            except Exception as e:
+                self.status.err = f"Send error: {type(e).__name__}"
+                self.m_send_errors.inc()
+                self._window.pop(self._seq, None)
+                for trace in traces:
+                    self._finish(trace, "send_error")
+                break
+            sync = False
+            self.m_write.observe((time.perf_counter() - t_write) * 1000.0)
+            self.m_sent.inc()
+            self.status.last_send_ts = time.time()
+            for trace in traces:
+                trace.written_ts = self.status.last_send_ts
+            self._notify("tx", cmd, self.status.last_send_ts)
+
+    def _expire_window(self, deadline: float):
+        """Команды в пути, записанные раньше deadline, — потерянные"""
+        for seq, (traces, sent_ts) in list(self._window.items()):
+            if sent_ts < deadline:
+                del self._window[seq]
+                self.m_seq_lost.inc()
+                for trace in traces:
+                    self._finish(trace, "lost")
+
+    def _handle_seq_reply(self, kind: bytes, seq: int, now: float):
+        """Ответ хаба на кадр 0x82 (вызывается в цикле asyncio)"""
+        entry = self._window.pop(seq, None)
+        if kind == SEQ_STALE:
+            self.m_seq_stale.inc()
+            for trace in (entry[0] if entry else ()):
+                self._finish(trace, "stale")
+        else:
+            if entry is not None:
+                traces, sent_ts = entry
+                self.m_ack_rtt.observe((now - sent_ts) * 1000.0)
+                for trace in traces:
+                    trace.ack_ts = now
+                    self._finish(trace)
+            # Подтверждение накопительное: более ранние номера без своего
+            # "ak" либо выполнены (потерян ответ), либо не дошли ("gp")
+            for older in [k for k in self._window if seq_newer(seq, k)]:
+                traces, _ = self._window.pop(older)
+                if kind == SEQ_GAP:
+                    self.m_seq_lost.inc()
+                for trace in traces:
+                    if kind == SEQ_GAP:
+                        self._finish(trace, "lost")
+                    else:
+                        trace.ack_ts = now
+                        self._finish(trace)
+        if self._ack_event is not None:
+            self._ack_event.set()
+
+    def _run_thread(self):
+        asyncio.run(self._ble_loop())
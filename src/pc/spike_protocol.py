@@ -0,0 +1,188 @@
+"""
+Spike Protocol - двоичные кадры команд для spike_server.py
+==========================================================
+
+Старые команды — 3 байта ASCII (fwd, stp, lft, ...). Двоичный кадр
+начинается с байта типа со старшим битом (0x80 | тип), поэтому хаб
+отличает его по первому байту: читает 3 байта как обычно, а остаток —
+по таблице длин. Новая версия кадра — новый тип.
+
+Кадр 0x81 «привод + руль», 6 байт:
+  0  0x81
+  1  drive   int8: +1 fwd, -1 rev, 0 стоп (в смысле команд хаба)
+  2  steer   int8: -1 налево, 0 прямо, +1 направо
+  3  dpow    мощность движения 0..100 (0 — DRIVE_DC хаба)
+  4  tpow    мощность поворота 0..100 (0 — TURN_STRENGTH хаба)
+  5  xor байтов 0..4
+
+Хаб смешивает: left = drive·dpow + steer·tpow, right = drive·dpow − steer·tpow;
+drive = 0 со steer = ±1 — поворот на месте, как lft/rgt.
+
+Кадр 0x83 «дуга» для планировщика с непрерывным рулём, 4 байта:
+  0  0x83
+  1  speed   int8 -100..100: мощность движения в процентах (+ в смысле fwd хаба)
+  2  steer   int8 -100..100: разность мощностей (- налево, + направо)
+  3  xor байтов 0..2
+Хаб: left = speed + steer, right = speed − steer; 0/0 — стоп.
+
+Кадр 0x82 «с номером» для конвейерной передачи, 4 + n байт:
+  0  0x82
+  1  seq     номер 0..255 (по кругу)
+  2  флаги/длина: бит 7 — sync (принять seq без проверки), биты 0..6 — n
+  3… вложенная команда: 3 байта ASCII или кадр 0x81 / 0x83 (n байт)
+  -1 xor всех предыдущих байтов
+Хаб не шлёт "rdy", а отвечает 3 байтами: "ak"+seq — выполнена по порядку,
+"gp"+seq — выполнена, но перед ней были потерянные, "st"+seq — устаревшая
+(номер не новее последнего), не выполнена.
+"""
+
+from __future__ import annotations
+
+from functools import reduce
+from typing import Tuple
+
+from cave_config import CMD_CENTER, CMD_LEFT, CMD_RIGHT
+
+FRAME_DRIVE_STEER = 0x81
+FRAME_SEQUENCED = 0x82
+FRAME_ARC = 0x83
+FRAME_LEN = {FRAME_DRIVE_STEER: 6, FRAME_ARC: 4}
+SYNC_FLAG = 0x80
+
+# Ответы хаба на кадр 0x82
+SEQ_ACK = b"ak"
+SEQ_GAP = b"gp"
+SEQ_STALE = b"st"
+
+# Мощности хаба по умолчанию (DRIVE_DC и TURN_STRENGTH в spike_server.py)
+HUB_DRIVE_DC = 55
+HUB_TURN_STRENGTH = 55
+
+# Значения привода — по смыслу команд хаба (CMD_FWD в cave_config = b"rev")
+DRIVE_VALUES = {b"fwd": 1, b"rev": -1, b"stp": 0}
+STEER_VALUES = {CMD_LEFT: -1, CMD_CENTER: 0, CMD_RIGHT: 1}
+
+
+def _xor(data: bytes) -> int:
+    return reduce(lambda a, b: a ^ b, data, 0)
+
+
+def _int8(b: int) -> int:
+    return b - 256 if b > 127 else b
+
+
+def encode_drive_steer(drive_cmd: bytes, steer_cmd: bytes, drive_power: int = 0, turn_power: int = 0) -> bytes:
+    """Кадр 0x81 из пары 3-байтных команд привода и руля"""
+    if drive_cmd not in DRIVE_VALUES or steer_cmd not in STEER_VALUES:
+        raise ValueError(f"not a drive/steer pair: {drive_cmd!r}, {steer_cmd!r}")
+    if not (0 <= drive_power <= 100 and 0 <= turn_power <= 100):
+        raise ValueError("power must be within 0..100")
+    body = bytes((FRAME_DRIVE_STEER, DRIVE_VALUES[drive_cmd] & 0xFF, STEER_VALUES[steer_cmd] & 0xFF,
+                  drive_power, turn_power))
+    return body + bytes((_xor(body),))
+
+
+def decode_drive_steer(frame: bytes):
+    """(drive, steer, dpow, tpow) из кадра 0x81; ValueError при ошибке"""
+    if len(frame) != FRAME_LEN[FRAME_DRIVE_STEER] or frame[0] != FRAME_DRIVE_STEER:
+        raise ValueError("not a drive/steer frame")
+    if _xor(frame[:5]) != frame[5]:
+        raise ValueError("checksum mismatch")
+    return _int8(frame[1]), _int8(frame[2]), frame[3], frame[4]
+
+
+def encode_arc(speed: int, steer: int) -> bytes:
+    """Кадр 0x83: мощность движения и руля в процентах хаба, -100..100"""
+    if not (-100 <= speed <= 100 and -100 <= steer <= 100):
+        raise ValueError("speed/steer must be within -100..100")
+    body = bytes((FRAME_ARC, speed & 0xFF, steer & 0xFF))
+    return body + bytes((_xor(body),))
+
+
+def decode_arc(frame: bytes):
+    """(speed, steer) из кадра 0x83; ValueError при ошибке"""
+    frame = bytes(frame)
+    if len(frame) != FRAME_LEN[FRAME_ARC] or frame[0] != FRAME_ARC:
+        raise ValueError("not an arc frame")
+    if _xor(frame[:3]) != frame[3]:
+        raise ValueError("checksum mismatch")
+    return _int8(frame[1]), _int8(frame[2])
+
+
+def is_arc(payload: bytes) -> bool:
+    return len(payload) == FRAME_LEN[FRAME_ARC] and payload[0] == FRAME_ARC
+
+
+def encode_sequenced(seq: int, inner: bytes, sync: bool = False) -> bytes:
+    """Кадр 0x82: команда или кадр 0x81 с номером seq"""
+    inner = bytes(inner)
+    if not 0 < len(inner) < SYNC_FLAG:
+        raise ValueError("inner command too long")
+    body = bytes((FRAME_SEQUENCED, seq & 0xFF, len(inner) | (SYNC_FLAG if sync else 0))) + inner
+    return body + bytes((_xor(body),))
+
+
+def decode_sequenced(frame: bytes):
+    """(seq, sync, вложенная команда) из кадра 0x82; ValueError при ошибке"""
+    frame = bytes(frame)
+    if len(frame) < 5 or frame[0] != FRAME_SEQUENCED or len(frame) != 4 + (frame[2] & 0x7F):
+        raise ValueError("not a sequenced frame")
+    if _xor(frame[:-1]) != frame[-1]:
+        raise ValueError("checksum mismatch")
+    return frame[1], bool(frame[2] & SYNC_FLAG), frame[3:-1]
+
+
+def seq_newer(a: int, b: int) -> bool:
+    """a новее b по кругу 0..255 (в пределах половины круга)"""
+    return 0 < ((a - b) & 0xFF) < 128
+
+
+def describe(payload: bytes) -> str:
+    """
+    Читаемое имя отправленной команды: "stp", "rev+lft" для кадра 0x81,
+    "arc-40/+12" для кадра 0x83; у кадра 0x82 — имя вложенной команды
+    """
+    payload = bytes(payload)
+    if payload and payload[0] == FRAME_SEQUENCED:
+        try:
+            return describe(decode_sequenced(payload)[2])
+        except ValueError:
+            return "bad-frame"
+    if payload and payload[0] == FRAME_DRIVE_STEER:
+        try:
+            drive, steer, _, _ = decode_drive_steer(payload)
+        except ValueError:
+            return "bad-frame"
+        names = {v: k for k, v in DRIVE_VALUES.items()}, {v: k for k, v in STEER_VALUES.items()}
+        return "+".join(n.get(v, b"?").decode() for n, v in zip(names, (drive, steer)))
+    if payload and payload[0] == FRAME_ARC:
+        try:
+            return "arc%+d/%+d" % decode_arc(payload)
+        except ValueError:
+            return "bad-frame"
+    return payload.decode("ascii", "replace")
+
+
+def hub_powers(payload: bytes) -> Tuple[int, int]:
+    """
+    Мощности (левый, правый) моторов хаба после команды — как их выставит
+    spike_server.py; неизвестная команда и битый кадр останавливают моторы
+    """
+    payload = bytes(payload)
+    dc, turn = HUB_DRIVE_DC, HUB_TURN_STRENGTH
+    try:
+        if payload and payload[0] == FRAME_SEQUENCED:
+            return hub_powers(decode_sequenced(payload)[2])
+        if payload and payload[0] == FRAME_DRIVE_STEER:
+            drive, steer, dpow, tpow = decode_drive_steer(payload)
+            dpow, tpow = dpow or dc, tpow or turn
+            left, right = drive * dpow + steer * tpow, drive * dpow - steer * tpow
+        elif payload and payload[0] == FRAME_ARC:
+            speed, steer = decode_arc(payload)
+            left, right = speed + steer, speed - steer
+        else:
+            left, right = {b"fwd": (dc, dc), b"ctr": (dc, dc), b"rev": (-dc, -dc),
+                           b"lft": (-turn, turn), b"rgt": (turn, -turn)}.get(payload, (0, 0))
+    except ValueError:
+        return 0, 0
+    return max(-100, min(100, left)), max(-100, min(100, right))
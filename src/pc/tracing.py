@@ -0,0 +1,162 @@
+"""
+Tracing - путь от кадра до мотора для каждой команды BLE
+========================================================
+
+Каждая команда автопилота несёт метку кадра, по которому принято
+решение (frame_id и время захвата). SpikeBLEController дописывает
+времена постановки в очередь, записи GATT и ответов хаба:
+
+  захват кадра → решение → очередь → запись GATT → "OK " → "rdy"
+
+("OK " может прийти ещё до подтверждения записи, поэтому участок
+hub_ack отсчитывается от начала записи.)
+
+Tracer копит завершённые трассы, считает распределения задержек по
+участкам (в том числе «стекло → мотор»: захват → подтверждение хаба)
+и сохраняет их в формате Chrome Trace Event (chrome://tracing, Perfetto).
+Все времена — time.time(), как у CaptureThread.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from metrics import Registry
+from spike_protocol import describe
+
+
+@dataclass(frozen=True)
+class CommandTag:
+    """Происхождение команды: кадр и момент решения"""
+    frame_id: int = -1
+    capture_ts: float = 0.0
+    decision_ts: float = 0.0
+
+
+@dataclass
+class CommandTrace:
+    cmd: bytes
+    tag: CommandTag
+    queued_ts: float
+    write_ts: float = 0.0       # начало write_gatt_char
+    written_ts: float = 0.0     # запись подтверждена
+    ack_ts: float = 0.0         # ответ "OK " от хаба
+    ready_ts: float = 0.0       # хаб снова готов ("rdy")
+    status: str = "ok"          # ok | no_rdy | send_error | dropped | lost | stale
+
+    @property
+    def from_frame(self) -> bool:
+        return self.tag.frame_id >= 0
+
+
+# Участки: (имя, начало, конец); для ручных команд кадровые участки пропускаются
+SPANS = (
+    ("frame_to_decision", "capture_ts", "decision_ts"),
+    ("decision_to_queue", "decision_ts", "queued_ts"),
+    ("queue_wait", "queued_ts", "write_ts"),
+    ("gatt_write", "write_ts", "written_ts"),
+    ("hub_ack", "write_ts", "ack_ts"),
+    ("hub_ready", "ack_ts", "ready_ts"),
+)
+TOTALS = (
+    ("glass_to_write", "capture_ts", "written_ts"),
+    ("glass_to_motor", "capture_ts", "ack_ts"),
+    ("decision_to_motor", "decision_ts", "ack_ts"),
+)
+
+
+def _ts(trace: CommandTrace, field: str) -> float:
+    if field in ("capture_ts", "decision_ts"):
+        return getattr(trace.tag, field)
+    return getattr(trace, field)
+
+
+def _span(trace: CommandTrace, start: str, end: str) -> Optional[float]:
+    a, b = _ts(trace, start), _ts(trace, end)
+    return b - a if a > 0 and b > 0 else None
+
+
+class Tracer:
+    """Кольцевой буфер завершённых трасс; гистограммы в metrics (если задан)"""
+
+    def __init__(self, capacity: int = 20000, metrics: Optional[Registry] = None):
+        self._traces: deque = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._hist = {}
+        if metrics is not None:
+            for name, _, _ in TOTALS:
+                self._hist[name] = metrics.histogram(f"trace_{name}_ms", f"Трасса команд: {name}")
+
+    def begin(self, cmd: bytes, tag: Optional[CommandTag], queued_ts: float) -> CommandTrace:
+        return CommandTrace(bytes(cmd), tag or CommandTag(), queued_ts)
+
+    def complete(self, trace: CommandTrace):
+        with self._lock:
+            self._traces.append(trace)
+        if trace.status == "ok":
+            for name, start, end in TOTALS:
+                d = _span(trace, start, end)
+                if d is not None and name in self._hist:
+                    self._hist[name].observe(d * 1000.0)
+
+    def traces(self) -> List[CommandTrace]:
+        with self._lock:
+            return list(self._traces)
+
+    def latencies(self) -> Dict[str, np.ndarray]:
+        """Длительности участков и итогов (мс) по успешным командам от кадров"""
+        out = {}
+        done = [t for t in self.traces() if t.status == "ok" and t.from_frame]
+        for name, start, end in SPANS + TOTALS:
+            vals = [_span(t, start, end) for t in done]
+            out[name] = np.array([v * 1000.0 for v in vals if v is not None])
+        return out
+
+    def summary(self) -> str:
+        traces = self.traces()
+        statuses: Dict[str, int] = {}
+        for t in traces:
+            statuses[t.status] = statuses.get(t.status, 0) + 1
+        lines = [f"commands traced: {len(traces)}  " + "  ".join(f"{k} {v}" for k, v in sorted(statuses.items()))]
+        for name, ms in self.latencies().items():
+            if ms.size:
+                p50, p95, p99 = np.percentile(ms, (50, 95, 99))
+                lines.append(f"  {name:<18} p50 {p50:8.1f}  p95 {p95:8.1f}  p99 {p99:8.1f} ms  (n={ms.size})")
+        return "\n".join(lines)
+
+    def dump_chrome(self, path: Path) -> int:
+        """
+        Трассы в Chrome Trace Event JSON: каждая команда — асинхронный
+        трек (id), участки — вложенные события. Возвращает число команд.
+        """
+        traces = self.traces()
+        events = []
+        for i, t in enumerate(traces):
+            cmd = describe(t.cmd)
+            name = f"{cmd} #{t.tag.frame_id}" if t.from_frame else f"{cmd} (manual)"
+            first = t.tag.capture_ts if t.from_frame else t.queued_ts
+            last = max(t.ready_ts, t.ack_ts, t.written_ts, t.write_ts, t.queued_ts)
+            args = {"frame_id": t.tag.frame_id, "status": t.status}
+            events.append(_async("b", name, i, first, args))
+            for span, start, end in SPANS:
+                a, b = _ts(t, start), _ts(t, end)
+                if a > 0 and b > 0:
+                    events.append(_async("b", span, i, a))
+                    events.append(_async("e", span, i, b))
+            events.append(_async("e", name, i, last))
+        Path(path).write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}), encoding="utf-8")
+        return len(traces)
+
+
+def _async(ph: str, name: str, tid: int, ts: float, args: Optional[dict] = None) -> dict:
+    ev = {"name": name, "cat": "ble", "ph": ph, "id": tid, "pid": 1, "tid": 1, "ts": ts * 1e6}
+    if args:
+        ev["args"] = args
+    return ev
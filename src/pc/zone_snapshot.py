@@ -0,0 +1,79 @@
+"""
+Zone Snapshot - неизменяемые результаты зон для автопилота
+==========================================================
+
+Поток обработки публикует каждый результат инференса одним снимком
+ZoneSnapshot (номер, кадр, время захвата и публикации, доли зон) в
+ZoneBoard; автопилот ждёт на условии появления снимка новее уже
+виденного, а не опрашивает поля конвейера по таймеру. Читатели из других
+потоков (UI, метрики) берут latest() — снимок заменяется целиком.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    # inference тянет torch — только для аннотаций
+    from inference import InferenceResult
+
+
+@dataclass(frozen=True)
+class ZoneSnapshot:
+    seq: int = 0
+    frame_id: int = -1
+    capture_ts: float = 0.0
+    published_ts: float = 0.0
+    oL: float = 0.0
+    oC: float = 0.0
+    oR: float = 0.0
+    safe_ratio: float = 0.0
+    obst_ratio: float = 0.0
+    # Исходный результат (сетка зон, компактная маска); после публикации не изменяется
+    result: Optional[InferenceResult] = None
+
+    def age(self, now: Optional[float] = None) -> float:
+        """Возраст по времени захвата кадра, сек (inf — снимков ещё не было)"""
+        if self.capture_ts <= 0:
+            return float("inf")
+        return (time.time() if now is None else now) - self.capture_ts
+
+
+EMPTY = ZoneSnapshot()
+
+
+class ZoneBoard:
+    """Последний снимок зон; wait_newer() блокируется до публикации нового"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._snapshot = EMPTY
+        self._closed = False
+
+    def publish(self, result: InferenceResult) -> ZoneSnapshot:
+        with self._cond:
+            snap = ZoneSnapshot(
+                seq=self._snapshot.seq + 1, frame_id=result.frame_id, capture_ts=result.capture_ts,
+                published_ts=time.time(), oL=result.oL, oC=result.oC, oR=result.oR,
+                safe_ratio=result.safe_ratio, obst_ratio=result.obst_ratio, result=result)
+            self._snapshot = snap
+            self._cond.notify_all()
+            return snap
+
+    def latest(self) -> ZoneSnapshot:
+        return self._snapshot
+
+    def wait_newer(self, seq: int, timeout: Optional[float] = None) -> Optional[ZoneSnapshot]:
+        """Снимок с номером больше seq или None по таймауту / при закрытии"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._snapshot.seq > seq or self._closed, timeout)
+            return self._snapshot if self._snapshot.seq > seq else None
+
+    def close(self):
+        """Разбудить ожидающих при остановке"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
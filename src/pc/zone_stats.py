@@ -0,0 +1,125 @@
+"""
+Zone Stats - статистика препятствий по зонам через интегральное изображение
+===========================================================================
+
+Одно интегральное изображение (summed-area table) на маску; после этого
+доля препятствий в любом прямоугольнике считается за O(1) по четырём
+углам. Сетка N×M внутри полосы ROI считается одним векторным запросом,
+поэтому мелкие сетки (например 7 колонок × 3 полосы глубины) и весовые
+карты стоимости не требуют повторного прохода по маске.
+
+Работает с numpy-масками (cv2.integral) и с torch-тензорами на устройстве
+модели (cumsum); на хост возвращаются только суммы ячеек.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+
+@dataclass(frozen=True)
+class ZoneGrid:
+    """
+    Сетка rows×cols внутри прямоугольника ROI (доли высоты/ширины кадра).
+
+    Границы ячеек целочисленные, остаток от деления уходит в последнюю
+    строку/колонку — так сетка 1×3 совпадает с исходным zone_ratios.
+    weights — необязательная карта стоимости rows×cols для cost().
+    """
+    rows: int = 1
+    cols: int = 3
+    y1: float = 0.55
+    y2: float = 0.95
+    x1: float = 0.0
+    x2: float = 1.0
+    weights: Optional[Tuple[Tuple[float, ...], ...]] = None
+
+    def bounds(self, h: int, w: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Границы ячеек: ys (rows+1), xs (cols+1) в пикселях"""
+        return (_split(int(h * self.y1), int(h * self.y2), self.rows),
+                _split(int(w * self.x1), int(w * self.x2), self.cols))
+
+    def weight_array(self) -> np.ndarray:
+        if self.weights is None:
+            return np.ones((self.rows, self.cols), dtype=np.float64)
+        wts = np.asarray(self.weights, dtype=np.float64)
+        if wts.shape != (self.rows, self.cols):
+            raise ValueError(f"weights shape {wts.shape} != {(self.rows, self.cols)}")
+        return wts
+
+
+def _split(a: int, b: int, n: int) -> np.ndarray:
+    step = (b - a) // n
+    edges = a + step * np.arange(n + 1)
+    edges[-1] = b
+    return edges
+
+
+class ZoneStats:
+    """
+    Интегральное изображение карты препятствий (2D, значения 0/1 или веса).
+
+    Для torch-тензора интеграл строится на его устройстве.
+    """
+
+    def __init__(self, obstacle_map):
+        self.h, self.w = obstacle_map.shape[:2]
+        if isinstance(obstacle_map, np.ndarray):
+            src = obstacle_map
+            if src.dtype == bool:
+                src = src.view(np.uint8)
+            sdepth = cv2.CV_32S if src.dtype == np.uint8 else cv2.CV_64F
+            self.ii = cv2.integral(src, sdepth=sdepth)
+            self._torch = False
+        else:
+            import torch
+            dtype = torch.int32 if not obstacle_map.is_floating_point() else torch.float64
+            ii = obstacle_map.to(dtype).cumsum(0, dtype=dtype).cumsum(1, dtype=dtype)
+            self.ii = torch.nn.functional.pad(ii, (1, 0, 1, 0))
+            self._torch = True
+
+    def _corners(self, ys: Sequence[int], xs: Sequence[int]) -> np.ndarray:
+        """Значения интеграла в узлах сетки ys × xs (на хосте)"""
+        if self._torch:
+            import torch
+            dev = self.ii.device
+            yi = torch.as_tensor(np.asarray(ys), device=dev)
+            xi = torch.as_tensor(np.asarray(xs), device=dev)
+            return self.ii.index_select(0, yi).index_select(1, xi).cpu().numpy()
+        return self.ii[np.ix_(ys, xs)]
+
+    def total(self) -> float:
+        return float(self._corners([self.h], [self.w])[0, 0])
+
+    def rect_sum(self, y0: int, y1: int, x0: int, x1: int) -> float:
+        c = self._corners([y0, y1], [x0, x1]).astype(np.float64)
+        return float(c[1, 1] - c[0, 1] - c[1, 0] + c[0, 0])
+
+    def rect_ratio(self, y0: int, y1: int, x0: int, x1: int) -> float:
+        area = (y1 - y0) * (x1 - x0)
+        return self.rect_sum(y0, y1, x0, x1) / area if area > 0 else float("nan")
+
+    def cell_sums(self, ys: np.ndarray, xs: np.ndarray) -> np.ndarray:
+        """Суммы всех ячеек сетки одним запросом: (len(ys)-1)×(len(xs)-1)"""
+        c = self._corners(ys, xs).astype(np.float64)
+        return c[1:, 1:] - c[:-1, 1:] - c[1:, :-1] + c[:-1, :-1]
+
+    def grid(self, grid: ZoneGrid) -> np.ndarray:
+        """Доли препятствий в ячейках сетки rows×cols (nan для пустых ячеек)"""
+        ys, xs = grid.bounds(self.h, self.w)
+        areas = np.outer(np.diff(ys), np.diff(xs)).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.cell_sums(ys, xs) / areas
+
+    def cost(self, grid: ZoneGrid, ratios: Optional[np.ndarray] = None) -> float:
+        """Взвешенная стоимость сетки: Σ w·ratio / Σ w"""
+        if ratios is None:
+            ratios = self.grid(grid)
+        wts = grid.weight_array()
+        valid = ~np.isnan(ratios)
+        denom = wts[valid].sum()
+        return float((ratios[valid] * wts[valid]).sum() / denom) if denom else float("nan")
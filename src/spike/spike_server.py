@@ -12,6 +12,18 @@ SPIKE Prime / Pybricks BLE Server для управления роботом-т
   ctr - ехать прямо (центр)
   bye - завершение работы
 
+Двоичные кадры (первый байт со старшим битом, длина — по FRAME_LEN):
+  0x81 drive steer dpow tpow xor - привод и руль одной записью
+       drive/steer: int8 (-1, 0, +1), dpow/tpow: 0..100 (0 - по умолчанию),
+       xor - контрольная сумма байтов 0..4
+       Моторы: левый = drive*dpow + steer*tpow, правый = drive*dpow - steer*tpow
+  0x83 speed steer xor - дуга с плавным рулём (планировщик автопилота)
+       speed/steer: int8 -100..100 в процентах мощности
+       Моторы: левый = speed + steer, правый = speed - steer
+  0x82 seq len cmd.. xor - команда (3 байта или кадр 0x81/0x83) с номером seq
+       len: бит 7 - sync, биты 0..6 - длина вложенной команды
+       Ответ без "rdy": "ak"+seq, "gp"+seq (были пропуски), "st"+seq (устарела)
+"""
 
 from pybricks.pupdevices import Motor, UltrasonicSensor
 from pybricks.parameters import Port, Stop, Direction
@@ -95,6 +107,164 @@ def stop_motors():
     right_motor.stop()
 
 
+def clamp(power):
+    """Ограничить мощность диапазоном -100..100"""
+    return max(-100, min(100, power))
+
+
+def int8(b):
+    """Байт как знаковое число"""
+    return b - 256 if b > 127 else b
+
+
+def drive_steer(drive, steer, drive_power, turn_power):
+    """
+    Привод и руль одновременно (кадр 0x81)
+
+    Args:
+        drive: +1 вперёд, -1 назад, 0 на месте
+        steer: -1 налево, +1 направо, 0 прямо
+        drive_power, turn_power: мощности (0 - DRIVE_DC / TURN_STRENGTH)
+    """
+    drive_power = drive_power or DRIVE_DC
+    turn_power = turn_power or TURN_STRENGTH
+    if drive == 0 and steer == 0:
+        stop_motors()
+        return
+    tank_drive(clamp(drive * drive_power + steer * turn_power),
+               clamp(drive * drive_power - steer * turn_power))
+
+
+def arc(speed, steer):
+    """
+    Дуга с непрерывным рулём (кадр 0x83)
+
+    Args:
+        speed: мощность движения -100..100 (+ вперёд в смысле fwd)
+        steer: разность мощностей -100..100 (- налево, + направо)
+    """
+    if speed == 0 and steer == 0:
+        stop_motors()
+        return
+    tank_drive(clamp(speed + steer), clamp(speed - steer))
+
+
+def run_command(cmd):
+    """Выполнить 3-байтную команду; возвращает ответ хаба"""
+    if cmd == b"fwd":
+        # Команда: ехать вперёд
+        drive_forward()
+        return b"OK "
+    
+    elif cmd == b"rev":
+        # Команда: ехать назад
+        drive_backward()
+        return b"OK "
+    
+    elif cmd == b"stp":
+        # Команда: стоп
+        stop_motors()
+        return b"OK "
+    
+    elif cmd == b"lft":
+        # Команда: поворот налево на месте
+        turn_left()
+        return b"OK "
+    
+    elif cmd == b"rgt":
+        # Команда: поворот направо на месте
+        turn_right()
+        return b"OK "
+    
+    elif cmd == b"ctr":
+        # Команда: ехать прямо (центр)
+        drive_straight()
+        return b"OK "
+    
+    elif cmd == b"bye":
+        # Команда: завершить работу
+        stop_motors()
+        return b"BYE"
+    
+    # Неизвестная команда
+    stop_motors()
+    return b"???"
+
+
+# ═══════════════════════════════════════════════════════════════
+#   ДВОИЧНЫЕ КАДРЫ
+# ═══════════════════════════════════════════════════════════════
+
+FRAME_DRIVE_STEER = 0x81
+FRAME_ARC = 0x83
+
+# Полная длина кадра по первому байту
+FRAME_LEN = {FRAME_DRIVE_STEER: 6, FRAME_ARC: 4}
+
+
+def handle_frame(frame):
+    """Выполнить двоичный кадр; возвращает ответ хаба"""
+    checksum = 0
+    for b in frame[:-1]:
+        checksum ^= b
+    if checksum != frame[-1]:
+        stop_motors()
+        return b"ERR"
+
+    if frame[0] == FRAME_DRIVE_STEER:
+        drive_steer(int8(frame[1]), int8(frame[2]), frame[3], frame[4])
+        return b"OK "
+    if frame[0] == FRAME_ARC:
+        arc(clamp(int8(frame[1])), clamp(int8(frame[2])))
+        return b"OK "
+
+    stop_motors()
+    return b"???"
+
+
+# ═══════════════════════════════════════════════════════════════
+#   КОНВЕЙЕР: КАДРЫ С НОМЕРОМ
+# ═══════════════════════════════════════════════════════════════
+
+FRAME_SEQUENCED = 0x82
+SYNC_FLAG = 0x80
+
+# Номер последней выполненной команды (None - ещё не было)
+last_seq = None
+
+
+def handle_sequenced(frame):
+    """
+    Кадр 0x82: seq, флаги/длина, вложенная команда, xor.
+    Устаревшие номера не выполняются; пропуски выполняются, но
+    отмечаются ответом "gp". Возвращает (ответ, вложенная команда).
+    """
+    global last_seq
+    checksum = 0
+    for b in frame[:-1]:
+        checksum ^= b
+    if checksum != frame[-1] or len(frame) < 5 or len(frame) != 4 + (frame[2] & 0x7F):
+        stop_motors()
+        return b"ERR", b""
+
+    seq = frame[1]
+    inner = frame[3:-1]
+    if last_seq is None or frame[2] & SYNC_FLAG:
+        kind = b"ak"
+    else:
+        diff = (seq - last_seq) & 0xFF
+        if diff == 0 or diff >= 128:
+            return b"st" + bytes((seq,)), b""
+        kind = b"ak" if diff == 1 else b"gp"
+
+    last_seq = seq
+    if inner[0] in FRAME_LEN:
+        handle_frame(inner)
+    else:
+        run_command(inner)
+    return kind + bytes((seq,)), inner
+
+
 # ═══════════════════════════════════════════════════════════════
 #   ИНИЦИАЛИЗАЦИЯ
 # ═══════════════════════════════════════════════════════════════
@@ -130,53 +300,31 @@ while True:
         stdout.buffer.write(b"rdy")
         continue
     
-    # ─────────────────────────────────────────────────────────
-    # ОБРАБОТКА КОМАНД
-    # ─────────────────────────────────────────────────────────
-    
-    if cmd == b"fwd":
-        # Команда: ехать вперёд
-        drive_forward()
-        stdout.buffer.write(b"OK ")
-    
-    elif cmd == b"rev":
-        # Команда: ехать назад
-        drive_backward()
-        stdout.buffer.write(b"OK ")
-    
-    elif cmd == b"stp":
-        # Команда: стоп
-        stop_motors()
-        stdout.buffer.write(b"OK ")
-    
-    elif cmd == b"lft":
-        # Команда: поворот налево на месте
-        turn_left()
-        stdout.buffer.write(b"OK ")
+    # Кадр с номером: отвечаем "ak"/"gp"/"st" без "rdy" (конвейер)
+    if cmd[0] == FRAME_SEQUENCED:
+        rest = stdin.buffer.read(1 + (cmd[2] & 0x7F))
+        reply, inner = handle_sequenced(cmd + rest)
+        stdout.buffer.write(reply)
+        if inner == b"bye":
+            FLASHLIGHT.lights.off()
+            wait(300)  # Задержка перед выходом
+            break
+        continue
     
-    elif cmd == b"rgt":
-        # Команда: поворот направо на месте
-        turn_right()
-        stdout.buffer.write(b"OK ")
+    # Двоичный кадр: дочитываем остаток по таблице длин
+    if cmd[0] in FRAME_LEN:
+        rest = stdin.buffer.read(FRAME_LEN[cmd[0]] - 3)
+        stdout.buffer.write(handle_frame(cmd + rest))
+        stdout.buffer.write(b"rdy")
+        continue
     
-    elif cmd == b"ctr":
-        # Команда: ехать прямо (центр)
-        drive_straight()
-        stdout.buffer.write(b"OK ")
+    stdout.buffer.write(run_command(cmd))
     
-    elif cmd == b"bye":
-        # Команда: завершить работу
-        stop_motors()
-        stdout.buffer.write(b"BYE")
+    if cmd == b"bye":
         FLASHLIGHT.lights.off()
         wait(300)  # Задержка перед выходом
         break
     
-    else:
-        # Неизвестная команда
-        stop_motors()
-        stdout.buffer.write(b"???")
-    
     stdout.buffer.write(b"rdy")
 
 # ═══════════════════════════════════════════════════════════════